@@ -0,0 +1,91 @@
+"""Benchmark event loop latency while an archive is under heavy I/O.
+
+A ticker task sleeps 1 ms at a time and records how late it wakes up while
+--tasks tasks write and read back deflated members. "sync" calls
+SQLiteArchive directly from the coroutines, "async" uses
+AsyncSQLiteArchive.
+
+    $ python benchmarks/bench_aio_latency.py --tasks 8 --size 512 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+from pysqlar.aio import AsyncSQLiteArchive
+
+
+async def _ticker(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def _measure(work):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    cuts = statistics.quantiles(lags, n=100, method="inclusive")
+    return cuts[49] * 1e3, cuts[98] * 1e3, max(lags) * 1e3, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=8)
+    parser.add_argument("--size", type=int, default=512, help="member size in KiB")
+    parser.add_argument("--rounds", type=int, default=10, help="members per task")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 512).hex().encode()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_ar = SQLiteArchive(
+            os.path.join(tmp, "sync.sqlar"),
+            mode="rwc",
+            compression=SQLAR_DEFLATED
+        )
+
+        async def sync_task(i):
+            for j in range(args.rounds):
+                sync_ar.writestr("t{}/m{}".format(i, j), data)
+                sync_ar.read("t{}/m{}".format(i, j))
+                await asyncio.sleep(0)
+
+        async_ar = AsyncSQLiteArchive(
+            os.path.join(tmp, "async.sqlar"),
+            mode="rwc",
+            compression=SQLAR_DEFLATED
+        )
+
+        async def async_task(i):
+            for j in range(args.rounds):
+                await async_ar.writestr("t{}/m{}".format(i, j), data)
+                await async_ar.read("t{}/m{}".format(i, j))
+
+        print("{:>6} {:>12} {:>12} {:>12} {:>10}".format(
+            "", "lag p50 ms", "lag p99 ms", "lag max ms", "total s"))
+        for label, task in (("sync", sync_task), ("async", async_task)):
+            async def work():
+                await asyncio.gather(*(task(i) for i in range(args.tasks)))
+            print("{:>6} {:>12.2f} {:>12.2f} {:>12.2f} {:>10.2f}".format(
+                label, *await _measure(work)))
+
+        sync_ar.close()
+        await async_ar.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
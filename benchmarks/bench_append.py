@@ -0,0 +1,54 @@
+"""Benchmark appending small records to members of growing size.
+
+Every iteration appends --record bytes to a member of --size MiB with
+writestr(mode="ab") and commits. With segments the cost of an append
+should not depend on the size of the member, --rewrite measures the default
+of rewriting the member instead. "compact" is the time to merge the segments
+back into one blob.
+
+    $ python benchmarks/bench_append.py --size 1 16 64 --appends 500
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, nargs="+", default=[1, 16, 64], help="member size in MiB")
+    parser.add_argument("--appends", type=int, default=500)
+    parser.add_argument("--record", type=int, default=120, help="bytes per append")
+    parser.add_argument("--deflate", action="store_true", help="use a deflated archive")
+    parser.add_argument("--rewrite", action="store_true", help="rewrite the member instead of adding segments")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+    compression = SQLAR_DEFLATED if args.deflate else None
+
+    print("{:>10} {:>14} {:>12}".format("size MiB", "ms/append", "compact s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.size:
+            filename = os.path.join(tmp, "bench{}.sqlar".format(size))
+            with SQLiteArchive(filename, mode="rwc", compression=compression,
+                               append_segments=not args.rewrite) as ar:
+                ar.writestr("log", os.urandom(size << 20))
+                record = b"x" * (args.record - 1) + b"\n"
+                start = time.perf_counter()
+                for _ in range(args.appends):
+                    ar.writestr("log", record, mode="ab")
+                appended = time.perf_counter() - start
+                start = time.perf_counter()
+                ar.compact()
+                compacted = time.perf_counter() - start
+            print("{:>10} {:>14.3f} {:>12.3f}".format(size, appended * 1000 / args.appends, compacted))
+
+
+if __name__ == "__main__":
+    main()
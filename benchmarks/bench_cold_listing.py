@@ -0,0 +1,85 @@
+"""Benchmark listing metadata from an archive that isn't in the OS page cache.
+
+Compares a plain sqlar table, as written by other tools or by older versions,
+with the covering metadata indexes added when an archive is opened for
+writing, and with the deduplicated layout keeping entries in their own
+table. The archive file is dropped from the page cache with
+posix_fadvise(POSIX_FADV_DONTNEED) before each measurement.
+
+    $ python benchmarks/bench_cold_listing.py --members 10000 40000 --size 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive
+from pysqlar import archive
+
+
+def _rows(members, size):
+    for i in range(members):
+        yield "d{}/f{}.bin".format(i % 100, i), 0o644, 0, size, os.urandom(size)
+
+
+def _build(filename, layout, members, size):
+    if layout == "table":
+        with sqlite3.connect(filename) as conn:
+            conn.execute(archive._SQLAR_TABLE_SCHEMA)
+            conn.executemany(
+                "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, ?, ?, ?, ?)",
+                _rows(members, size)
+            )
+        conn.close()
+    else:
+        with SQLiteArchive(filename, mode="rwc", dedup=layout == "dedup") as ar:
+            ar.writemany((name, data) for name, _, _, _, data in _rows(members, size))
+
+
+def _drop_cache(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _cold(filename, fn):
+    _drop_cache(filename)
+    with SQLiteArchive(filename) as ar:
+        start = time.perf_counter()
+        fn(ar)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, nargs="+", default=[10000, 40000])
+    parser.add_argument("--size", type=int, default=4, help="member size in KiB")
+    args = parser.parse_args()
+
+    print("{:>8} {:>6} {:>8} {:>12} {:>12} {:>12}".format(
+        "members", "layout", "MiB", "infolist ms", "namelist ms", "scandir ms"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for members in args.members:
+            for layout in ("table", "index", "dedup"):
+                filename = os.path.join(tmp, "bench-{}-{}.sqlar".format(members, layout))
+                _build(filename, layout, members, args.size * 1024)
+                times = [
+                    _cold(filename, fn) * 1e3
+                    for fn in (SQLiteArchive.infolist, SQLiteArchive.namelist,
+                               lambda ar: ar.scandir("d42"))
+                ]
+                print("{:>8} {:>6} {:>8.1f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                    members, layout, os.path.getsize(filename) / 2**20, *times))
+                os.unlink(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark repeated reads of a hot set of small deflated members.
+
+    $ python benchmarks/bench_content_cache.py --members 50 --size 16 --reads 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def _bench(names, reads, read):
+    picks = [random.choice(names) for _ in range(reads)]
+    start = time.perf_counter()
+    for name in picks:
+        read(name)
+    return (time.perf_counter() - start) / reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--size", type=int, default=16, help="member size in KiB")
+    parser.add_argument("--reads", type=int, default=100000)
+    parser.add_argument("--budget", type=int, default=64, help="cache size in MiB")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.sqlar")
+        names = ["templates/t{}.html".format(i) for i in range(args.members)]
+        with SQLiteArchive(filename, mode="rwc", compression=SQLAR_DEFLATED) as ar:
+            ar.writemany(
+                (name, os.urandom(args.size * 512).hex().encode()) for name in names
+            )
+
+        print("{:>22} {:>10}".format("", "us/read"))
+        with SQLiteArchive(filename) as ar:
+            t = _bench(names, args.reads, ar.read)
+            print("{:>22} {:>10.1f}".format("read, no cache", t * 1e6))
+        with SQLiteArchive(filename, content_cache=args.budget * 1024 * 1024) as ar:
+            t = _bench(names, args.reads, ar.read)
+            print("{:>22} {:>10.1f}".format("read, cache", t * 1e6))
+            t = _bench(names, args.reads, ar.readview)
+            print("{:>22} {:>10.1f}".format("readview, cache", t * 1e6))
+            print(ar.content_cache_info())
+
+
+if __name__ == "__main__":
+    main()
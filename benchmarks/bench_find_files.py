@@ -0,0 +1,59 @@
+"""Benchmark sqlar.find_files() against archive size.
+
+Compares the old implementation, which fetched infolist() and compiled the
+pattern regex for every member, with matching in SQLite through
+SQLiteArchive.iterinfo().
+
+    $ python benchmarks/bench_find_files.py --members 100000 1000000 --pattern 'src/0/**/*.c'
+"""
+import argparse
+import fnmatch
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive
+
+
+def _old_find_files(archive, patterns):
+    for file in archive.infolist():
+        for pattern in patterns:
+            if re.compile(fnmatch.translate(pattern)).match(file[0]):
+                yield file
+
+
+def _time(fn):
+    start = time.perf_counter()
+    count = sum(1 for _ in fn())
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--pattern", nargs="+", default=["src/0/**/*.c"])
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>12} {:>12}".format("members", "matches", "old s", "sql s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for members in args.members:
+            filename = os.path.join(tmp, "bench-{}.sqlar".format(members))
+            extensions = [".c", ".h", ".o", ".txt"]
+            with SQLiteArchive(filename, mode="rwc", pragmas="bulk") as ar:
+                ar.writemany(
+                    ("src/{}/{}/f{}{}".format(i % 10, i % 1000, i, extensions[i % 4]), b"")
+                    for i in range(members)
+                )
+            with SQLiteArchive(filename) as ar:
+                old, count = _time(lambda: _old_find_files(ar, args.pattern))
+                new, _ = _time(lambda: ar.iterinfo(args.pattern))
+            print("{:>10} {:>10} {:>12.3f} {:>12.3f}".format(members, count, old, new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark SQLARFS metadata lookups with and without the metadata cache.
+
+Builds a tree --depth directories deep with --files files in each directory
+and times a full fs.walk, exists() on every file, both repeated --rounds
+times, and reading every file once, which checks all its parent
+directories.
+
+    $ python benchmarks/bench_fs_metadata.py --depth 12 --files 20
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyfs2_sqlar import SQLARFS
+
+logging.getLogger("pyfs2_sqlar").setLevel(logging.WARNING)
+
+
+def _build(filename, depth, files):
+    paths = []
+    with SQLARFS(filename) as fs:
+        path = ""
+        for level in range(depth):
+            path += "/dir{}".format(level)
+            fs.makedir(path)
+            for i in range(files):
+                paths.append("{}/file{}".format(path, i))
+                fs.writebytes(paths[-1], b"x")
+    return paths
+
+
+def _bench(filename, paths, metadata_cache, rounds):
+    with SQLARFS(filename, metadata_cache=metadata_cache) as fs:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            assert sum(1 for _ in fs.walk.files()) == len(paths)
+        walk = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            assert all(fs.exists(path) for path in paths)
+        exists = (time.perf_counter() - start) / rounds / len(paths)
+        start = time.perf_counter()
+        for path in paths:
+            fs.readbytes(path)
+        read = (time.perf_counter() - start) / len(paths)
+        return walk, exists, read, fs.file.metadata_cache_info()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.sqlar")
+        paths = _build(filename, args.depth, args.files)
+        print("{:>8} {:>10} {:>11} {:>13}  {}".format(
+            "cache", "walk ms", "exists us", "readbytes us", "cache info"))
+        for metadata_cache in (0, 4096):
+            walk, exists, read, info = _bench(filename, paths, metadata_cache, args.rounds)
+            print("{:>8} {:>10.2f} {:>11.1f} {:>13.1f}  {}".format(
+                metadata_cache, walk * 1e3, exists * 1e6, read * 1e6, info))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark listing one directory against archive size.
+
+An archive in the old layout is filled with N empty members spread over
+directories of --per-dir entries. Listing a directory is timed by filtering
+namelist() in Python (the cost of the old SQLARFS.listdir), with the name
+range scan used for archives opened read-only, and with the indexed parent
+column after the archive was migrated by opening it for writing.
+
+    $ python benchmarks/bench_listdir.py --members 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive
+from pysqlar.archive import _SQLAR_TABLE_SCHEMA
+
+
+def _fill(filename, members, per_dir):
+    with sqlite3.connect(filename) as conn:
+        conn.execute(_SQLAR_TABLE_SCHEMA)
+        dirs = (members + per_dir) // (per_dir + 1)
+        conn.executemany(
+            "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, 493, 0, 0, NULL)",
+            (("d{:06}".format(d),) for d in range(dirs))
+        )
+        conn.executemany(
+            "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, 420, 0, 0, x'')",
+            (("d{:06}/f{:06}".format(i // per_dir, i % per_dir),)
+             for i in range(members - dirs))
+        )
+    conn.close()
+    return dirs
+
+
+def _time(fn, dirs, lists):
+    paths = ["d{:06}".format(random.randrange(dirs)) for _ in range(lists)]
+    start = time.perf_counter()
+    for path in paths:
+        fn(path)
+    return (time.perf_counter() - start) / lists
+
+
+def _scan(ar, path):
+    return [name for name in ar.namelist() if os.path.dirname(name) == path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--per-dir", type=int, default=1000)
+    parser.add_argument("--lists", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:>10} {:>14} {:>14} {:>14} {:>14}".format(
+        "members", "scan ms", "range ms", "migrate s", "indexed ms"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for members in args.members:
+            filename = os.path.join(tmp, "bench-{}.sqlar".format(members))
+            dirs = _fill(filename, members, args.per_dir)
+            with SQLiteArchive(filename) as ar:
+                scan = _time(lambda path: _scan(ar, path), dirs, min(args.lists, 3))
+                ranged = _time(ar.listdir, dirs, args.lists)
+            start = time.perf_counter()
+            SQLiteArchive(filename, mode="rw").close()
+            migrate = time.perf_counter() - start
+            with SQLiteArchive(filename) as ar:
+                indexed = _time(ar.listdir, dirs, args.lists)
+            print("{:>10} {:>14.3f} {:>14.3f} {:>14.2f} {:>14.3f}".format(
+                members, scan * 1e3, ranged * 1e3, migrate, indexed * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark 4 KiB range reads against member size.
+
+Compares a standard deflated member with the same content stored in the
+chunked layout.
+
+    $ python benchmarks/bench_range_read.py --sizes 1 16 64 256
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def _content(size):
+    # Hex encoded random bytes compress roughly 2:1.
+    return os.urandom(size // 2).hex().encode()
+
+
+def _bench(ar, name, size, reads, length):
+    offsets = [random.randrange(0, size - length) for _ in range(reads)]
+    start = time.perf_counter()
+    for offset in offsets:
+        ar.read(name, offset + 1, offset + length)
+    return (time.perf_counter() - start) / reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 64],
+                        help="member sizes in MiB")
+    parser.add_argument("--reads", type=int, default=20)
+    parser.add_argument("--length", type=int, default=4096)
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    print("{:>10} {:>16} {:>16}".format("size MiB", "standard ms", "chunked ms"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for mib in args.sizes:
+            filename = os.path.join(tmp, "bench-{}.sqlar".format(mib))
+            data = _content(mib * 1024 * 1024)
+            with SQLiteArchive(filename, mode="rwc", compression=SQLAR_DEFLATED) as ar:
+                ar.writestr("standard", data)
+                ar.writestr("chunked", data, chunk_size=args.chunk_size)
+                del data
+                size = mib * 1024 * 1024
+                standard = _bench(ar, "standard", size, args.reads, args.length)
+                chunked = _bench(ar, "chunked", size, args.reads, args.length)
+            print("{:>10} {:>16.3f} {:>16.3f}".format(mib, standard * 1e3, chunked * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark small-member read latency of read-only and immutable archives.
+
+Times every read() and getinfo() of random small members and reports the
+median and 99th percentile, and the time taken to open the archive.
+
+    $ python benchmarks/bench_serve_latency.py --members 10000 --size 2 --reads 20000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def _percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return cuts[49] / 1e3, cuts[98] / 1e3
+
+
+def _latencies(fn, names):
+    samples = []
+    for name in names:
+        start = time.perf_counter_ns()
+        fn(name)
+        samples.append(time.perf_counter_ns() - start)
+    return _percentiles(samples)
+
+
+def _opens(filename, mode, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter_ns()
+        SQLiteArchive(filename, mode=mode).close()
+        samples.append(time.perf_counter_ns() - start)
+    return _percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=2, help="member size in KiB")
+    parser.add_argument("--reads", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.sqlar")
+        names = ["static/{}/f{}.js".format(i % 50, i) for i in range(args.members)]
+        with SQLiteArchive(filename, mode="rwc", compression=SQLAR_DEFLATED) as ar:
+            ar.writemany(
+                (name, os.urandom(args.size * 512).hex().encode()) for name in names
+            )
+
+        picks = random.choices(names, k=args.reads)
+        print("{:>10} {:>10} {:>20} {:>20} {:>20}".format(
+            "mode", "", "read us", "getinfo us", "open us"))
+        for mode in ("ro", "immutable"):
+            with SQLiteArchive(filename, mode=mode) as ar:
+                read = _latencies(ar.read, picks)
+                getinfo = _latencies(ar.getinfo, picks)
+            opened = _opens(filename, mode, 200)
+            for label, index in (("p50", 0), ("p99", 1)):
+                print("{:>10} {:>10} {:>20.1f} {:>20.1f} {:>20.1f}".format(
+                    mode, label, read[index], getinfo[index], opened[index]))
+
+
+if __name__ == "__main__":
+    main()
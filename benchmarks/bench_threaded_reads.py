@@ -0,0 +1,66 @@
+"""Benchmark concurrent reads of a pooled archive against thread count.
+
+Every thread reads random deflated members. "pooled" reads through the
+connection of each thread, "serialized" takes a lock around every read, as
+sharing a single connection between threads would.
+
+    $ python benchmarks/bench_threaded_reads.py --threads 1 2 4 8 --size 256
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def _bench(read, names, threads, reads):
+    def work(_):
+        for name in random.choices(names, k=reads):
+            read(name)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, range(threads)))
+    return threads * reads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256, help="member size in KiB")
+    parser.add_argument("--reads", type=int, default=200, help="reads per thread")
+    args = parser.parse_args()
+
+    print("{} CPUs".format(os.cpu_count()))
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.sqlar")
+        names = ["m{}".format(i) for i in range(args.members)]
+        with SQLiteArchive(filename, mode="rwc", compression=SQLAR_DEFLATED) as ar:
+            ar.writemany(
+                (name, os.urandom(args.size * 256).hex().encode()) for name in names
+            )
+
+        lock = threading.Lock()
+        print("{:>8} {:>14} {:>14}".format("threads", "pooled/s", "serialized/s"))
+        with SQLiteArchive(filename, pooled=True) as ar:
+            def serialized(name):
+                with lock:
+                    ar.read(name)
+
+            for threads in args.threads:
+                pooled = _bench(ar.read, names, threads, args.reads)
+                single = _bench(serialized, names, threads, args.reads)
+                print("{:>8} {:>14.0f} {:>14.0f}".format(threads, pooled, single))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark walking and globbing a SQLARFS.
+
+"generic" walks with fs.walk.Walker, which calls scandir once per
+directory. "sqlarfs" uses the walker and globber of SQLARFS, which read the
+whole tree with one query.
+
+    $ python benchmarks/bench_walk.py --dirs 500 --files 100
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fs.glob
+import fs.walk
+from pyfs2_sqlar import SQLARFS
+from pysqlar import SQLiteArchive
+
+
+def _time(fn):
+    start = time.perf_counter()
+    count = sum(1 for _ in fn())
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files", type=int, default=100, help="files per directory")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench.sqlar")
+        with SQLiteArchive(filename, mode="rwc", pragmas="bulk") as ar:
+            with ar.batch():
+                for d in range(args.dirs):
+                    directory = "/d{}/sub{}".format(d // 20, d)
+                    for name in (directory.rsplit("/", 1)[0], directory):
+                        ar.sql("INSERT OR IGNORE INTO sqlar(name, mode, mtime, sz) VALUES (?, 493, 0, 0)", name)
+                ar.writemany(
+                    ("/d{}/sub{}/f{}.{}".format(d // 20, d, f, "py" if f % 10 else "txt"), b"x")
+                    for d in range(args.dirs)
+                    for f in range(args.files)
+                )
+
+        with SQLARFS(filename) as sqlarfs:
+            generic = fs.walk.Walker()
+            cases = [
+                ("walk.files", lambda: generic.files(sqlarfs), lambda: sqlarfs.walk.files()),
+                ("walk.info", lambda: generic.info(sqlarfs, namespaces=["details"]),
+                 lambda: sqlarfs.walk.info(namespaces=["details"])),
+                ("glob", lambda: fs.glob.Globber(sqlarfs, "/d3/**/*.txt"),
+                 lambda: sqlarfs.glob("/d3/**/*.txt")),
+            ]
+            print("{:>12} {:>12} {:>12} {:>10}".format("", "generic s", "sqlarfs s", "entries"))
+            for label, slow, fast in cases:
+                slow_time, count = _time(slow)
+                fast_time, fast_count = _time(fast)
+                assert count == fast_count, (count, fast_count)
+                print("{:>12} {:>12.3f} {:>12.3f} {:>10}".format(label, slow_time, fast_time, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark small writes flushed to a large SQLARFS file.
+
+Every iteration overwrites --write bytes at a random offset of a stored
+member of --size MiB and flushes the file. The cost of a flush should depend
+on the amount of data written, not on the size of the member.
+
+    $ python benchmarks/bench_writer_flush.py --size 1 16 64 --flushes 200
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyfs2_sqlar import SQLARFS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, nargs="+", default=[1, 16, 64], help="member size in MiB")
+    parser.add_argument("--flushes", type=int, default=200)
+    parser.add_argument("--write", type=int, default=100, help="bytes written before each flush")
+    args = parser.parse_args()
+    logging.disable(logging.DEBUG)
+
+    print("{:>10} {:>14}".format("size MiB", "ms/flush"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.size:
+            with SQLARFS(os.path.join(tmp, "bench{}.sqlar".format(size))) as fs:
+                fs.writebytes("file", os.urandom(size << 20))
+                rnd = random.Random(0)
+                with fs.openbin("file", "r+") as f:
+                    start = time.perf_counter()
+                    for _ in range(args.flushes):
+                        f.seek(rnd.randrange((size << 20) - args.write))
+                        f.write(os.urandom(args.write))
+                        f.flush()
+                    elapsed = time.perf_counter() - start
+            print("{:>10} {:>14.3f}".format(size, elapsed * 1000 / args.flushes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark ingest throughput of many producer processes.
+
+Every producer process writes --members deflated members. "direct" opens
+the archive in each producer and calls writestr(), retrying when SQLite
+reports the database as locked. "service" sends the members to an
+ArchiveWriterService which commits them in groups.
+
+    $ python benchmarks/bench_writer_service.py --producers 1 2 4 8 16 32 --members 200
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+from pysqlar.service import ArchiveWriterClient, ArchiveWriterService
+
+
+def _payload(i, j, size):
+    return ("producer {} member {}\n".format(i, j) * (size * 1024 // 24)).encode()
+
+
+def _direct(filename, i, members, size, start, retries):
+    start.wait()
+    with SQLiteArchive(filename, mode="rw", compression=SQLAR_DEFLATED) as ar:
+        for j in range(members):
+            while True:
+                try:
+                    ar.writestr("p{}/m{}".format(i, j), _payload(i, j, size))
+                    break
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    with retries.get_lock():
+                        retries.value += 1
+
+
+def _client(address, i, members, size, start, retries):
+    start.wait()
+    with ArchiveWriterClient(address, compression=SQLAR_DEFLATED) as client:
+        for j in range(members):
+            client.writestr("p{}/m{}".format(i, j), _payload(i, j, size))
+
+
+def _run(target, args, producers, members, size):
+    start = multiprocessing.Event()
+    retries = multiprocessing.Value("i", 0)
+    processes = [
+        multiprocessing.Process(target=target, args=(*args, i, members, size, start, retries))
+        for i in range(producers)
+    ]
+    for process in processes:
+        process.start()
+    began = time.perf_counter()
+    start.set()
+    for process in processes:
+        process.join()
+    return producers * members / (time.perf_counter() - began), retries.value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--producers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--members", type=int, default=200, help="members per producer")
+    parser.add_argument("--size", type=int, default=4, help="member size in KiB")
+    args = parser.parse_args()
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:>10} {:>14} {:>10} {:>14}".format(
+        "producers", "direct/s", "retries", "service/s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for producers in args.producers:
+            filename = os.path.join(tmp, "direct{}.sqlar".format(producers))
+            SQLiteArchive(filename, mode="rwc").close()
+            direct, retries = _run(_direct, (filename,), producers, args.members, args.size)
+
+            filename = os.path.join(tmp, "service{}.sqlar".format(producers))
+            address = os.path.join(tmp, "service.sock")
+            with ArchiveWriterService(filename, address) as service:
+                thread = threading.Thread(target=service.serve_forever, args=(0.05,))
+                thread.start()
+                served, _ = _run(_client, (address,), producers, args.members, args.size)
+                service.shutdown()
+                thread.join()
+
+            print("{:>10} {:>14.0f} {:>10} {:>14.0f}".format(
+                producers, direct, retries, served))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Benchmark the cost of a single writestr() against archive size.
+
+The archive is pre-filled with N members, then the time of further
+writestr() calls is measured. The per-write cost should stay flat as N
+grows.
+
+    $ python benchmarks/bench_writestr_scaling.py --members 1000 10000 100000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pysqlar import SQLiteArchive, SQLAR_DEFLATED
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    data = b"Hello World!\n" * 20
+    print("{:>10} {:>16}".format("members", "us/writestr"))
+    for members in args.members:
+        # In memory so that fsync doesn't hide the cost of the statements.
+        with SQLiteArchive(":memory:", compression=SQLAR_DEFLATED) as ar:
+            ar.writemany(("file{}".format(i), data) for i in range(members))
+            start = time.perf_counter()
+            for i in range(args.writes):
+                ar.writestr("new{}".format(i), data)
+            elapsed = time.perf_counter() - start
+        print("{:>10} {:>16.1f}".format(members, elapsed / args.writes * 1e6))
+
+
+if __name__ == "__main__":
+    main()
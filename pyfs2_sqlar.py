@@ -1,8 +1,12 @@
 from inspect import trace
+import bisect
 import io
 import logging
 import os
 import sys
+import threading
+import time
+from heapq import heappop, heappush
 
 from collections import namedtuple
 from contextlib import contextmanager
@@ -12,12 +16,15 @@ import traceback
 import fs # ResourceType
 import fs.errors as fse # ResouceNotFound
 import fs.base as fsb # FS
+import fs.glob as fsg
 import fs.info as fsi # Info
+import fs.iotools as fsio
 import fs.mode as fsm
 import fs.path as fsp
 import fs.subfs as sfs
+import fs.walk as fsw
 import sqlar
-from pysqlar import SQLiteArchive
+from pysqlar import SQLAR_DEFLATED, SQLAR_STORED, SQLiteArchive
 
 
 logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
@@ -32,14 +39,216 @@ def getsplit(text, max, start=0):
     return len(r), start + len(r), r
 
 
+def _parent(name):
+    """The directory containing member *name*, as the `parent` column of the
+    archive computes it."""
+    head, sep, _ = name.rpartition('/')
+    if not sep:
+        return ''
+    return head or '/'
+
+
+def _subtree_end(name):
+    """The first name sorted after all the members inside directory *name*."""
+    prefix = name if name == '/' else name + '/'
+    return prefix[:-1] + '0'
+
+
+class SQLARWalker(fsw.Walker):
+    """Walks a SQLARFS with a single query instead of a scandir per
+    directory.
+
+    The members below the walked directory are read from
+    `SQLiteArchive.itertree`, which applies *max_depth* and the *filter*
+    patterns. Directories are still opened, excluded and filtered by the
+    checks of `fs.walk.Walker`, other filesystems are walked by it.
+
+    *patterns* are additional fnmatch patterns on the whole path that files
+    must match, they only narrow the query and are not checked again.
+    """
+
+    def __init__(self, patterns=None, **kwargs):
+        super().__init__(**kwargs)
+        self.patterns = patterns
+
+    @classmethod
+    def bind(cls, fs):
+        # Walker.bind always binds the base class.
+        return fsw.BoundWalker(fs, walker_class=cls)
+
+    def _iter_walk(self, fs, path, namespaces=None):
+        if not isinstance(fs, SQLARFS):
+            return super()._iter_walk(fs, path, namespaces=namespaces)
+        return self._walk_archive(fs, path, namespaces)
+
+    def _walk_archive(self, fs, path, namespaces):
+        root = fs._tr_path(path)
+        try:
+            if not fs.getinfo(root).is_dir:
+                raise fse.DirectoryExpected(path)
+        except fse.FSError as error:
+            if not self.on_error(path, error):
+                raise
+            yield path, None
+            return
+
+        depth_first = self.search == 'depth'
+        # Directories being walked wait in a heap until the rows are past
+        # their members, "\0" sorting before any other character, or when
+        # walking depth first past all the members below them.
+        key = _subtree_end if depth_first else (lambda name: name + '\0')
+        pending = [(key(root), root, path, None)]
+        paths = {root: path}
+        base = self._calculate_depth(root)
+
+        def finish(until=None):
+            while pending and (until is None or pending[0][0] <= until):
+                _, name, dir_path, step = heappop(pending)
+                del paths[name]
+                if step is not None:
+                    yield step
+                yield dir_path, None
+
+        patterns = self.patterns
+        if self.filter:
+            # '*' also matches '/' in fnmatch, so these select the files
+            # whose last component matches, and a few more.
+            patterns = (patterns or []) + ['*/' + pattern for pattern in self.filter]
+        current = None
+        for row in fs.file.itertree(root, self.max_depth, patterns):
+            entry = sqlar.SQLARFileInfo(*row)
+            parent = _parent(entry.name)
+            if parent != current:
+                current = parent
+                yield from finish(parent)
+            dir_path = paths.get(parent)
+            if dir_path is None:
+                # Below a directory that isn't walked
+                continue
+            info = fs._info(entry, namespaces)
+            if not info.is_dir:
+                if self.check_file(fs, info):
+                    yield dir_path, info
+                continue
+            if not self._check_open_dir(fs, dir_path, info):
+                continue
+            depth = self._calculate_depth(entry.name) - base
+            if self._check_scan_dir(fs, dir_path, info, depth):
+                child = fsp.combine(dir_path, info.name)
+                paths[entry.name] = child
+                if depth_first:
+                    # Yielded once everything below it has been
+                    heappush(pending, (key(entry.name), entry.name, child, (dir_path, info)))
+                    continue
+                heappush(pending, (key(entry.name), entry.name, child, None))
+            yield dir_path, info
+        yield from finish()
+
+
+class SQLARGlobber(fsg.Globber):
+    """Globber walking only the part of a SQLARFS the pattern can match.
+
+    The leading components of the pattern without wildcards select the
+    directory to walk, and the whole pattern selects the files in the query.
+    """
+
+    def _make_iter(self, search="breadth", namespaces=None):
+        try:
+            levels, recursive, re_pattern = fsg._PATTERN_CACHE[
+                (self.pattern, self.case_sensitive)
+            ]
+        except KeyError:
+            levels, recursive, re_pattern = fsg._translate_glob(
+                self.pattern, case_sensitive=self.case_sensitive
+            )
+
+        components = list(fsp.iteratepath(self.pattern))
+        start = path = fsp.abspath(self.path)
+        patterns = None
+        skipped = []
+        if self.case_sensitive:
+            patterns = [''.join('*' if c == '**' else '/' + c for c in components)]
+        if self.case_sensitive and start == '/':
+            # Patterns are matched against absolute paths, so the components
+            # without wildcards are directories below the root. The last
+            # component is matched against the entries found, and one
+            # followed by '**' also matches the start of longer names.
+            for component, following in zip(components, components[1:]):
+                if fsp.iswildcard(component) or following == '**':
+                    break
+                if self.exclude_dirs and self.fs.match(self.exclude_dirs, component):
+                    break
+                path = fsp.combine(path, component)
+                skipped.append(path)
+                levels -= 1
+            if skipped and not self.fs.isdir(path):
+                return
+        # The walk doesn't return the directories it starts from, which
+        # the pattern may match with an empty last component.
+        skipped = [
+            fsg.GlobMatch(dir_path + '/', self.fs.getinfo(dir_path, namespaces or self.namespaces))
+            for dir_path in skipped if re_pattern.match(dir_path + '/')
+        ]
+        if search != 'depth':
+            yield from skipped
+
+        for path, info in self.fs.walk.info(
+            path=path,
+            namespaces=namespaces or self.namespaces,
+            max_depth=None if recursive else levels,
+            search=search,
+            exclude_dirs=self.exclude_dirs,
+            patterns=patterns,
+        ):
+            if info.is_dir:
+                path += "/"
+            if re_pattern.match(path):
+                yield fsg.GlobMatch(path, info)
+        if search == 'depth':
+            yield from reversed(skipped)
+
+
+class SQLARBoundGlobber(fsg.BoundGlobber):
+
+    __slots__ = []
+
+    def __call__(self, pattern, path="/", namespaces=None, case_sensitive=True, exclude_dirs=None):
+        return SQLARGlobber(
+            self.fs,
+            pattern,
+            path,
+            namespaces=namespaces,
+            case_sensitive=case_sensitive,
+            exclude_dirs=exclude_dirs,
+        )
+
+
 class SQLARFS(fsb.FS):
-    def __init__(self, filename=None, root = '/'):
+
+    walker_class = SQLARWalker
+
+    def __init__(self, filename=None, root = '/', metadata_cache=4096, content_cache=0, pooled=False,
+                 recompress='close', append_segments=False):
+        # When compressed files open for writing are rewritten, see SQLARFileWriter
+        if recompress not in ('close', 'flush'):
+            raise ValueError("recompress must be 'close' or 'flush', not {!r}".format(recompress))
         super().__init__()
         self.filename = filename
+        self._metadata_cache = metadata_cache
+        self._content_cache = content_cache
+        # Pooled archives can be used from several threads at once
+        self._pooled = pooled
+        # Appends are stored as segments, which only pysqlar reads until
+        # the archive is compacted
+        self._append_segments = append_segments
         self._file = None
+        self._file_lock = threading.Lock()
         self._root = root
         self._closed = False
         self.invalid_path_chars = '\\:@\n\0'
+        self._recompress = recompress
+        # Last (index, name) returned by a paged scandir, per directory
+        self._page_cursors = {}
 
     def _tr_path(self, path):
         path = fsp.normpath(fsp.abspath(path))
@@ -49,7 +258,16 @@ class SQLARFS(fsb.FS):
     @property
     def file(self):
         if not self._file:
-            self._file = SQLiteArchive(self.filename, mode="rwc")
+            with self._file_lock:
+                if not self._file:
+                    self._file = SQLiteArchive(
+                        self.filename,
+                        mode="rwc",
+                        metadata_cache=self._metadata_cache,
+                        content_cache=self._content_cache,
+                        pooled=self._pooled,
+                        append_segments=self._append_segments
+                    )
         return self._file
 
     def _path_exists(self, path):
@@ -75,13 +293,20 @@ class SQLARFS(fsb.FS):
             full_path = parent
 
     def close(self):
-        if not self._closed:
-            self.file.close()
+        # Also called by __del__ when __init__ failed. Archives that were
+        # never opened aren't created just to be closed.
+        if not getattr(self, '_closed', True):
+            if self._file is not None:
+                self._file.close()
             self._closed = True
 
     def isclosed(self):
         return self._closed
 
+    @property
+    def glob(self):
+        return SQLARBoundGlobber(self)
+
     def getmeta(self, namespace='standard'):
         if namespace != 'standard':
             return {}
@@ -91,7 +316,7 @@ class SQLARFS(fsb.FS):
                 'max_sys_path_length': None,
                 'network': False,
                 'read_only': False,
-                'rename': False}
+                'rename': True}
         return meta
 
     def _get_sqlar_path_info(self, path):
@@ -130,11 +355,15 @@ class SQLARFS(fsb.FS):
 
     def getinfo(self, path, namespaces=None):
         path = self._tr_path(path)
-        namespaces = namespaces or ()
         path_obj = self._get_sqlar_path_info(path) # Raises ResourceNotFound if non-existent
+        return self._info(path_obj, namespaces)
+
+    def _info(self, path_obj, namespaces=None):
+        """Build an Info object from a SQLARFileInfo"""
+        namespaces = namespaces or ()
         resource_type = [fs.ResourceType.file, fs.ResourceType.directory, fs.ResourceType.symlink] \
                             [path_obj.is_sym << 1 | path_obj.is_dir]
-        logger.debug(f'PATHINFO: {str(path_obj)}')
+        logger.debug('PATHINFO: %s', path_obj)
         #I think "name" needs to be just the filename, not full path
         #info = {"basic": {"name": path_obj.name, "is_dir": path_obj.is_dir}}
         info = {"basic": {"name": fsp.basename(path_obj.name), "is_dir": path_obj.is_dir}} 
@@ -156,39 +385,28 @@ class SQLARFS(fsb.FS):
         dirinfo = self.getinfo(path)
         if not dirinfo.is_dir:
             raise fse.DirectoryExpected(path)
-        pattern = fsp.combine(path, '*')
-        files = sqlar.find_files(self.file, pattern, True)
-        start, end = None, None
-        def _getfiles(_files):
-            for _file in _files:
-                if (fsp.dirname(_file.name) or '/') == path and _file.name != '/':
-                    yield _file
-        #files = iter([file.name for file in files if (fsp.dirname(file.name) or '/') == path and file.name != '/'])
-        files = _getfiles(files)
-        if page != None:
-            start, end = page
-            # For paging
-            page = []
-            try:
-                try:
-                    while True:
-                        if (start or 0) > 0:
-                            next(files)
-                            start -= 1
-                        else:
-                            break
-                except StopIteration:
-                    pass                
-                try:
-                    for _ in range(0, end):
-                        page.append(next(files))
-                except StopIteration:
-                    pass
-                files = page
-            except StopIteration:
-                pass
-        for file in files:
-            yield self.getinfo(file.name)
+        if page is None:
+            rows = self.file.scandir(path)
+        else:
+            rows = self._scandir_page(path, *page)
+        for row in rows:
+            yield self._info(sqlar.SQLARFileInfo(*row), namespaces)
+
+    def _scandir_page(self, path, start, end):
+        start = start or 0
+        limit = None if end is None else max(end - start, 0)
+        # A page following the previous one continues after its last name,
+        # other pages are found by offset.
+        cursor = self._page_cursors.pop(path, None)
+        if cursor and cursor[0] == start:
+            rows = self.file.scandir(path, after=cursor[1], limit=limit)
+        else:
+            rows = self.file.scandir(path, limit=limit, offset=start)
+        if rows:
+            if len(self._page_cursors) >= 64:
+                self._page_cursors.clear()
+            self._page_cursors[path] = (start + len(rows), rows[-1][0])
+        return rows
 
     def listdir(self, path):
         path = self._tr_path(path)
@@ -197,11 +415,7 @@ class SQLARFS(fsb.FS):
         dirinfo = self.getinfo(path)
         if not dirinfo.is_dir:
             raise fse.DirectoryExpected(path)
-        pattern = fsp.combine(path, '*')
-        files = sqlar.find_files(self.file, pattern, True)
-        files = [file.name for file in files if (fsp.dirname(file.name) or '/') == path]
-        files = [fsp.relativefrom(path, file) for file in files]
-        return files
+        return [fsp.basename(file) for file in self.file.listdir(path)]
 
     def makedir(self, path, permissions=None, recreate=False):
         path = self._tr_path(path)
@@ -234,7 +448,14 @@ class SQLARFS(fsb.FS):
             raise fse.FileExpected(path)
         # Check to see if parent directories exist:
         self._validate_intermediate_paths(path)
-        file_obj = SQLARFileWriter(self.file, path, mode)
+        if not mode_obj.writing:
+            # Read-only handles stream the member instead of loading it
+            try:
+                reader = self.file.open(path)
+            except KeyError:
+                raise fse.ResourceNotFound(path)
+            return fsio.RawWrapper(reader, mode=mode_obj.to_platform_bin(), name=path)
+        file_obj = SQLARFileWriter(self.file, path, mode, self._recompress, self._append_segments)
         return file_obj
 
     def remove(self, path):
@@ -255,46 +476,149 @@ class SQLARFS(fsb.FS):
         info = self.getinfo(path)
         if not info.is_dir:
             raise fse.DirectoryExpected(path)
-        files = self.listdir(path)
-        if len(files) > 0:
+        if self.file.has_members(path + '/'):
             raise fse.DirectoryNotEmpty(path)
         sqlar.delete_file(self.file, path)
 
+    def removetree(self, dir_path):
+        # Deletes the whole subtree with one range DELETE instead of walking
+        # it. The root itself is never removed, only emptied.
+        path = self._tr_path(dir_path)
+        with self._lock:
+            info = self.getinfo(path)
+            if not info.is_dir:
+                raise fse.DirectoryExpected(dir_path)
+            with self.file.batch():
+                self.file.delete_prefix(path.rstrip('/') + '/')
+                if path != '/':
+                    sqlar.delete_file(self.file, path)
+
+    def isempty(self, path):
+        path = self._tr_path(path)
+        if not self.getinfo(path).is_dir:
+            raise fse.DirectoryExpected(path)
+        return not self.file.has_members(path.rstrip('/') + '/')
+
+    def _check_relocation(self, src_path, dst_path):
+        """Raise if *dst_path* is inside *src_path* or the other way around.
+
+        Moving or copying a directory into itself has no meaning, and the
+        renamed entries would collide with the ones being renamed.
+        """
+        src = self._tr_path(src_path)
+        dst = self._tr_path(dst_path)
+        if src != dst and (fsp.isbase(src, dst) or fsp.isbase(dst, src)):
+            raise fse.ResourceInvalid(dst_path, msg="can't move or copy {path!r} into itself")
+        return src, dst
+
+    def _check_file_destination(self, src_path, dst_path, overwrite):
+        if not overwrite and self.exists(dst_path):
+            raise fse.DestinationExists(dst_path)
+        if self.getinfo(src_path).is_dir:
+            raise fse.FileExpected(src_path)
+        src, dst = self._check_relocation(src_path, dst_path)
+        self._validate_intermediate_paths(dst)
+        if self.exists(dst_path) and self.getinfo(dst_path).is_dir:
+            raise fse.FileExpected(dst_path)
+        return src, dst
+
+    def _check_dir_destination(self, src_path, dst_path, create):
+        if not create and not self.exists(dst_path):
+            raise fse.ResourceNotFound(dst_path)
+        if not self.getinfo(src_path).is_dir:
+            raise fse.DirectoryExpected(src_path)
+        src, dst = self._check_relocation(src_path, dst_path)
+        self._validate_intermediate_paths(dst)
+        if self.exists(dst_path) and not self.getinfo(dst_path).is_dir:
+            raise fse.DirectoryExpected(dst_path)
+        return src, dst
+
+    def move(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        # Renames the entry in the archive, the data isn't read or rewritten.
+        with self._lock:
+            src, dst = self._check_file_destination(src_path, dst_path, overwrite)
+            self.file.move(src, dst, replace=True)
+
+    def movedir(self, src_path, dst_path, create=False, preserve_time=False):
+        # Renames every entry under src_path in one statement. The contents
+        # are merged into an existing dst_path, like fs.move.move_dir does.
+        with self._lock:
+            src, dst = self._check_dir_destination(src_path, dst_path, create)
+            if src != dst:
+                self.file.move(src, dst, replace=True)
+
+    def copy(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        # Duplicates the entry with its compressed data.
+        with self._lock:
+            src, dst = self._check_file_destination(src_path, dst_path, overwrite)
+            self.file.copy(src, dst, replace=True, mtime=None if preserve_time else int(time.time()))
+
+    def copydir(self, src_path, dst_path, create=False, preserve_time=False):
+        with self._lock:
+            src, dst = self._check_dir_destination(src_path, dst_path, create)
+            if src != dst:
+                self.file.copy(src, dst, replace=True, mtime=None if preserve_time else int(time.time()))
+
 
 class SQLARFileWriter(io.RawIOBase):
-    def __init__(self, archive_filename, internal_filename_path, mode='wb'):
+    """Writable file object over a member of the archive.
+
+    Only the byte ranges written since the last flush are held in memory,
+    reads merge them with the content stored in the archive. Stored members
+    are flushed in place through `SQLiteArchive.patch`. Compressed members
+    have to be rewritten as a whole: with *recompress* `"close"` flushing them
+    is deferred until the file is closed, with `"flush"` every flush rewrites
+    them. With *append_segments* data written past the end of the member is
+    appended to it as a new segment, see `SQLiteArchive.compact`.
+    """
+    def __init__(self, archive_filename, internal_filename_path, mode='wb', recompress='close',
+                 append_segments=False):
         super().__init__()
-        self._buffer = io.BytesIO()
-        self._flush_pos = 0
         self._mode = fsm.Mode(mode)
+        self._recompress = recompress
+        self._append_segments = append_segments
         self._closed = False
         self.sqlite_archive = None
         if isinstance(archive_filename, SQLiteArchive):
             self.sqlite_archive = archive_filename
         else:
-            self.sqlite_archive = SQLiteArchive(archive_filename, mode='rwc')
+            self.sqlite_archive = SQLiteArchive(archive_filename, mode='rwc', append_segments=append_segments)
         self.internal_filename_path = internal_filename_path
-        self._init_buffer()
-        if self._mode.create and not self._mode.appending:
-            # overwrite the file
-            self.seek(0, io.SEEK_SET)
-            self.truncate(0)
-            self.flush()
-            
+        info = self.sqlite_archive.getinfo(internal_filename_path)
+        # Size of the member in the archive, and how much of it is still
+        # part of the file after truncations
+        self._stored_size = info[3] if info else 0
+        self._base_size = 0 if self._mode.truncate else self._stored_size
+        self._size = self._base_size
+        self._pos = self._size if self._mode.appending else 0
+        # Sorted, disjoint ranges written since the last flush
+        self._offsets = []
+        self._chunks = []
+        # A new or truncated member is stored even if nothing is written
+        self._dirty = info is None or self._base_size < self._stored_size
+        # Written in place without updating the modification time
+        self._touched = False
+        self._reader = None
+
     @property
     def mode(self):
         return self._mode.to_platform_bin()
 
-    def _init_buffer(self):
-        # So we only have 1 trip to the database
-        data = self.sqlite_archive.read(self.internal_filename_path)
-        if data != None:
-            self._buffer.write(data)
-            if not self._mode.appending:
-                self._buffer.seek(0)
-        if self._mode.appending:
-            self._buffer.seek(0, io.SEEK_END)
-            self._flush_pos = self.tell()
+    def _read_range(self, start, end):
+        data = bytearray(end - start)
+        base_end = min(end, self._base_size)
+        if start < base_end:
+            if self._reader is None:
+                self._reader = self.sqlite_archive.open(self.internal_filename_path)
+            self._reader.seek(start)
+            self._reader.readinto(memoryview(data)[:base_end - start])
+        first = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+        for i in range(first, bisect.bisect_left(self._offsets, end)):
+            offset, chunk = self._offsets[i], self._chunks[i]
+            lo, hi = max(offset, start), min(offset + len(chunk), end)
+            if lo < hi:
+                data[lo - start:hi - start] = chunk[lo - offset:hi - offset]
+        return data
 
     def seekable(self):
         return True
@@ -305,23 +629,39 @@ class SQLARFileWriter(io.RawIOBase):
 
     def tell(self):
         self._validate_seekable()
-        return self._buffer.tell()
+        return self._pos
 
     def seek(self, _offset, _whence=0):
         self._validate_seekable()
-        return self._buffer.seek(_offset, _whence)
+        if _whence == io.SEEK_SET:
+            pos = _offset
+        elif _whence == io.SEEK_CUR:
+            pos = self._pos + _offset
+        elif _whence == io.SEEK_END:
+            pos = self._size + _offset
+        else:
+            raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(_whence))
+        if pos < 0:
+            raise OSError("negative seek position {}".format(pos))
+        self._pos = pos
+        return pos
 
-    def truncate(self, _size):
+    def truncate(self, _size=None):
         self._validate_seekable()
-        new_file_size = self._buffer.truncate(_size)
-        old_file_size = len(self._buffer.getbuffer())
-        if new_file_size > old_file_size:
-            pos = self.tell()
-            self.seek(old_file_size)
-            self.write(b'\0' * (new_file_size - old_file_size))
-            self.seek(pos)
-            #self._buffer.getbuffer()[pos:new_file_size] = b'\0' * (new_file_size - pos + 1)
-        return new_file_size
+        if not self.writable():
+            raise OSError()
+        if _size is None:
+            _size = self._pos
+        if _size < self._size:
+            # Drop the written ranges past the new end
+            i = bisect.bisect_left(self._offsets, _size)
+            del self._offsets[i:], self._chunks[i:]
+            if self._chunks:
+                del self._chunks[-1][_size - self._offsets[-1]:]
+            self._base_size = min(self._base_size, _size)
+        self._size = _size
+        self._dirty = True
+        return _size
 
     def write(self, _buffer):
         if not self.writable():
@@ -329,13 +669,43 @@ class SQLARFileWriter(io.RawIOBase):
         return self._write_buf(_buffer)
 
     def _write_buf(self, _buffer):
-        return self._buffer.write(_buffer)
+        data = bytes(_buffer)
+        if self._mode.appending:
+            self._pos = self._size
+        start, end = self._pos, self._pos + len(data)
+        if not data:
+            return 0
+        # Merge with the ranges overlapping or touching the written one
+        offsets, chunks = self._offsets, self._chunks
+        lo = bisect.bisect_left(offsets, start)
+        if lo and offsets[lo - 1] + len(chunks[lo - 1]) >= start:
+            lo -= 1
+        hi = bisect.bisect_right(offsets, end)
+        if lo < hi and offsets[lo] <= start:
+            merged, first = chunks[lo], offsets[lo]
+        else:
+            merged, first = bytearray(), start
+        for offset, chunk in zip(offsets[lo:hi], chunks[lo:hi]):
+            if chunk is not merged:
+                merged.extend(bytes(offset - first - len(merged)))
+                merged[offset - first:] = chunk
+        merged.extend(bytes(max(start - first - len(merged), 0)))
+        merged[start - first:end - first] = data
+        offsets[lo:hi] = [first]
+        chunks[lo:hi] = [merged]
+        self._pos = end
+        self._size = max(self._size, end)
+        self._dirty = True
+        return len(data)
 
     def close(self):
         if not self._closed:
-            if self.writable():
-                self.flush()
-            self._closed = True
+            try:
+                if self.writable():
+                    self._flush(final=True)
+            finally:
+                self._close_reader()
+                self._closed = True
     
     @property
     def closed(self):
@@ -350,37 +720,88 @@ class SQLARFileWriter(io.RawIOBase):
         self.close()
 
     def flush(self):
-        if self.writable():
-            data = self._buffer.getbuffer().tobytes()
-            sqlar.write(self.sqlite_archive, '', self.internal_filename_path, data=data, mode=str(self._mode), cursor_pos=self.tell())
-            self._flush_pos = self.tell()
+        self._flush()
 
-    def writelines(self, _lines):
+    def _flush(self, final=False):
         if not self.writable():
-            raise OSError()
-        self._buffer.writelines(_lines)
-
-    def readline(self, _size = None):
-       return self._buffer.readline(_size)
-
-    def __iter__(self):
-        yield from self._buffer.__iter__()
-
-    def readlines(self, _hint=-1):
-        if not self.readable():
-            raise OSError()
-        return self._buffer.readlines(_hint)
-
-    def read(self, _size = None):
+            return
+        if not self._dirty:
+            if final and self._touched:
+                self.sqlite_archive.patch(self.internal_filename_path, [], mtime=int(time.time()))
+            return
+        name = self.internal_filename_path
+        ranges = list(zip(self._offsets, self._chunks))
+        kept = min(self._stored_size, self._size)
+        if self._base_size < kept:
+            # Truncated content that is still in the archive reads as zeros
+            ranges.insert(0, (self._base_size, bytes(kept - self._base_size)))
+        self._close_reader()
+        # Setting the modification time copies a stored member, only done on close
+        mtime = int(time.time()) if final else None
+        if (self._append_segments and self._stored_size and self._base_size == self._stored_size
+                and self._offsets == [self._stored_size]
+                and self._size == self._stored_size + len(self._chunks[0])):
+            # Data written past the end is appended as a new segment, which
+            # doesn't copy the member either
+            mtime = int(time.time())
+            self.sqlite_archive.writestr(name, bytes(self._chunks[0]), mtime=mtime, mode='ab')
+            written = True
+        else:
+            try:
+                written = self.sqlite_archive.patch(name, ranges, self._size, mtime)
+            except KeyError:
+                # New members get the compression of the archive
+                written, compression = False, None
+            else:
+                if not written and self._recompress == 'close' and not final:
+                    return
+                # Keep the compression of the member, chunked members get the
+                # compression of the archive
+                stored, = self.sqlite_archive.sql("SELECT length(data) = sz FROM sqlar WHERE name = ?", name)[0]
+                compression = None if stored is None else SQLAR_STORED if stored else SQLAR_DEFLATED
+        if not written:
+            data = self._read_range(0, self._size)
+            # The blob handle of the reader can't outlive the rewrite
+            self._close_reader()
+            self.sqlite_archive.writestr(name, bytes(data), mtime=int(time.time()), compression=compression)
+        self._touched = written and mtime is None and self._size == self._stored_size
+        self._offsets, self._chunks = [], []
+        self._stored_size = self._base_size = self._size
+        self._dirty = False
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def readline(self, _size=-1):
         if not self.readable():
             raise OSError()
-        data = self._buffer.read(_size)
-        return data
-
-    def readinto(self, _buffer: bytearray):
+        remaining = max(self._size - self._pos, 0)
+        limit = remaining if _size is None or _size < 0 else min(_size, remaining)
+        line = bytearray()
+        while len(line) < limit:
+            chunk = self._read_range(self._pos, self._pos + min(io.DEFAULT_BUFFER_SIZE, limit - len(line)))
+            end = chunk.find(b'\n') + 1
+            if end:
+                del chunk[end:]
+            line += chunk
+            self._pos += len(chunk)
+            if end:
+                break
+        return bytes(line)
+
+    def readinto(self, _buffer):
         if not self.readable():
             raise OSError()
-        return self._buffer.readinto(_buffer)
+        with memoryview(_buffer) as view, view.cast("B") as view:
+            end = min(self._pos + len(view), self._size)
+            if end <= self._pos:
+                return 0
+            data = self._read_range(self._pos, end)
+            view[:len(data)] = data
+        self._pos = end
+        return len(data)
 
     def readable(self) -> bool:
         return self._mode.reading
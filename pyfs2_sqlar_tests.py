@@ -1,7 +1,15 @@
+import gc
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from unittest.mock import patch
+import fs.errors as fse
+from fs.memoryfs import MemoryFS
 from fs.test import FSTestCases
 from pyfs2_sqlar import SQLARFS
+from pysqlar import SQLAR_DEFLATED, SQLAR_STORED, SQLiteArchive
 
 
 class TestSQLARFS(FSTestCases, unittest.TestCase):
@@ -14,4 +22,377 @@ class TestSQLARFS(FSTestCases, unittest.TestCase):
         return SQLARFS(str(arc))
 
 
+class TestSQLARFSQueries(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'queries.sqlar'
+        self.fs = SQLARFS(str(arc))
+        self.addCleanup(self.fs.close)
+        self.fs.makedir('dir')
+        for i in range(50):
+            self.fs.writebytes('dir/file{:02}'.format(i), b'' if i % 2 else b'data')
+
+    def count_queries(self, fn):
+        queries = []
+        self.fs.file._conn.set_trace_callback(queries.append)
+        try:
+            result = fn()
+        finally:
+            self.fs.file._conn.set_trace_callback(None)
+        return result, len([query for query in queries if query.lstrip().startswith('SELECT')])
+
+    def test_scandir_single_query(self):
+        infos, queries = self.count_queries(
+            lambda: list(self.fs.scandir('dir', namespaces=['details']))
+        )
+        self.assertEqual(len(infos), 50)
+        self.assertLessEqual(queries, 2)
+        self.assertEqual(infos[1].size, 0)
+        self.assertFalse(infos[1].is_dir)
+
+    def test_scandir_pages(self):
+        names = []
+        for start in range(0, 60, 20):
+            page = list(self.fs.scandir('dir', page=(start, start + 20)))
+            names.extend(info.name for info in page)
+        self.assertEqual(names, ['file{:02}'.format(i) for i in range(50)])
+        self.assertEqual(
+            [info.name for info in self.fs.scandir('dir', page=(45, None))],
+            ['file{:02}'.format(i) for i in range(45, 50)]
+        )
+
+
+class TestSQLARFSMoveCopy(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'move.sqlar'
+        self.fs = SQLARFS(str(arc))
+        self.addCleanup(self.fs.close)
+        self.fs.makedirs('src/sub')
+        self.fs.writebytes('src/a', b'a' * 1000)
+        self.fs.writebytes('src/sub/b', b'b' * 1000)
+        # Files are not read back through the generic implementations
+        patcher = patch.object(SQLARFS, 'openbin', side_effect=AssertionError('openbin called'))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_movedir(self):
+        self.fs.movedir('src', 'dst', create=True)
+        self.assertFalse(self.fs.exists('src'))
+        self.assertEqual(sorted(self.fs.walk.files('/dst')), ['/dst/a', '/dst/sub/b'])
+        self.assertEqual(self.fs.getsize('dst/sub/b'), 1000)
+
+    def test_movedir_merges(self):
+        self.fs.makedir('dst')
+        self.fs.makedir('dst/other')
+        self.fs.movedir('src', 'dst')
+        self.assertEqual(sorted(self.fs.listdir('dst')), ['a', 'other', 'sub'])
+
+    def test_move(self):
+        self.fs.move('src/a', 'src/sub/a')
+        self.assertEqual(self.fs.listdir('src'), ['sub'])
+        with self.assertRaises(fse.DestinationExists):
+            self.fs.move('src/sub/a', 'src/sub/b')
+        self.fs.move('src/sub/a', 'src/sub/b', overwrite=True)
+        self.assertEqual(self.fs.listdir('src/sub'), ['b'])
+        self.assertEqual(self.fs.getsize('src/sub/b'), 1000)
+
+    def test_copy(self):
+        self.fs.copy('src/a', 'a', preserve_time=True)
+        self.fs.copydir('src', 'copy', create=True)
+        self.assertEqual(self.fs.getinfo('a', ['details']).modified, self.fs.getinfo('src/a', ['details']).modified)
+        self.assertEqual(sorted(self.fs.walk.files('/copy')), ['/copy/a', '/copy/sub/b'])
+        self.assertEqual(sorted(self.fs.walk.files('/src')), ['/src/a', '/src/sub/b'])
+
+    def test_into_itself(self):
+        with self.assertRaises(fse.ResourceInvalid):
+            self.fs.movedir('src', 'src/sub/src', create=True)
+
+
+class TestSQLARFSRemoveTree(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'remove.sqlar'
+        self.fs = SQLARFS(str(arc))
+        self.addCleanup(self.fs.close)
+        self.fs.makedirs('dir/sub')
+        for i in range(20):
+            self.fs.writebytes('dir/sub/file{}'.format(i), b'data')
+        self.fs.writebytes('dir.txt', b'data')
+
+    def test_removetree(self):
+        statements = []
+        self.fs.file._conn.set_trace_callback(statements.append)
+        self.fs.removetree('dir')
+        self.fs.file._conn.set_trace_callback(None)
+        self.assertEqual(self.fs.listdir('/'), ['dir.txt'])
+        self.assertEqual(len([s for s in statements if s.lstrip().startswith('DELETE')]), 2)
+        self.assertEqual(len([s for s in statements if s.startswith('COMMIT')]), 1)
+
+    def test_removetree_root(self):
+        self.fs.removetree('/')
+        self.assertTrue(self.fs.exists('/'))
+        self.assertTrue(self.fs.isempty('/'))
+
+    def test_removedir_not_empty(self):
+        with self.assertRaises(fse.DirectoryNotEmpty):
+            self.fs.removedir('dir')
+        self.assertFalse(self.fs.isempty('dir/sub'))
+        self.fs.removetree('dir/sub')
+        self.assertTrue(self.fs.isempty('dir'))
+        self.fs.removedir('dir')
+        self.assertFalse(self.fs.exists('dir'))
+
+
+class TestSQLARFSWalk(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'walk.sqlar'
+        self.fs = SQLARFS(str(arc))
+        self.addCleanup(self.fs.close)
+        # The generic walker over a memory filesystem gives the expected results
+        self.expected = MemoryFS()
+        for fs in (self.fs, self.expected):
+            fs.makedirs('a/b/c')
+            fs.makedirs('a.b/d')
+            fs.makedirs('a/empty')
+            for path in ['a/x.py', 'a/b/y.py', 'a/b/c/z.txt', 'a.b/d/q.py', 'top.py']:
+                fs.writebytes(path, b'data')
+
+    def test_walk(self):
+        for options in [{}, {'search': 'depth'}, {'max_depth': 2}, {'filter': ['*.py']},
+                        {'exclude': ['*.txt']}, {'exclude_dirs': ['b']}, {'filter_dirs': ['a*']}]:
+            for path in ['/', '/a']:
+                with self.subTest(path=path, **options):
+                    self.assertEqual(
+                        sorted(self.fs.walk.files(path, **options)),
+                        sorted(self.expected.walk.files(path, **options))
+                    )
+                    self.assertEqual(
+                        sorted(self.fs.walk.dirs(path, **options)),
+                        sorted(self.expected.walk.dirs(path, **options))
+                    )
+                    steps = [(step.path, sorted(i.name for i in step.dirs), sorted(i.name for i in step.files))
+                             for step in self.fs.walk(path, **options)]
+                    expected = [(step.path, sorted(i.name for i in step.dirs), sorted(i.name for i in step.files))
+                                for step in self.expected.walk(path, **options)]
+                    self.assertEqual(sorted(steps), sorted(expected))
+
+    def test_walk_order(self):
+        top_down = [step.path for step in self.fs.walk('/')]
+        self.assertLess(top_down.index('/a'), top_down.index('/a/b'))
+        self.assertLess(top_down.index('/a/b'), top_down.index('/a/b/c'))
+        bottom_up = [step.path for step in self.fs.walk('/', search='depth')]
+        self.assertGreater(bottom_up.index('/a'), bottom_up.index('/a/b'))
+        self.assertGreater(bottom_up.index('/a/b'), bottom_up.index('/a/b/c'))
+        self.assertEqual(bottom_up[-1], '/')
+
+    def test_single_query(self):
+        queries = []
+        self.fs.file._conn.set_trace_callback(queries.append)
+        files = list(self.fs.walk.info('/', namespaces=['details']))
+        self.fs.file._conn.set_trace_callback(None)
+        self.assertEqual(len(files), 11)
+        self.assertLessEqual(len([query for query in queries if query.lstrip().startswith('SELECT')]), 2)
+
+    def test_glob(self):
+        for pattern in ['**/*.py', 'a/**/*.py', 'a/b/*', 'a/*/', '*.py', 'a.b/d/*', 'missing/*']:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(
+                    sorted(match.path for match in self.fs.glob(pattern)),
+                    sorted(match.path for match in self.expected.glob(pattern))
+                )
+        self.assertEqual(self.fs.glob('**/*.py').count().files, 4)
+
+
+class TestSQLARFSOpen(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'open.sqlar'
+        self.fs = SQLARFS(str(arc))
+        self.addCleanup(self.fs.close)
+        self.data = b''.join(b'line %d\n' % i for i in range(100000))
+        self.fs.writebytes('big', self.data)
+        # Members are never loaded as a whole
+        patcher = patch.object(self.fs.file, 'read', side_effect=AssertionError('read called'))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_read_streams(self):
+        with self.fs.openbin('big') as f:
+            self.assertEqual(f.mode, 'rb')
+            self.assertFalse(f.writable())
+            self.assertEqual(f.readline(), b'line 0\n')
+            f.seek(-8, 2)
+            self.assertEqual(f.read(), self.data[-8:])
+        with self.fs.open('big') as f:
+            self.assertEqual(f.readline(), 'line 0\n')
+
+    def test_missing(self):
+        with self.assertRaises(fse.ResourceNotFound):
+            self.fs.openbin('missing')
+
+    def test_write_does_not_load(self):
+        with self.fs.openbin('big', 'w') as f:
+            f.write(b'new')
+        self.assertEqual(self.fs.readbytes('big'), b'new')
+
+    def test_append_buffers_new_data(self):
+        with self.fs.openbin('big', 'a') as f:
+            self.assertEqual(f.tell(), len(self.data))
+            f.write(b'tail')
+            f.flush()
+            f.write(b'!')
+            self.assertEqual(f.tell(), len(self.data) + 5)
+        with self.fs.openbin('big') as f:
+            f.seek(len(self.data))
+            self.assertEqual(f.read(), b'tail!')
+
+
+class TestSQLARFSWriter(unittest.TestCase):
+
+    def make_fs(self, **options):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'writer.sqlar'
+        fs = SQLARFS(str(arc), **options)
+        self.addCleanup(fs.close)
+        return fs
+
+    def test_stored_in_place(self):
+        fs = self.make_fs()
+        fs.writebytes('file', b'0123456789' * 1000)
+        with patch.object(fs.file, 'writestr', side_effect=AssertionError('writestr called')):
+            with fs.openbin('file', 'r+') as f:
+                f.seek(5)
+                f.write(b'abc')
+                f.flush()
+                self.assertEqual(fs.file.read('/file')[:10], b'01234abc89')
+                f.seek(3)
+                self.assertEqual(f.read(5), b'34abc')
+        self.assertEqual(fs.readbytes('file')[:10], b'01234abc89')
+
+    def test_append_segments(self):
+        fs = self.make_fs(append_segments=True)
+        fs.writebytes('log', b'x' * 1000)
+        with fs.openbin('log', 'a') as f:
+            for i in range(3):
+                f.write(b'line %d\n' % i)
+                f.flush()
+        self.assertEqual(len(fs.file.sql("SELECT * FROM sqlar_append WHERE name = '/log'")), 4)
+        with fs.open('log') as f:
+            self.assertEqual(f.readlines()[-2:], ['line 1\n', 'line 2\n'])
+        self.assertEqual(fs.getsize('log'), 1021)
+        fs.file.compact()
+        self.assertEqual(fs.readbytes('log'), b'x' * 1000 + b'line 0\nline 1\nline 2\n')
+
+    def test_append_standard(self):
+        fs = self.make_fs()
+        fs.writebytes('log', b'x' * 1000)
+        with fs.openbin('log', 'a') as f:
+            f.write(b'line 0\n')
+            f.flush()
+            f.write(b'line 1\n')
+        self.assertEqual(fs.file.sql("SELECT data FROM sqlar WHERE name = '/log'"),
+                         [(b'x' * 1000 + b'line 0\nline 1\n',)])
+
+    def test_truncate(self):
+        fs = self.make_fs()
+        fs.writebytes('file', b'x' * 100)
+        with fs.openbin('file', 'r+') as f:
+            f.truncate(10)
+            f.truncate(20)
+            f.seek(0, 2)
+            f.write(b'y')
+        self.assertEqual(fs.readbytes('file'), b'x' * 10 + b'\0' * 10 + b'y')
+
+    def test_deflated_deferred(self):
+        fs = self.make_fs()
+        fs.file.writestr('/file', b'x' * 1000, compression=SQLAR_DEFLATED)
+        with fs.openbin('file', 'r+') as f:
+            f.write(b'y')
+            f.flush()
+            self.assertEqual(fs.file.read('/file'), b'x' * 1000)
+            self.assertEqual(f.read(3), b'xxx')
+        self.assertEqual(fs.readbytes('file'), b'y' + b'x' * 999)
+        # Recompressed on close
+        self.assertLess(len(fs.file.sql("SELECT data FROM sqlar WHERE name = '/file'")[0][0]), 1000)
+
+    def test_rewrite_keeps_compression(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'writer.sqlar'
+        with SQLiteArchive(str(arc), mode='rwc', dedup=True) as ar:
+            ar.writestr('/file', b'x' * 1000, compression=SQLAR_STORED)
+        fs = SQLARFS(str(arc))
+        self.addCleanup(fs.close)
+        # Deduplicated content is shared and always rewritten
+        with fs.openbin('file', 'r+') as f:
+            f.write(b'y')
+        self.assertEqual(fs.readbytes('file'), b'y' + b'x' * 999)
+        self.assertEqual(fs.file.sql("SELECT length(data) FROM sqlar WHERE name = '/file'"), [(1000,)])
+
+    def test_deflated_flush_policy(self):
+        fs = self.make_fs(recompress='flush')
+        fs.file.writestr('/file', b'x' * 1000, compression=SQLAR_DEFLATED)
+        with fs.openbin('file', 'r+') as f:
+            f.write(b'y')
+            f.flush()
+            self.assertEqual(fs.file.read('/file')[:2], b'yx')
+
+    def test_invalid_recompress(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                SQLARFS(str(Path(tmp) / 'unused.sqlar'), recompress='never')
+            gc.collect()
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_close_unused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            SQLARFS(str(Path(tmp) / 'unused.sqlar')).close()
+            self.assertEqual(os.listdir(tmp), [])
+
+
+class TestSQLARFSPooled(unittest.TestCase):
+
+    def test_threads(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'pooled.sqlar'
+        with SQLARFS(str(arc), pooled=True) as fs:
+            fs.makedir('dir')
+
+            def work(i):
+                fs.writebytes('dir/file{}'.format(i), bytes([i]) * 100)
+                return fs.readbytes('dir/file{}'.format(i)), fs.getinfo('dir/file{}'.format(i)).name
+
+            with ThreadPoolExecutor(4) as pool:
+                results = list(pool.map(work, range(40)))
+            self.assertEqual(results, [(bytes([i]) * 100, 'file{}'.format(i)) for i in range(40)])
+            self.assertEqual(len(fs.listdir('dir')), 40)
+
+    def test_open_file_doesnt_pin_reads(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        arc = Path(tmp.name) / 'pooled.sqlar'
+        with SQLARFS(str(arc), pooled=True) as fs:
+            fs.writebytes('a', b'a' * 100)
+            self.assertFalse(fs.exists('b'))
+            with fs.openbin('a') as f:
+                fs.writebytes('b', b'b')
+                self.assertTrue(fs.exists('b'))
+                self.assertEqual(f.read(), b'a' * 100)
+            self.assertTrue(fs.exists('b'))
+
+
 unittest.main()
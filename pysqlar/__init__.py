@@ -1,4 +1,4 @@
-from .archive import SQLiteArchive, is_sqlar, SQLAR_STORED, SQLAR_DEFLATED
+from .archive import SQLiteArchive, is_sqlar, SQLAR_STORED, SQLAR_DEFLATED, PRAGMA_PROFILES, CacheInfo
 
 
-__all__ = ["SQLiteArchive", "is_sqlar", "SQLAR_STORED", "SQLAR_DEFLATED"]
+__all__ = ["SQLiteArchive", "is_sqlar", "SQLAR_STORED", "SQLAR_DEFLATED", "PRAGMA_PROFILES", "CacheInfo"]
@@ -0,0 +1,362 @@
+"""asyncio front-end for SQLite Archives.
+
+`AsyncSQLiteArchive` runs every operation of a `SQLiteArchive`, including
+SQLite I/O and zlib compression and decompression, on a dedicated pool of
+worker threads, so the event loop is never blocked by the archive.
+
+```python
+async with AsyncSQLiteArchive("site.sqlar", mode="rwc") as ar:
+    await ar.writestr("index.html", html)
+    async for name, *_ in ar.iterinfo(["*.css"]):
+        ...
+    async with ar.open("video.mp4") as f:
+        async for chunk in f:
+            ...
+```
+"""
+import asyncio
+import functools
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .archive import (
+    SQLiteArchive,
+    _BATCH_MAX_BYTES,
+    _BATCH_MAX_ROWS,
+    _BLOB_CHUNK_SIZE,
+    _EXTRACT_BUFFER_SIZE,
+)
+
+
+def _pack_item(archive, item, compression, level):
+    """Turns a `writemany` item into a row for `SQLiteArchive._store_rows`,
+    compressing its data."""
+    arcname, data, *rest = item
+    unix_mode = rest[0] if rest else 0o777
+    mtime = rest[1] if len(rest) > 1 else int(time.time())
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return (
+        str(Path(arcname).as_posix()),
+        unix_mode,
+        mtime,
+        len(data),
+        *archive._pack(data, compression or archive._compression, level or archive._compress_level)
+    )
+
+
+def _store_group(archive, rows):
+    with archive.batch():
+        archive._store_rows(rows)
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncMemberFile():
+    """Asynchronous file object over an archive member.
+
+    Returned by `AsyncSQLiteArchive.open`. Reads, writes and seeks run on the
+    archive's workers, a file object must only be used by one task at a
+    time. Iterating over a file opened for reading yields its content in
+    chunks.
+    """
+
+    def __init__(self, run, f):
+        self._run = run
+        self._f = f
+
+    async def read(self, size=-1):
+        return await self._run(self._f.read, size)
+
+    async def write(self, b):
+        return await self._run(self._f.write, b)
+
+    async def seek(self, offset, whence=io.SEEK_SET):
+        return await self._run(self._f.seek, offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    async def close(self):
+        # Closing a file opened for writing stores the member.
+        await self._run(self._f.close)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read(_BLOB_CHUNK_SIZE)
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *details):
+        await self.close()
+
+
+class _Opening():
+    """Awaitable returning an `AsyncMemberFile`, which can also be used
+    directly in `async with`."""
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._file = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._file = await self._coro
+        return self._file
+
+    async def __aexit__(self, *details):
+        await self._file.close()
+
+
+class AsyncSQLiteArchive():
+    """An SQLite Archive used from asyncio.
+
+    The archive is opened in *pooled* mode on the first call, so each worker
+    thread reads through its own connection and reads run concurrently,
+    while writes are serialized. Memory-only databases can't be pooled and
+    get a single worker instead.
+
+    Attributes:
+        filename: The filename of the SQLite Archive.
+    """
+
+    def __init__(self, filename, mode="ro", workers=4, max_pending=None, **kwargs):
+        """Prepare an SQLite Archive for asynchronous use.
+
+        Args:
+            filename: The path to the archive, see `SQLiteArchive`.
+            mode (optional): The mode to open the archive with, see
+                `SQLiteArchive`.
+            workers (optional): The number of worker threads.
+            max_pending (optional): The largest number of members
+                `writemany` compresses at once, by default twice the number
+                of workers.
+            **kwargs: Other arguments passed to `SQLiteArchive`.
+        """
+        memory = filename == ":memory:" or mode == "memory"
+        self.filename = filename
+        self._executor = ThreadPoolExecutor(
+            1 if memory else workers,
+            thread_name_prefix="pysqlar"
+        )
+        self._max_pending = max_pending or 2 * workers
+        # Opened by the first call, on a worker, so opening doesn't block the
+        # event loop either.
+        self._open = functools.partial(SQLiteArchive, filename, mode, pooled=not memory, **kwargs)
+        self._archive = None
+        self._opening = asyncio.Lock()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _get_archive(self):
+        if self._archive is None:
+            async with self._opening:
+                if self._archive is None:
+                    self._archive = await self._run(self._open)
+        return self._archive
+
+    async def _call(self, method, *args, **kwargs):
+        archive = await self._get_archive()
+        return await self._run(functools.partial(getattr(archive, method), *args, **kwargs))
+
+    async def close(self):
+        """Close the archive and stop the workers."""
+        if self._archive is not None:
+            await self._run(self._archive.close)
+        self._executor.shutdown(wait=False)
+
+    async def getinfo(self, name):
+        """See `SQLiteArchive.getinfo`."""
+        return await self._call("getinfo", name)
+
+    async def infolist(self, name=None):
+        """See `SQLiteArchive.infolist`."""
+        return await self._call("infolist", name)
+
+    async def namelist(self):
+        """See `SQLiteArchive.namelist`."""
+        return await self._call("namelist")
+
+    async def listdir(self, path=""):
+        """See `SQLiteArchive.listdir`."""
+        return await self._call("listdir", path)
+
+    async def scandir(self, path="", after=None, limit=None, offset=0):
+        """See `SQLiteArchive.scandir`."""
+        return await self._call("scandir", path, after, limit, offset)
+
+    async def iterinfo(self, patterns=None, page=1000):
+        """Yields metadata for the members matching any of *patterns*.
+
+        The rows are read on the workers *page* rows at a time, each page by
+        its own query continuing after the last name of the previous one, so
+        listing a large archive doesn't load it all into memory. The rows are
+        sorted by name.
+
+        Args:
+            patterns (optional): Patterns to match, see
+                `SQLiteArchive.iterinfo`.
+            page (optional): The number of rows read at a time.
+
+        Yields:
+            Rows with the same fields as the rows of `infolist`.
+        """
+        archive = await self._get_archive()
+        after = None
+        while True:
+            chunk = await self._run(lambda: list(archive.iterinfo(patterns, after, page)))
+            for row in chunk:
+                yield row
+            if len(chunk) < page:
+                return
+            after = chunk[-1][0]
+
+    async def read(self, name, start=1, end=2147483647):
+        """See `SQLiteArchive.read`."""
+        return await self._call("read", name, start, end)
+
+    async def extract(self, member, path=None, buffer_size=_EXTRACT_BUFFER_SIZE):
+        """See `SQLiteArchive.extract`."""
+        return await self._call("extract", member, path, buffer_size)
+
+    async def extractall(self, path=None, members=None, workers=None, buffer_size=_EXTRACT_BUFFER_SIZE):
+        """See `SQLiteArchive.extractall`."""
+        return await self._call("extractall", path, members, workers, buffer_size)
+
+    async def sql(self, query, *args):
+        """See `SQLiteArchive.sql`."""
+        return await self._call("sql", query, *args)
+
+    def open(self, name, mode="r", compression=None, compress_level=None):
+        """Access a member of the archive as an asynchronous file object.
+
+        Can be awaited or used directly as an asynchronous context manager:
+        ```python
+        async with ar.open("log.txt") as f:
+            head = await f.read(100)
+        ```
+
+        Args:
+            See `SQLiteArchive.open`.
+
+        Returns:
+            An `AsyncMemberFile`.
+        """
+        async def opening():
+            f = await self._call("open", name, mode, compression, compress_level)
+            return AsyncMemberFile(self._run, f)
+        return _Opening(opening())
+
+    async def write(self,
+                    filename,
+                    arcname=None,
+                    compression=None,
+                    compress_level=None,
+                    chunk_size=None):
+        """See `SQLiteArchive.write`."""
+        return await self._call("write", filename, arcname, compression, compress_level, chunk_size)
+
+    async def writestr(self, arcname, data, **kwargs):
+        """See `SQLiteArchive.writestr`."""
+        return await self._call("writestr", arcname, data, **kwargs)
+
+    async def add_files(self, files, compression=None, compress_level=None, workers=None):
+        """See `SQLiteArchive.add_files`."""
+        return await self._call("add_files", files, compression, compress_level, workers)
+
+    async def writemany(self, items, compression=None, compress_level=None):
+        """Write many strings into the archive.
+
+        The members are compressed on the workers in parallel. At most
+        *max_pending* members are being compressed at any time, and *items*
+        is only consumed as they complete, so a producer faster than the
+        archive is held back instead of filling memory. Existing members
+        with the same name are replaced.
+
+        Unlike `SQLiteArchive.writemany` the members are committed in groups
+        as they are written, not in a single transaction.
+
+        Args:
+            items: An iterable or asynchronous iterable of `(arcname, data)`
+                or `(arcname, data, unix_mode, mtime)` tuples.
+            compression (optional): Override the *compression* chosen when
+                opening the archive.
+            compress_level (optional): Override the *compress_level* chosen when
+                opening the archive.
+        """
+        archive = await self._get_archive()
+        if archive._chunk_size:
+            # Chunked members are compressed while they are stored.
+            group = []
+            async for item in _aiter(items):
+                group.append(item)
+                if len(group) >= _BATCH_MAX_ROWS:
+                    await self._run(archive.writemany, group, compression, compress_level)
+                    group = []
+            if group:
+                await self._run(archive.writemany, group, compression, compress_level)
+            return
+
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        group = []
+        size = 0
+
+        async def store(row):
+            nonlocal group, size
+            group.append(row)
+            # Rows of content already in the archive carry a callable
+            size += 0 if callable(row[4]) else len(row[4] or b"")
+            if len(group) >= _BATCH_MAX_ROWS or size >= _BATCH_MAX_BYTES:
+                rows, group, size = group, [], 0
+                await self._run(_store_group, archive, rows)
+
+        try:
+            async for item in _aiter(items):
+                pending.append(loop.run_in_executor(
+                    self._executor,
+                    _pack_item,
+                    archive,
+                    item,
+                    compression,
+                    compress_level
+                ))
+                if len(pending) >= self._max_pending:
+                    await store(await pending.popleft())
+            while pending:
+                await store(await pending.popleft())
+            if group:
+                await self._run(_store_group, archive, group)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def __aenter__(self):
+        await self._get_archive()
+        return self
+
+    async def __aexit__(self, *details):
+        await self.close()
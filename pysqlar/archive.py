@@ -1,15 +1,30 @@
+import bisect
+import fnmatch
+import hashlib
+import io
 import logging
 from multiprocessing.util import is_exiting
 import os
+import re
 from select import select
 import sqlite3
 import sys
+import tempfile
+import threading
+import time
 import zlib
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache, partial
+from itertools import accumulate
 from enum import Enum, auto
 from pathlib import Path
 
+from .cache import CacheInfo, LRUCache, MISSING
+
 
 logger = logging.getLogger(__name__)
 
@@ -50,16 +65,278 @@ _SQLAR_TABLE_INFO_EXPANDED_EXPECTED_RESULT = [
     (6, "ctime", "INT", 0, None, 0),
 ]
 
+_SQLAR_INSERT = """
+INSERT INTO sqlar(name, mode, mtime, sz, data)
+VALUES (?, ?, ?, ?, {data})
+"""
+
+_SQLAR_UPSERT = _SQLAR_INSERT + """ON CONFLICT(name) DO UPDATE SET
+    mode = excluded.mode,
+    mtime = excluded.mtime,
+    sz = excluded.sz,
+    data = excluded.data
+"""
+
+_SQLAR_CHUNK_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS sqlar_chunk(
+        name TEXT, -- name of the member in sqlar
+        seq INT, -- position of the chunk in the member
+        sz INT, -- original chunk size
+        data BLOB, -- compressed chunk content
+        PRIMARY KEY(name, seq)
+    )""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_chunk_delete
+    AFTER DELETE ON sqlar BEGIN
+        DELETE FROM sqlar_chunk WHERE name = old.name;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_chunk_rename
+    AFTER UPDATE OF name ON sqlar WHEN new.name != old.name BEGIN
+        UPDATE sqlar_chunk SET name = new.name WHERE name = old.name;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_chunk_replace
+    AFTER UPDATE OF data ON sqlar WHEN new.data IS NOT NULL BEGIN
+        DELETE FROM sqlar_chunk WHERE name = new.name;
+    END""",
+]
+
+_SQLAR_APPEND_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS sqlar_append(
+        name TEXT, -- name of the member in sqlar
+        seq INT, -- position of the segment in the member
+        sz INT, -- original segment size
+        data BLOB, -- compressed segment content
+        PRIMARY KEY(name, seq)
+    )""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_append_delete
+    AFTER DELETE ON sqlar BEGIN
+        DELETE FROM sqlar_append WHERE name = old.name;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_append_rename
+    AFTER UPDATE OF name ON sqlar WHEN new.name != old.name BEGIN
+        UPDATE sqlar_append SET name = new.name WHERE name = old.name;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_append_replace
+    AFTER UPDATE OF data ON sqlar WHEN new.data IS NOT NULL BEGIN
+        DELETE FROM sqlar_append WHERE name = new.name;
+    END""",
+]
+
+_SQLAR_DEDUP_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS sqlar_entry(
+        name TEXT PRIMARY KEY, -- name of the file
+        mode INT, -- access permissions
+        mtime INT, -- last modification time
+        sz INT, -- original file size
+        digest BLOB, -- sha256 of the original content, NULL for directories
+        atime INT,
+        ctime INT
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS sqlar_content(
+        digest BLOB PRIMARY KEY, -- sha256 of the original content
+        refs INT NOT NULL, -- number of entries using the content
+        data BLOB -- compressed content
+    )""",
+    """
+    CREATE VIEW IF NOT EXISTS sqlar(name, mode, mtime, sz, data, atime, ctime) AS
+    SELECT e.name, e.mode, e.mtime, e.sz, c.data, e.atime, e.ctime
+    FROM sqlar_entry e LEFT JOIN sqlar_content c USING (digest)""",
+    # Reference counting, content is deleted with its last entry.
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_entry_insert
+    AFTER INSERT ON sqlar_entry WHEN new.digest IS NOT NULL BEGIN
+        UPDATE sqlar_content SET refs = refs + 1 WHERE digest = new.digest;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_entry_delete
+    AFTER DELETE ON sqlar_entry WHEN old.digest IS NOT NULL BEGIN
+        UPDATE sqlar_content SET refs = refs - 1 WHERE digest = old.digest;
+        DELETE FROM sqlar_content WHERE digest = old.digest AND refs <= 0;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_entry_update
+    AFTER UPDATE OF digest ON sqlar_entry WHEN new.digest IS NOT old.digest BEGIN
+        UPDATE sqlar_content SET refs = refs + 1 WHERE digest = new.digest;
+        UPDATE sqlar_content SET refs = refs - 1 WHERE digest = old.digest;
+        DELETE FROM sqlar_content WHERE digest = old.digest AND refs <= 0;
+    END""",
+    # Writes through the sqlar view. The entry is written first, new content
+    # is then inserted already referenced once.
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_insert
+    INSTEAD OF INSERT ON sqlar BEGIN
+        INSERT INTO sqlar_entry(name, mode, mtime, sz, digest, atime, ctime)
+        VALUES (new.name, new.mode, new.mtime, new.sz, sqlar_digest(new.sz, new.data),
+                new.atime, new.ctime);
+        INSERT INTO sqlar_content(digest, refs, data)
+        SELECT sqlar_digest(new.sz, new.data), 1, new.data WHERE new.data IS NOT NULL
+        ON CONFLICT(digest) DO NOTHING;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_update
+    INSTEAD OF UPDATE ON sqlar BEGIN
+        UPDATE sqlar_entry SET
+            name = new.name,
+            mode = new.mode,
+            mtime = new.mtime,
+            sz = new.sz,
+            digest = CASE WHEN new.sz IS old.sz AND new.data IS old.data THEN digest
+                          ELSE sqlar_digest(new.sz, new.data) END,
+            atime = new.atime,
+            ctime = new.ctime
+        WHERE name = old.name;
+        INSERT INTO sqlar_content(digest, refs, data)
+        SELECT sqlar_digest(new.sz, new.data), 1, new.data
+        WHERE new.data IS NOT NULL AND (new.sz IS NOT old.sz OR new.data IS NOT old.data)
+        ON CONFLICT(digest) DO NOTHING;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS sqlar_delete
+    INSTEAD OF DELETE ON sqlar BEGIN
+        DELETE FROM sqlar_entry WHERE name = old.name;
+    END""",
+]
+
+_SQLAR_ENTRY_INSERT = """
+INSERT INTO sqlar_entry(name, mode, mtime, sz, digest)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+_SQLAR_ENTRY_UPSERT = _SQLAR_ENTRY_INSERT + """ON CONFLICT(name) DO UPDATE SET
+    mode = excluded.mode,
+    mtime = excluded.mtime,
+    sz = excluded.sz,
+    digest = excluded.digest
+"""
+
+_SQLAR_PARENT = """
+CASE WHEN instr(name, '/') = 0 THEN ''
+     ELSE coalesce(nullif(rtrim(rtrim(name, replace(name, '/', '')), '/'), ''), '/')
+END"""
+"""SQL expression for the directory containing member *name*: `''` for
+top-level relative names, `'/'` for top-level absolute names."""
+
+_SQLAR_METADATA_COLUMNS = ["mode", "mtime", "sz", "atime", "ctime"]
+"""Columns stored in the covering metadata indexes, if the table has them."""
+
+PRAGMA_PROFILES = {
+    "bulk": {
+        # page_size only takes effect for new archives
+        "page_size": 65536,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -262144,
+    },
+}
+"""Named sets of SQLite pragmas that can be passed as *pragmas* to
+`SQLiteArchive`.
+
+`"bulk"` tunes the archive for loading many files: WAL journaling, fewer
+fsyncs, a 256 MiB page cache and 64 KiB pages for new archives. Archives
+opened read-only only get the pragmas that don't write to the file.
+"""
+
+_WRITE_PRAGMAS = frozenset(["page_size", "journal_mode", "auto_vacuum"])
+"""Pragmas that write to the database file, skipped on read-only connections."""
+
+_BATCH_MAX_ROWS = 1000
+_BATCH_MAX_BYTES = 8 * 1024 * 1024
+
+_EXTRACT_BUFFER_SIZE = 1024 * 1024
+"""Members larger than this are extracted in chunks of this size."""
+
+_STREAM_MIN_SIZE = 1024 * 1024
+"""Files larger than this are streamed into the archive."""
+
+_SAMPLE_SIZE = 1024 * 1024
+_SAMPLE_MAX_RATIO = 0.95
+"""Files whose first `_SAMPLE_SIZE` bytes don't compress below this ratio are
+stored without compressing the rest."""
+
+_BLOB_CHUNK_SIZE = 64 * 1024
+"""Number of bytes moved through a blob handle at a time."""
+
+_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+"""Size at which member data being written is spooled to disk."""
+
+_MAX_IDLE_READERS = 8
+"""Number of idle read-only connections a pooled archive keeps open."""
+
+_IMMUTABLE_LAYOUTS = LRUCache(256)
+"""Results of the schema checks of archives opened immutable, keyed by the
+identity of the file."""
+_IMMUTABLE_LAYOUTS_LOCK = threading.Lock()
+
+
 class SQLiteArchiveException(Exception):
     pass
 
 
 def _get_deflated_decompressor():
-    return zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+    # sqlar members are written with zlib's compress(), i.e. they carry the
+    # zlib header and trailer.
+    return zlib.decompressobj()
 
 
 def _get_deflated_compressor(level=-1):
-    return zlib.compressobj(level=level, method=zlib.DEFLATED, wbits=-zlib.MAX_WBITS)
+    return zlib.compressobj(level=level)
+
+
+def _seek_target(pos, size, offset, whence):
+    if whence == io.SEEK_SET:
+        target = offset
+    elif whence == io.SEEK_CUR:
+        target = pos + offset
+    elif whence == io.SEEK_END:
+        target = size + offset
+    else:
+        raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(whence))
+    if target < 0:
+        raise ValueError("negative seek position {}".format(target))
+    return target
+
+
+def _copy_to_blob(conn, table, rowid, source, chunk_size=_BLOB_CHUNK_SIZE):
+    with conn.blobopen(table, "data", rowid) as blob:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            blob.write(chunk)
+
+
+def _spool_member(source, spool, compression, level):
+    """Copy the content of member file *source* to *spool*, compressed if
+    *compression* is `SQLAR_DEFLATED` and the result is smaller, and return
+    its original size."""
+    compressor = None
+    if compression == SQLAR_DEFLATED:
+        compressor = _get_deflated_compressor(level or zlib.Z_DEFAULT_COMPRESSION)
+    size = 0
+    while True:
+        chunk = source.read(_BLOB_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        spool.write(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        spool.write(compressor.flush())
+        # Same rule as compress_data, only keep smaller results.
+        if spool.tell() >= size:
+            source.seek(0)
+            spool.seek(0)
+            spool.truncate()
+            _spool_member(source, spool, SQLAR_STORED, level)
+    return size
 
 
 def compress_data(data, level=None):
@@ -87,6 +364,28 @@ def compress_data(data, level=None):
     return compressed_data if len(compressed_data) < len(data) else data
 
 
+def _sqlar_digest(size, data):
+    """Digest identifying member content in a deduplicated archive.
+
+    This is the SHA-256 of the original content, so identical files share
+    their content regardless of how they were compressed. It is registered
+    as the SQL function `sqlar_digest(sz, data)`.
+    """
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if size != -1:
+        data = decompress_data(data, size)
+    return hashlib.sha256(data).digest()
+
+
+def _file_digest(f):
+    digest = hashlib.file_digest(f, "sha256").digest()
+    f.seek(0)
+    return digest
+
+
 def decompress_data(data, size):
     """Decompress data compressed with `compress_data`.
 
@@ -105,40 +404,331 @@ def decompress_data(data, size):
     else:
         return zlib.decompress(data)
 
-def _decompress_row(path, row):
+def _decompress_row(path, row, make_parents=True):
     name, mode, mtime, size, data = row
     complete_path = path / name
-    complete_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(complete_path, "wb") as f:
-        f.write(decompress_data(data, size))
+    if make_parents:
+        complete_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if size == 0 and data is None:
+        complete_path.mkdir(exist_ok=True)
+    elif size == -1:
+        complete_path.unlink(missing_ok=True)
+        complete_path.symlink_to(data.decode() if isinstance(data, bytes) else data)
+        return
+    else:
+        with open(complete_path, "wb") as f:
+            f.write(decompress_data(data, size))
     
     complete_path.chmod(mode)
     info = complete_path.stat()
     os.utime(complete_path, times=(info.st_atime, mtime))
 
 
-def _init_archive(filename, mode):
+def _deflate_file(f, level):
+    """Compress the open binary file *f* into a spooled temporary file.
+
+    A sample from the start of the file is compressed first. If it doesn't
+    compress well the rest of the file isn't compressed at all. Like
+    `compress_data`, the compressed data is only used if it is smaller than
+    the original.
+
+    Returns:
+        A tuple `(source, size)` where *source* is a file positioned at the
+        start of the content to store, either the compressed spool or *f*,
+        and *size* is the original size.
+    """
+    compressor = _get_deflated_compressor(level or zlib.Z_DEFAULT_COMPRESSION)
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+
+    sample = f.read(_SAMPLE_SIZE)
+    size = len(sample)
+    spool.write(compressor.compress(sample))
+    probe = spool.tell() + len(compressor.copy().flush())
+    if probe >= size * _SAMPLE_MAX_RATIO:
+        spool.close()
+        f.seek(0, io.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        return f, size
+
+    while True:
+        chunk = f.read(_BLOB_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+
+    if spool.tell() >= size:
+        spool.close()
+        f.seek(0)
+        return f, size
+    f.close()
+    spool.seek(0)
+    return spool, size
+
+
+def _compress(data, compression, level):
+    return compress_data(data, level) if compression == SQLAR_DEFLATED else data
+
+
+def _read_stream(path, compression, level):
+    f = open(path, "rb")
+    return _deflate_file(f, level)[0] if compression == SQLAR_DEFLATED else f
+
+
+def _read_file(filename, arcname, compression, level, dedup=False, exists=None):
+    """Read and compress a file, returning its *sqlar* row.
+
+    The content of files larger than 1 MiB is not read into memory, it is
+    returned as an open binary file to be copied into the archive instead.
+
+    With *dedup* the digest of the content is appended to the row. If
+    *exists* is given and returns true for the digest, the content is
+    already in the archive and isn't compressed yet, the row's data is a
+    callable reading it again in case it is gone by the time it is stored.
+    """
+    path = Path(filename)
+
+    info = path.stat()
+    mode = info.st_mode & 0o777
+    mtime = int(info.st_mtime_ns * 1e-9)
+    size = info.st_size
+    digest = None
+
+    if path.is_symlink():
+        data = str(path.resolve().as_posix())
+        size = -1
+        if dedup:
+            digest = _sqlar_digest(size, data)
+    elif path.is_file() and size > _STREAM_MIN_SIZE:
+        data = open(path, "rb")
+        if dedup:
+            digest = _file_digest(data)
+        if exists and exists(digest):
+            data.close()
+            data = partial(_read_stream, path, compression, level)
+        elif compression == SQLAR_DEFLATED:
+            data, size = _deflate_file(data, level)
+    elif path.is_file():
+        with open(path, "rb") as f:
+            data = f.read()
+        if dedup:
+            digest = hashlib.sha256(data).digest()
+        if exists and exists(digest):
+            data = partial(_compress, data, compression, level)
+        elif compression == SQLAR_DEFLATED:
+            data = compress_data(data, level)
+    elif path.is_dir():
+        data = None
+        size = 0
+    else:
+        raise ValueError("path is not a file, directory or symlink")
+
+    logger.debug(
+        "Write: arcname={}, mode={}, mtime={}, size={}".format(
+            arcname,
+            mode,
+            mtime,
+            size
+        )
+    )
+    row = str(Path(arcname).as_posix()), mode, mtime, size, data
+    return row + (digest,) if dedup else row
+
+
+def _is_stream(data):
+    return not (data is None or callable(data)
+                or isinstance(data, (str, bytes, bytearray, memoryview)))
+
+
+def _bounded_map(pool, fn, iterable, window):
+    """Like `Executor.map` but with at most *window* calls in flight."""
+    pending = deque()
+    try:
+        for args in iterable:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern):
+    return re.compile(fnmatch.translate(pattern))
+
+
+def _sqlar_fnmatch(pattern, name):
+    return _compile_pattern(pattern).match(name) is not None
+
+
+def _fnmatch_to_glob(pattern):
+    """Translate an *fnmatch* pattern to an SQLite `GLOB` pattern.
+
+    Returns:
+        The `GLOB` pattern, or `None` if the pattern uses bracket expressions
+        that `GLOB` reads differently.
+    """
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c != "[":
+            parts.append(c)
+            continue
+        j = i
+        if j < n and pattern[j] == "!":
+            j += 1
+        if j < n and pattern[j] == "]":
+            j += 1
+        while j < n and pattern[j] != "]":
+            j += 1
+        if j >= n:
+            # An unclosed bracket is a literal in fnmatch.
+            parts.append("[[]")
+            continue
+        chars = pattern[i:j]
+        if chars.startswith("^"):
+            return None
+        if chars.startswith("!"):
+            chars = "^" + chars[1:]
+        parts.append("[" + chars + "]")
+        i = j + 1
+    return "".join(parts)
+
+
+def _pattern_condition(pattern):
+    """Returns an SQL condition on `name` matching the *fnmatch* *pattern*,
+    and its arguments.
+
+    The literal start of the pattern becomes a range on `name`, so SQLite
+    finds the candidates in the index, and the rest of the pattern is matched
+    with `GLOB`, or with the registered `sqlar_fnmatch` function when it
+    can't be expressed as a `GLOB` pattern.
+    """
+    glob = _fnmatch_to_glob(pattern)
+    if glob is None:
+        condition, args = "sqlar_fnmatch(?, name)", (pattern,)
+    else:
+        condition, args = "name GLOB ?", (glob,)
+    prefix = re.match(r"[^*?\[]*", pattern).group()
+    if prefix:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        condition = "name >= ? AND name < ? AND " + condition
+        args = (prefix, upper) + args
+    return condition, args
+
+
+def _init_archive(filename, mode, pragmas=None, dedup=False, check_same_thread=True):
     if filename == ":memory:":
-        conn = sqlite3.connect(filename)
+        conn = sqlite3.connect(filename, check_same_thread=check_same_thread)
         mode = "rwc"
     else:
         if mode == "memory":
-            uri = "file:{}".format(filename)
+            uri = "file:{}?mode=memory".format(filename)
+        elif mode == "immutable":
+            uri = Path(filename).absolute().as_uri() + "?mode=ro&immutable=1"
         else:
-            uri = Path(filename).absolute().as_uri()
+            uri = "{}?mode={}".format(Path(filename).absolute().as_uri(), mode)
+
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+        if mode == "immutable":
+            # SQLite caps this at its compile-time maximum.
+            conn.execute("PRAGMA mmap_size={}".format(os.stat(filename).st_size))
+
+    if isinstance(pragmas, str):
+        pragmas = PRAGMA_PROFILES[pragmas]
+    writable = "w" in mode or mode == "memory"
+    for pragma, value in (pragmas or {}).items():
+        # Read-only connections can't change the database file
+        if writable or pragma not in _WRITE_PRAGMAS:
+            conn.execute("PRAGMA {}={}".format(pragma, value))
 
-        conn = sqlite3.connect("{}?mode={}".format(uri, mode), uri=True)
+    conn.create_function("sqlar_digest", 2, _sqlar_digest, deterministic=True)
+    conn.create_function("sqlar_fnmatch", 2, _sqlar_fnmatch, deterministic=True)
 
-    if "w" in mode or mode == "memory":
+    if writable:
         with conn as c:
+            if dedup and not _sqlar_table_exists(c):
+                for statement in _SQLAR_DEDUP_SCHEMA:
+                    c.execute(statement)
             c.execute(_SQLAR_TABLE_SCHEMA)
     return conn, mode
 
 
+def _is_dedup_sqlar(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlar_content'"
+    ).fetchone() is not None
+
+
+def _has_parent_column(conn, table):
+    return any(
+        field[1] == "parent"
+        for field in conn.execute("PRAGMA table_xinfo('{}')".format(table))
+    )
+
+
+def _has_metadata_index(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+        ("{}_meta".format(table),)
+    ).fetchone() is not None
+
+
+def _metadata_columns(conn, table):
+    columns = [field[1] for field in conn.execute("PRAGMA table_info('{}')".format(table))]
+    return [column for column in _SQLAR_METADATA_COLUMNS if column in columns]
+
+
+def _add_metadata_indexes(conn, table, covering=True):
+    """Add the indexed `parent` column to *table* if it is missing.
+
+    The column is generated, so it is maintained by SQLite for rows written by
+    any program, but it requires SQLite 3.31 or later to open the archive.
+
+    With *covering*, the metadata columns are stored in the `parent` index
+    and in a second index on `name`, so listings are read from the indexes
+    without touching the table pages holding the data. Indexes created by
+    earlier versions are rebuilt.
+    """
+    with conn as c:
+        if not _has_parent_column(c, table):
+            c.execute(
+                "ALTER TABLE {} ADD COLUMN parent TEXT GENERATED ALWAYS AS ({}) VIRTUAL".format(
+                    table,
+                    _SQLAR_PARENT
+                )
+            )
+        columns = ["parent", "name"]
+        if covering:
+            metadata = _metadata_columns(c, table)
+            columns += metadata
+            c.execute("CREATE INDEX IF NOT EXISTS {0}_meta ON {0}({1})".format(
+                table,
+                ", ".join(["name"] + metadata)
+            ))
+        indexed = c.execute("PRAGMA index_info('{}_parent')".format(table)).fetchall()
+        if indexed and len(indexed) != len(columns):
+            c.execute("DROP INDEX {}_parent".format(table))
+        c.execute("CREATE INDEX IF NOT EXISTS {0}_parent ON {0}({1})".format(
+            table,
+            ", ".join(columns)
+        ))
+
+
 def _sqlar_table_exists(conn):
     cur = conn.cursor()
     field_info = cur.execute("PRAGMA table_info('sqlar')").fetchall()
+    if _is_dedup_sqlar(conn):
+        # The columns of the sqlar view don't report the primary key.
+        field_info = [field[:5] + (int(field[1] == "name"),) for field in field_info]
     for field in _SQLAR_TABLE_INFO_EXPECTED_RESULT:
         if field not in field_info:
             return False
@@ -189,6 +779,309 @@ def is_sqlar(filename):
     return flag
 
 
+class MemberReader(io.RawIOBase):
+    """Read-only file object streaming the content of an archive member.
+
+    The content is read from an SQLite blob handle in chunks of *chunk_size*
+    bytes. Deflated members are decompressed incrementally, so at most one
+    chunk of compressed data is held in memory besides the caller's buffer.
+
+    Seeking backwards in a deflated member restarts decompression from the
+    beginning of the member.
+    """
+
+    def __init__(self, blob, size, stored, chunk_size=_BLOB_CHUNK_SIZE):
+        super().__init__()
+        self._blob = blob
+        self._size = size
+        self._stored = stored
+        self._chunk_size = chunk_size
+        self._pos = 0
+        self._decompressor = None if stored else _get_deflated_decompressor()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def readinto(self, b):
+        self._checkClosed()
+        with memoryview(b) as view, view.cast("B") as view:
+            if self._stored:
+                data = self._blob.read(len(view))
+            else:
+                data = self._inflate(len(view))
+            n = len(data)
+            view[:n] = data
+        self._pos += n
+        return n
+
+    def _inflate(self, max_length):
+        decompressor = self._decompressor
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail or self._blob.read(self._chunk_size)
+            if not data:
+                raise EOFError("compressed data ended before the end-of-stream marker")
+            out = decompressor.decompress(data, max_length)
+            if out:
+                return out
+        return b""
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        target = _seek_target(self._pos, self._size, offset, whence)
+        if self._stored:
+            self._blob.seek(min(target, len(self._blob)))
+            self._pos = target
+            return self._pos
+
+        if target < self._pos:
+            self._blob.seek(0)
+            self._decompressor = _get_deflated_decompressor()
+            self._pos = 0
+        while self._pos < target:
+            skipped = len(self._inflate(min(target - self._pos, self._chunk_size)))
+            if not skipped:
+                break
+            self._pos += skipped
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._blob.close()
+        super().close()
+
+
+class ChunkedMemberReader(io.RawIOBase):
+    """Read-only file object over a member stored in the chunked layout.
+
+    Only the chunk containing the current position is decompressed and held
+    in memory, seeking is therefore cheap in both directions.
+    """
+
+    def __init__(self, conn, name, size):
+        super().__init__()
+        self._conn = conn
+        self._name = name
+        self._size = size
+        self._chunk_size, = conn.execute(
+            "SELECT sz FROM sqlar_chunk WHERE name = ? AND seq = 0",
+            (name,)
+        ).fetchone()
+        self._pos = 0
+        self._seq = None
+        self._chunk = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def readinto(self, b):
+        self._checkClosed()
+        if self._pos >= self._size:
+            return 0
+        seq, offset = divmod(self._pos, self._chunk_size)
+        if seq != self._seq:
+            size, data = self._conn.execute(
+                "SELECT sz, data FROM sqlar_chunk WHERE name = ? AND seq = ?",
+                (self._name, seq)
+            ).fetchone()
+            self._chunk = decompress_data(data, size)
+            self._seq = seq
+        with memoryview(b) as view, view.cast("B") as view:
+            data = self._chunk[offset:offset + len(view)]
+            n = len(data)
+            view[:n] = data
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        self._pos = _seek_target(self._pos, self._size, offset, whence)
+        return self._pos
+
+    def close(self):
+        self._chunk = b""
+        super().close()
+
+
+class SegmentedMemberReader(io.RawIOBase):
+    """Read-only file object over a member stored in appended segments.
+
+    The segments are read one after the other, each through a
+    `MemberReader`, so the member is streamed like a member in one blob.
+    """
+
+    def __init__(self, conn, name):
+        super().__init__()
+        self._conn = conn
+        self._segments = conn.execute(
+            "SELECT rowid, sz, length(data) FROM sqlar_append WHERE name = ? ORDER BY seq",
+            (name,)
+        ).fetchall()
+        self._offsets = list(accumulate((size for _, size, _ in self._segments), initial=0))
+        self._size = self._offsets[-1]
+        self._pos = 0
+        self._index = None
+        self._reader = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def readinto(self, b):
+        self._checkClosed()
+        if self._pos >= self._size:
+            return 0
+        # Empty segments share their offset with the next one
+        index = bisect.bisect_right(self._offsets, self._pos) - 1
+        if index != self._index:
+            self._close_segment()
+            rowid, size, length = self._segments[index]
+            stored = size == length
+            blob = self._conn.blobopen("sqlar_append", "data", rowid, readonly=True)
+            self._reader = MemberReader(blob, size, stored)
+            self._index = index
+        self._reader.seek(self._pos - self._offsets[index])
+        n = self._reader.readinto(b)
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        self._pos = _seek_target(self._pos, self._size, offset, whence)
+        return self._pos
+
+    def _close_segment(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def close(self):
+        self._close_segment()
+        super().close()
+
+
+class MemberWriter(io.RawIOBase):
+    """Write-only file object storing a new member in the archive.
+
+    Written data is compressed incrementally and spooled to a temporary file
+    that is kept in memory until it grows beyond 8 MiB. The member is stored
+    in the archive, replacing any member with the same name, when the file
+    object is closed.
+    """
+
+    def __init__(self, archive, name, compression, level, unix_mode=0o777):
+        super().__init__()
+        self._archive = archive
+        self._name = name
+        self._unix_mode = unix_mode
+        self._size = 0
+        self._raw = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        self._compressor = None
+        self._compressed = None
+        self._hash = hashlib.sha256() if archive.dedup else None
+        if compression == SQLAR_DEFLATED:
+            self._compressor = _get_deflated_compressor(level or zlib.Z_DEFAULT_COMPRESSION)
+            self._compressed = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._checkClosed()
+        with memoryview(b) as view:
+            self._raw.write(view)
+            if self._hash:
+                self._hash.update(view)
+            if self._compressor:
+                self._compressed.write(self._compressor.compress(view))
+            n = view.nbytes
+        self._size += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            source = self._raw
+            if self._compressor:
+                self._compressed.write(self._compressor.flush())
+                # Same rule as compress_data, only keep smaller results.
+                if self._compressed.tell() < self._size:
+                    source = self._compressed
+            source.seek(0)
+            self._archive._store(
+                self._name,
+                self._unix_mode,
+                int(time.time()),
+                self._size,
+                source,
+                self._hash.digest() if self._hash else None
+            )
+        finally:
+            self._raw.close()
+            if self._compressed:
+                self._compressed.close()
+            super().close()
+
+
+class CheckedOutReader(io.RawIOBase):
+    """Member file object of a pooled archive owning its connection.
+
+    The read-only connection is checked out of the pool of the archive for
+    the lifetime of the file object, so the read snapshot it holds doesn't
+    affect other reads of the thread. It is returned to the pool when the
+    file object is closed.
+    """
+
+    def __init__(self, archive, conn, raw):
+        super().__init__()
+        self._archive = archive
+        self._conn = conn
+        self._raw = raw
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._raw.tell()
+
+    def readinto(self, b):
+        return self._raw.readinto(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._raw.seek(offset, whence)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._raw.close()
+        finally:
+            self._archive._checkin(self._conn)
+            super().close()
+
 
 class SQLiteArchive():
     """An SQLite Archive.
@@ -216,16 +1109,91 @@ class SQLiteArchive():
     Additional tables can be stored in the database to store additional metadata
     for the files.
 
+    Members can optionally be stored in a chunked layout, where the content is
+    split into fixed-size, independently compressed chunks kept in the side
+    table *sqlar_chunk*:
+    ```sql
+    CREATE TABLE sqlar_chunk(
+                    name TEXT,
+                    seq INT,
+                    sz INT,
+                    data BLOB,
+                    PRIMARY KEY(name, seq)
+                )
+    ```
+    The member keeps its row in *sqlar* with the original size and
+    `data = NULL`. Reading a range of a chunked member only decompresses the
+    chunks overlapping the range. Chunked members can only be read by
+    *pysqlar*, other members are unaffected.
+
+    Archives opened with *append_segments* store data appended with
+    `writestr(mode="ab")` as a new segment in the side table *sqlar_append*,
+    which has the same columns as *sqlar_chunk*. The first append moves the
+    content of the member into segment 0, the member keeps its row in *sqlar*
+    with the total size and `data = NULL`, and reads stitch the segments
+    together. This layout isn't standard: like chunked members, members with
+    segments can only be read by *pysqlar*, until `compact` merges the
+    segments back into a standard member.
+
+    Archives created with *dedup* store every distinct file content once.
+    Members are kept in *sqlar_entry*, which references the content in
+    *sqlar_content* by the SHA-256 digest of the original data:
+    ```sql
+    CREATE TABLE sqlar_entry(
+                    name TEXT PRIMARY KEY,
+                    mode INT,
+                    mtime INT,
+                    sz INT,
+                    digest BLOB,
+                    atime INT,
+                    ctime INT
+                )
+    CREATE TABLE sqlar_content(
+                    digest BLOB PRIMARY KEY,
+                    refs INT NOT NULL,
+                    data BLOB
+                )
+    ```
+    *sqlar* is then a view joining the two tables, so standard readers can
+    still read the archive. Triggers count the references to each content
+    and delete it with its last member, and make inserts, updates and
+    deletes through the view work from *pysqlar* connections. Writing
+    through the view needs the `sqlar_digest` SQL function registered by
+    *pysqlar*.
+
+    Archives opened for writing get a generated `parent` column holding the
+    directory of each member, indexed together with `name`, so listing a
+    directory only reads the entries in it. The metadata columns are also
+    stored in that index and in the index *sqlar_meta* on `name`, so
+    `infolist`, `namelist`, `getinfo` and directory listings don't read the
+    table pages holding the data. Existing archives are migrated when they
+    are opened for writing.
+
+    A *pooled* archive can be shared between threads. Writes go through a
+    single connection and are serialized, reads use a read-only connection
+    per thread and run concurrently with each other and, as the archive is
+    switched to WAL journaling, with writes. Reads made by a thread while it
+    writes, e.g. inside `batch`, use the writing connection and see its
+    uncommitted changes.
+
     Attributes:
         filename: The filename of the SQLite Archive.
         mode: The current mode of the opened database.
+        dedup: `True` if the archive stores content deduplicated.
     """
 
     def __init__(self,
                  filename,
                  mode="ro",
                  compression=SQLAR_STORED,
-                 compress_level=None):
+                 compress_level=None,
+                 chunk_size=None,
+                 append_segments=False,
+                 pragmas=None,
+                 dedup=False,
+                 metadata_cache=0,
+                 content_cache=0,
+                 pooled=False):
         """Open a SQLite Archive.
 
         Args:
@@ -236,7 +1204,11 @@ class SQLiteArchive():
                 values are: `"ro"` Read-Only, `"rw"` Read-Write, `"rwc"`
                 Read-Write-Create and `"memory"` opens a memory-only database.
                 See [SQLite URI documentation](https://www.sqlite.org/uri.html)
-                for more information
+                for more information. `"immutable"` opens a read-only
+                archive that no program modifies while it is open, e.g. for
+                serving published archives: SQLite takes no locks, the file
+                is memory-mapped, and the schema checks are only run the
+                first time the same file is opened.
             compression (optional): Controls the compression of the archive.
                 Allowed values are `SQLAR_STORED` which stores the data
                 uncompressed in the archive and `SQLAR_DEFLATED` which stores
@@ -245,22 +1217,262 @@ class SQLiteArchive():
                 documentation for allowed values. If compression is
                 `SQLAR_DEFLATED` the default is
                 `zlib.Z_DEFAULT_COMPRESSION`.
+            chunk_size (optional): Store files written to the archive in the
+                chunked layout with chunks of *chunk_size* bytes. The default
+                `None` stores files as standard sqlar members.
+            append_segments (optional): Store data appended with
+                `writestr(mode="ab")` as new segments of the member instead of
+                rewriting it, see `compact`. Members with segments can only be
+                read by *pysqlar* until they are compacted, so the default
+                `False` keeps appended members standard.
+            pragmas (optional): SQLite pragmas applied when opening the
+                archive, either a dict mapping pragma names to values or the
+                name of a profile in `PRAGMA_PROFILES`, e.g. `"bulk"`.
+            dedup (optional): Create a new archive storing identical content
+                only once. Existing deduplicated archives are detected when
+                they are opened.
+            metadata_cache (optional): The number of names whose `getinfo`
+                result, including `None` for missing members, is kept in an
+                LRU cache. The cache is cleared by any write made through
+                this archive and, checked with `PRAGMA data_version`, by
+                commits of other connections. The default 0 disables it.
+            content_cache (optional): The number of bytes of decompressed
+                member content kept in an LRU cache by `read` and `readview`.
+                Members larger than this are never cached. The cache is
+                cleared like the metadata cache. The default 0 disables it.
+            pooled (optional): Allow the archive to be used from several
+                threads, reading through read-only connections checked out
+                of a pool. Archives opened for writing are switched to WAL
+                journaling.
         
         Raises:
-            `SQLiteArchiveException` if the *filename* is not a SQLite Archive.
+            `SQLiteArchiveException` if the *filename* is not a SQLite Archive,
+            or *dedup* is set for an existing archive that isn't
+            deduplicated.
+            ValueError: Both *dedup* and *chunk_size* are set, or *pooled*
+                is set for a memory-only database.
         """
+        if pooled and (filename == ":memory:" or mode == "memory"):
+            raise ValueError("a memory-only database can't be pooled")
         self.filename = filename
-        self._conn, self.mode = _init_archive(filename, mode)
-        if not _sqlar_table_exists(self._conn):
-            raise SQLiteArchiveException("{} is not a sqlite archive".format(self.filename))
-        self.is_expanded = _is_expanded_sqlar(self._conn)
+        self._conn, self.mode = _init_archive(filename, mode, pragmas, dedup, not pooled)
+        if self.mode == "immutable":
+            info = os.stat(filename)
+            key = (os.path.realpath(filename), info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+            with _IMMUTABLE_LAYOUTS_LOCK:
+                layout = _IMMUTABLE_LAYOUTS.get(key)
+            if layout is MISSING:
+                layout = self._check_layout()
+                with _IMMUTABLE_LAYOUTS_LOCK:
+                    _IMMUTABLE_LAYOUTS.put(key, layout)
+        else:
+            layout = self._check_layout()
+        self.dedup, self._has_parent, self._has_metadata_index, self.is_expanded = layout
+        if dedup and not self.dedup:
+            raise SQLiteArchiveException("{} is not a deduplicated archive".format(self.filename))
+        if chunk_size and self.dedup:
+            raise ValueError("the chunked layout can't be used in a deduplicated archive")
+        self._data_table = "sqlar_content" if self.dedup else "sqlar"
+        self._entry_table = "sqlar_entry" if self.dedup else "sqlar"
+        self._queries = {}
         self._compression = compression
         self._compress_level = compress_level
-        self.statinfo = os.stat(self.filename)
+        self._chunk_size = chunk_size
+        self._append_segments = append_segments
+        self._batch_depth = 0
+        self._metadata_cache = LRUCache(metadata_cache) if metadata_cache else None
+        self._content_cache = LRUCache(content_cache, len) if content_cache else None
+        self.statinfo = None if filename == ":memory:" else os.stat(self.filename)
+
+        self._pooled = pooled
+        self._pragmas = pragmas
+        self._lock = threading.RLock()
+        self._owner = None
+        self._local = threading.local()
+        # Read-only connections of a pooled archive, all of them and the
+        # idle ones, guarded by _readers_lock
+        self._readers = set()
+        self._idle_readers = []
+        self._readers_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._probe = None
+        if pooled:
+            if "w" in self.mode:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            if (metadata_cache or content_cache) and self.mode != "immutable":
+                # Only used for PRAGMA data_version, which changes when any
+                # other connection, including the writer, commits.
+                self._probe, _ = _init_archive(filename, "ro", check_same_thread=False)
+
+    def _check_layout(self):
+        """Checks the schema of the archive, migrating it if it is writable.
+
+        Returns:
+            A tuple `(dedup, has_parent, has_metadata_index, is_expanded)`.
+
+        Raises:
+            `SQLiteArchiveException` if the archive has no *sqlar* table.
+        """
+        conn = self._conn
+        if not _sqlar_table_exists(conn):
+            raise SQLiteArchiveException("{} is not a sqlite archive".format(self.filename))
+        dedup = _is_dedup_sqlar(conn)
+        table = "sqlar_entry" if dedup else "sqlar"
+        if "w" in self.mode or self.mode == "memory":
+            # Entries of deduplicated archives don't hold the data, their
+            # table is as small as an index.
+            _add_metadata_indexes(conn, table, covering=not dedup)
+        return (
+            dedup,
+            _has_parent_column(conn, table),
+            _has_metadata_index(conn, table),
+            _is_expanded_sqlar(conn)
+        )
 
     def close(self):
         """Close the database."""
+        with self._readers_lock:
+            readers, self._readers, self._idle_readers = self._readers, set(), []
+        for conn in readers:
+            conn.close()
+        if self._probe:
+            self._probe.close()
         self._conn.close()
+
+    @contextmanager
+    def _writing(self):
+        # Serializes the use of the writing connection between threads and
+        # records which thread is using it.
+        with self._lock:
+            owner, self._owner = self._owner, threading.get_ident()
+            try:
+                yield
+            finally:
+                self._owner = owner
+
+    @contextmanager
+    def _transaction(self):
+        # Inside batch() statements join the batch transaction instead of
+        # committing on their own.
+        with self._writing():
+            if self._batch_depth:
+                yield self._conn
+            else:
+                with self._conn as c:
+                    yield c
+
+    def _checkout(self):
+        """Takes a read-only connection out of the pool, opening a new one if
+        none is idle. It must be returned with `_checkin`."""
+        with self._readers_lock:
+            if self._idle_readers:
+                return self._idle_readers.pop()
+        conn, _ = _init_archive(
+            self.filename,
+            "immutable" if self.mode == "immutable" else "ro",
+            self._pragmas,
+            check_same_thread=False
+        )
+        with self._readers_lock:
+            self._readers.add(conn)
+        return conn
+
+    def _checkin(self, conn):
+        """Returns a connection taken with `_checkout` to the pool, closing it
+        if enough connections are idle already."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._readers_lock:
+            if conn in self._readers and len(self._idle_readers) < _MAX_IDLE_READERS:
+                self._idle_readers.append(conn)
+                return
+            self._readers.discard(conn)
+        conn.close()
+
+    def _reads_pooled(self):
+        # The thread writing reads its own changes on the writing connection.
+        return self._pooled and self._owner != threading.get_ident()
+
+    @contextmanager
+    def _reading(self):
+        """Context manager yielding a connection for read-only statements.
+
+        Pooled archives read through a connection checked out of the pool
+        for the block, in a read transaction, so all statements in the block
+        see the same state of the archive. Nested blocks of the thread join
+        the transaction of the outermost one.
+        """
+        if not self._reads_pooled():
+            with self._writing():
+                yield self._conn
+            return
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        local.conn = conn
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            local.conn = None
+            self._checkin(conn)
+
+    def _query(self, sql, args):
+        """Yields the rows of a read-only query as they are read.
+
+        Pooled archives run the query on a connection checked out until the
+        rows are exhausted or the generator is closed.
+        """
+        if not self._reads_pooled():
+            yield from self._conn.execute(sql, args)
+            return
+        conn = self._checkout()
+        cursor = conn.cursor()
+        try:
+            yield from cursor.execute(sql, args)
+        finally:
+            # Resets the statement, which would hold on to its snapshot.
+            cursor.close()
+            self._checkin(conn)
+
+    @contextmanager
+    def batch(self):
+        """Group all writes made in the block into a single transaction.
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises. Batches can be nested, only the outermost batch
+        commits. The write lock of the database is taken when the outermost
+        batch starts.
+
+        ```python
+        with ar.batch():
+            for name, data in files:
+                ar.writestr(name, data)
+        ```
+        """
+        with self._writing():
+            if self._batch_depth:
+                self._batch_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._batch_depth -= 1
+                return
+
+            self._batch_depth = 1
+            try:
+                with self._conn as c:
+                    # Taking the write lock up front keeps other connections
+                    # from committing between the reads and the writes of
+                    # the batch, e.g. of an append.
+                    if not c.in_transaction:
+                        c.execute("BEGIN IMMEDIATE")
+                    yield self
+            finally:
+                self._batch_depth = 0
     
     def getinfo(self, name):
         """Return metadata about a file in the archive.
@@ -272,12 +1484,79 @@ class SQLiteArchive():
             Metadata for file *name* or `None` if there is no such file in the
             archive.
         """
+        cache = self._metadata_cache
+        if cache is not None:
+            token, row = self._cache_get(cache, name)
+            if row is not MISSING:
+                return row
+
         _info = self.infolist(name)
-        try:
-            row = next(iter(_info))
-            return row
-        except StopIteration:
+        row = next(iter(_info), None)
+        if cache is not None:
+            self._cache_put(cache, token, name, row)
+        return row
+
+    def metadata_cache_info(self):
+        """Returns the statistics of the metadata cache.
+
+        Returns:
+            A `CacheInfo` with the number of hits and misses, or `None` if the
+            cache is disabled.
+        """
+        if self._metadata_cache is None:
             return None
+        return self._metadata_cache.info()
+
+    def content_cache_info(self):
+        """Returns the statistics of the content cache.
+
+        Returns:
+            A `CacheInfo` with the number of hits and misses and the cached
+            size in bytes, or `None` if the cache is disabled.
+        """
+        if self._content_cache is None:
+            return None
+        return self._content_cache.info()
+
+    def _data_token(self):
+        # Reads made while the thread is writing may see uncommitted changes,
+        # which would stay cached if they were rolled back.
+        if self._owner == threading.get_ident():
+            return None
+        if self.mode == "immutable":
+            return 0
+        if self._probe:
+            version, = self._probe.execute("PRAGMA data_version").fetchone()
+            return version
+        # total_changes counts the writes made through this connection,
+        # data_version changes when another connection commits.
+        version, = self._conn.execute("PRAGMA data_version").fetchone()
+        return self._conn.total_changes, version
+
+    def _cache_get(self, cache, key):
+        """Looks up *key* in *cache* after clearing it if the archive changed.
+
+        Returns:
+            A tuple `(token, value)` where *value* is `MISSING` on a miss, and
+            *token* is to be passed to `_cache_put`. The cache isn't used and
+            *token* is `None` while the calling thread is writing or inside a
+            read transaction, whose reads may be older than the token.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            # Reads would see the snapshot of the enclosing read transaction,
+            # which may be older than the token.
+            return None, MISSING
+        with self._cache_lock:
+            token = self._data_token()
+            if token is None:
+                return None, MISSING
+            cache.validate(token)
+            return token, cache.get(key)
+
+    def _cache_put(self, cache, token, key, value):
+        if token is not None:
+            with self._cache_lock:
+                cache.put(key, value, token)
 
     def _fieldlist(self, calc=False):
         fields = [
@@ -287,8 +1566,16 @@ class SQLiteArchive():
             'sz'
         ]
         if calc:
-            fields += ['case when sz == 0 and data is null then true else false end is_dir',
-                       'case when sz == -1 and data is not null then true else false end is_sym']
+            if self.dedup:
+                no_data = 'digest is null'
+            elif self._has_metadata_index:
+                # Only looked up for empty members and links, so scans of
+                # the covering indexes don't read the table for other rows.
+                no_data = '(select d.data is null from sqlar d where d.rowid = sqlar.rowid)'
+            else:
+                no_data = 'data is null'
+            fields += [f'case when sz == 0 and {no_data} then true else false end is_dir',
+                       f'case when sz == -1 and not {no_data} then true else false end is_sym']
         if self.is_expanded:
             fields += [
                 'atime',
@@ -296,17 +1583,28 @@ class SQLiteArchive():
             ]
         return fields
 
+    def _metadata_source(self):
+        # Lookups by name would otherwise use the primary key index and read
+        # atime and ctime from the table row, after the data.
+        if self._has_metadata_index:
+            return "sqlar INDEXED BY sqlar_meta"
+        return self._entry_table
+
     def infolist(self, name=None):
         """Returns a list of metadata for all files in the archive."""
 
-        fields = self._fieldlist(calc=True)
-        select_list = ', '.join(fields)
-        sql = f"""
+        # The layout can't change while the archive is open, so the query is
+        # only built once and always found in the statement cache.
+        sql = self._queries.get(name is None)
+        if sql is None:
+            fields = self._fieldlist(calc=True)
+            select_list = ', '.join(fields)
+            sql = self._queries[name is None] = f"""
                 SELECT 
                 {select_list} 
-                FROM sqlar {'WHERE name = ?' if name != None else ''};
-        """
-        with self._conn as c:
+                FROM {self._metadata_source()} {'WHERE name = ?' if name != None else ''};
+            """
+        with self._reading() as c:
             if name == None:
                 name = []
             else:
@@ -315,96 +1613,667 @@ class SQLiteArchive():
             row = cursor.execute(sql, name).fetchall()
         return row
 
+    def iterinfo(self, patterns=None, after=None, limit=None):
+        """Yields metadata for the members matching any of *patterns*.
+
+        Patterns use *fnmatch* syntax, where `*` also matches `/`, and are
+        matched against the whole name. The matching is done by SQLite, using
+        the index on `name` for the part of each pattern before the first
+        wildcard. Rows are streamed from the cursor as they are read.
+
+        When *after* or *limit* are given the rows are sorted by name, so a
+        large listing can be read a page at a time by passing the name of the
+        last member of the previous page as *after*, see `scandir`.
+
+        Args:
+            patterns (optional): An iterable of patterns, by default all
+                members are returned.
+            after (optional): Only return members with names sorted after
+                *after*.
+            limit (optional): The largest number of rows to return.
+
+        Yields:
+            Rows with the same fields as the rows of `infolist`.
+        """
+        patterns = [str(pattern) for pattern in patterns or ()]
+        select_list = ', '.join(self._fieldlist(calc=True))
+        sql = "SELECT {} FROM {}".format(select_list, self._metadata_source())
+        conditions = []
+        args = ()
+        if patterns and "*" not in patterns:
+            pattern_conditions = []
+            for pattern in patterns:
+                condition, pattern_args = _pattern_condition(pattern)
+                pattern_conditions.append("({})".format(condition))
+                args += pattern_args
+            conditions.append("({})".format(" OR ".join(pattern_conditions)))
+        if after is not None:
+            conditions.append("name > ?")
+            args += (after,)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if after is not None or limit is not None:
+            sql += " ORDER BY name LIMIT ?"
+            args += (-1 if limit is None else limit,)
+        yield from self._query(sql, args)
+
     def namelist(self):
         """Returns a list of all files in the archive."""
-        with self._conn as c:
+        with self._reading() as c:
             rows = c.execute(
-                """
-                SELECT name FROM sqlar;
-                """
+                "SELECT name FROM {};".format(self._entry_table)
             ).fetchall()
         return list(*zip(*rows)) # unpack [(item1,), (item2,), ...] to [item1, item2, ...]
 
-    def open(self, name, mode="r"):
-        raise NotImplementedError()
+    def listdir(self, path=""):
+        """Returns the names of the members directly inside directory *path*.
 
-    def extract(self, member, path=None):
+        The listing is an index lookup on the `parent` column, archives
+        opened read-only that haven't been migrated yet fall back to a range
+        scan of the names starting with *path*.
+
+        Args:
+            path (optional): Name of the directory. The default `""` lists the
+                top level of archives storing relative names, `"/"` the top
+                level of archives storing absolute names.
+
+        Returns:
+            A sorted list of member names.
+        """
+        where, args = self._children(path)
+        with self._reading() as c:
+            rows = c.execute(
+                "SELECT name FROM {} WHERE {} ORDER BY name;".format(self._entry_table, where),
+                args
+            ).fetchall()
+        return [name for name, in rows]
+
+    def scandir(self, path="", after=None, limit=None, offset=0):
+        """Returns metadata for the members directly inside directory *path*.
+
+        The rows have the same fields as the rows of `infolist` and are sorted
+        by name. Large directories can be read a page at a time by passing
+        the name of the last member of the previous page as *after*, which
+        continues from the index instead of skipping rows.
+
+        Args:
+            path (optional): Name of the directory, see `listdir`.
+            after (optional): Only return members with names sorted after
+                *after*.
+            limit (optional): The largest number of rows to return.
+            offset (optional): The number of rows to skip.
+
+        Returns:
+            A list of metadata rows.
+        """
+        where, args = self._children(path)
+        if after is not None:
+            where += " AND name > ?"
+            args += (after,)
+        select_list = ', '.join(self._fieldlist(calc=True))
+        with self._reading() as c:
+            rows = c.execute(
+                "SELECT {} FROM {} WHERE {} ORDER BY name LIMIT ? OFFSET ?;".format(
+                    select_list,
+                    self._entry_table,
+                    where
+                ),
+                args + (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return rows
+
+    def itertree(self, path="", max_depth=None, patterns=None):
+        """Yields metadata for the members inside directory *path*, at any
+        depth.
+
+        The rows are read by a single query over a range of the `parent`
+        index, sorted by directory and then by name, so the members of a
+        directory come together and every directory comes before the members
+        inside it. They are streamed from the cursor as they are read.
+
+        Args:
+            path (optional): Name of the directory, see `listdir`.
+            max_depth (optional): Only return members at most *max_depth*
+                levels below *path*, the members directly inside *path* being
+                at level 1.
+            patterns (optional): *fnmatch* patterns matched against the whole
+                name, see `iterinfo`. Members other than directories are only
+                returned if they match one of them.
+
+        Yields:
+            Rows with the same fields as the rows of `infolist`.
+        """
+        path = path.rstrip("/") or path[:1]
+        # Unmigrated archives are sorted on the expression by SQLite.
+        parent = "parent" if self._has_parent else "({})".format(_SQLAR_PARENT)
+        conditions = []
+        args = ()
+        if path:
+            prefix = path if path == "/" else path + "/"
+            # The range also holds the siblings of path sorted before
+            # path + "/", e.g. "dir.old" for "dir", which are skipped.
+            conditions.append("{0} >= ? AND {0} < ? AND ({0} = ? OR {0} >= ?)".format(parent))
+            args += (path, prefix[:-1] + "0", path, prefix)
+        if max_depth is not None:
+            level = path.count("/") + (0 if path in ("", "/") else 1)
+            conditions.append("length(name) - length(replace(name, '/', '')) < ?")
+            args += (level + max_depth,)
+        if patterns:
+            matches = []
+            for pattern in patterns:
+                condition, pattern_args = _pattern_condition(str(pattern))
+                matches.append("({})".format(condition))
+                args += pattern_args
+            conditions.append("(is_dir OR {})".format(" OR ".join(matches)))
+        select_list = ", ".join(self._fieldlist(calc=True))
+        sql = "SELECT {} FROM {} WHERE {} ORDER BY {}, name".format(
+            select_list,
+            self._entry_table,
+            " AND ".join(conditions) or "1",
+            parent
+        )
+        yield from self._query(sql, args)
+
+    def _children(self, path):
+        """Returns an SQL condition and its arguments matching the members
+        directly inside directory *path*."""
+        path = path.rstrip("/") or path[:1]
+        if self._has_parent:
+            return "parent = ? AND name != ?", (path, path)
+        if not path:
+            return "instr(name, '/') = 0", ()
+        prefix = path if path == "/" else path + "/"
+        # "0" sorts right after "/", so this is the range of names starting
+        # with prefix.
+        return (
+            "name > ? AND name < ? AND instr(substr(name, ?), '/') = 0",
+            (prefix, prefix[:-1] + "0", len(prefix) + 1)
+        )
+
+    def _subtree(self, name):
+        """Returns an SQL condition and its arguments matching member *name*
+        and every member inside it, as a range of the index on `name`."""
+        prefix = name if name == "/" else name + "/"
+        return (
+            "(name = ? OR (name > ? AND name < ?))",
+            (name, prefix, prefix[:-1] + "0")
+        )
+
+    def _has_table(self, c, table):
+        return c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,)
+        ).fetchone() is not None
+
+    def _is_segmented(self, c, name):
+        """Returns `True` if *name* is stored in appended segments. Only
+        meaningful for members with a size and `data = NULL`."""
+        return self._has_table(c, "sqlar_append") and c.execute(
+            "SELECT 1 FROM sqlar_append WHERE name = ? LIMIT 1",
+            (name,)
+        ).fetchone() is not None
+
+    def open(self, name, mode="r", compression=None, compress_level=None):
+        """Access a member of the archive as a binary file-like object.
+
+        The member content is streamed through SQLite's incremental blob I/O,
+        so the memory used does not depend on the size of the member.
+
+        In read mode the returned object is seekable and supports `readinto`.
+        In write mode the member is stored, replacing an existing member with
+        the same name, when the file object is closed.
+
+        Args:
+            name: The name of the file in the archive.
+            mode (optional): `"r"` to read or `"w"` to write the member.
+            compression (optional): Override the *compression* chosen when
+                opening the archive. Only used in write mode.
+            compress_level (optional): Override the *compress_level* chosen when
+                opening the archive. Only used in write mode.
+
+        Returns:
+            An `io.BufferedReader` or `io.BufferedWriter`.
+
+        Raises:
+            KeyError: If *mode* is `"r"` and there is no file *name* in the
+                archive.
+            ValueError: If *mode* is not `"r"` or `"w"`.
+        """
+        if mode == "r":
+            if not self._reads_pooled() or getattr(self._local, "conn", None) is not None:
+                with self._reading() as c:
+                    return io.BufferedReader(self._open_member(c, name), _BLOB_CHUNK_SIZE)
+            # The snapshot read by the open member would otherwise be seen by
+            # later reads of the thread.
+            conn = self._checkout()
+            try:
+                conn.execute("BEGIN")
+                raw = CheckedOutReader(self, conn, self._open_member(conn, name))
+            except BaseException:
+                self._checkin(conn)
+                raise
+            return io.BufferedReader(raw, _BLOB_CHUNK_SIZE)
+        elif mode == "w":
+            writer = MemberWriter(
+                self,
+                str(Path(name).as_posix()),
+                compression or self._compression,
+                compress_level or self._compress_level
+            )
+            return io.BufferedWriter(writer, _BLOB_CHUNK_SIZE)
+        raise ValueError("open() requires mode \"r\" or \"w\"")
+
+    def _open_member(self, c, name):
+        row = self._locate(c, name)
+        if row is None or (row[2] is None and not row[1]):
+            raise KeyError("There is no file named {!r} in the archive".format(name))
+        return self._member_reader(c, name, *row)
+
+    def _locate(self, c, name):
+        if self.dedup:
+            return c.execute(
+                """
+                SELECT c.rowid, e.sz, length(c.data)
+                FROM sqlar_entry e LEFT JOIN sqlar_content c USING (digest)
+                WHERE e.name = ?;
+                """,
+                (name,)
+            ).fetchone()
+        return c.execute(
+            """
+            SELECT rowid, sz, length(data) FROM sqlar WHERE name = ?;
+            """,
+            (name,)
+        ).fetchone()
+
+    def _member_reader(self, c, name, rowid, size, length):
+        if length is None:
+            if self._is_segmented(c, name):
+                return SegmentedMemberReader(c, name)
+            return ChunkedMemberReader(c, name, size)
+        stored = size in (length, -1)
+        blob = c.blobopen(self._data_table, "data", rowid, readonly=True)
+        return MemberReader(blob, length if stored else size, stored)
+
+    def _read_chunks(self, c, name, first, last):
+        chunk_size, = c.execute(
+            "SELECT sz FROM sqlar_chunk WHERE name = ? AND seq = 0",
+            (name,)
+        ).fetchone()
+        rows = c.execute(
+            """
+            SELECT seq, sz, data FROM sqlar_chunk
+            WHERE name = ? AND seq BETWEEN ? AND ?
+            ORDER BY seq;
+            """,
+            (name, first // chunk_size, (last - 1) // chunk_size)
+        )
+        parts = []
+        for seq, size, data in rows:
+            offset = seq * chunk_size
+            parts.append(decompress_data(data, size)[max(first - offset, 0):last - offset])
+        return b"".join(parts)
+
+    def _store_chunked(self, name, mode, mtime, source, compression, level, chunk_size):
+        """Insert or replace a member in the chunked layout.
+
+        *source* is a binary file that is read *chunk_size* bytes at a time.
+        """
+        if self.dedup:
+            raise ValueError("the chunked layout can't be used in a deduplicated archive")
+        with self._transaction() as c:
+            for statement in _SQLAR_CHUNK_SCHEMA:
+                c.execute(statement)
+            c.execute("DELETE FROM sqlar_chunk WHERE name = ?", (name,))
+            if self._has_table(c, "sqlar_append"):
+                # data stays NULL, so the replace trigger doesn't fire
+                c.execute("DELETE FROM sqlar_append WHERE name = ?", (name,))
+            size = 0
+            seq = 0
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                data = compress_data(chunk, level) if compression == SQLAR_DEFLATED else chunk
+                c.execute(
+                    "INSERT INTO sqlar_chunk(name, seq, sz, data) VALUES (?, ?, ?, ?)",
+                    (name, seq, len(chunk), data)
+                )
+                size += len(chunk)
+                seq += 1
+            # An empty member is stored as a standard empty file so it isn't
+            # mistaken for a directory.
+            c.execute(
+                _SQLAR_UPSERT.format(data="?"),
+                (name, mode, mtime, size, None if size else b"")
+            )
+
+    def _store(self, name, mode, mtime, size, data, digest=None, replace=True):
+        """Insert a member, replacing an existing one if *replace* is true.
+
+        *data* is either a bytes-like object or a binary file which is copied
+        into the archive through a blob handle.
+
+        In a deduplicated archive *digest* identifies the content, it must be
+        given when *data* is a file. *data* is only stored if the archive
+        doesn't contain the content yet. It may be a callable returning the
+        data, which is only called if the content is missing.
+        """
+        if self.dedup:
+            self._store_deduplicated(name, mode, mtime, size, data, digest, replace)
+            return
+
+        sql = _SQLAR_UPSERT if replace else _SQLAR_INSERT
+        with self._transaction() as c:
+            if not _is_stream(data):
+                c.execute(sql.format(data="?"), (name, mode, mtime, size, data))
+                return
+            start = data.tell()
+            length = data.seek(0, io.SEEK_END) - start
+            data.seek(start)
+            c.execute(sql.format(data="zeroblob(?)"), (name, mode, mtime, size, length))
+            rowid, = c.execute("SELECT rowid FROM sqlar WHERE name = ?", (name,)).fetchone()
+            _copy_to_blob(c, "sqlar", rowid, data)
+
+    def _store_deduplicated(self, name, mode, mtime, size, data, digest, replace):
+        if digest is None:
+            digest = _sqlar_digest(size, data)
+        sql = _SQLAR_ENTRY_UPSERT if replace else _SQLAR_ENTRY_INSERT
+        with self._transaction() as c:
+            # The triggers only count references to existing content, so the
+            # entry goes first and new content starts with one reference.
+            # Inserting it also takes the write lock, content found
+            # afterwards can't be deleted before the commit.
+            c.execute(sql, (name, mode, mtime, size, digest))
+            if digest is None or c.execute(
+                    "SELECT 1 FROM sqlar_content WHERE digest = ?",
+                    (digest,)).fetchone():
+                return
+            if callable(data):
+                data = data()
+                if _is_stream(data):
+                    with data:
+                        self._store_content(c, digest, data)
+                    return
+            self._store_content(c, digest, data)
+
+    def _store_content(self, c, digest, data):
+        if not _is_stream(data):
+            c.execute(
+                "INSERT INTO sqlar_content(digest, refs, data) VALUES (?, 1, ?)",
+                (digest, data)
+            )
+            return
+        start = data.tell()
+        length = data.seek(0, io.SEEK_END) - start
+        data.seek(start)
+        cur = c.execute(
+            "INSERT INTO sqlar_content(digest, refs, data) VALUES (?, 1, zeroblob(?))",
+            (digest, length)
+        )
+        _copy_to_blob(c, "sqlar_content", cur.lastrowid, data)
+
+    def _has_content(self, digest):
+        with self._reading() as c:
+            return c.execute(
+                "SELECT 1 FROM sqlar_content WHERE digest = ?",
+                (digest,)
+            ).fetchone() is not None
+
+    def _pack(self, data, compression, level):
+        """Prepare the uncompressed *data* of a member for `_store`.
+
+        Returns:
+            A tuple `(data, digest)`. In a deduplicated archive content that
+            is already stored isn't compressed, *data* is then a callable
+            compressing it if `_store` finds it missing after all.
+        """
+        digest = None
+        if self.dedup:
+            digest = hashlib.sha256(data).digest()
+            if self._has_content(digest):
+                return partial(_compress, data, compression, level), digest
+        return _compress(data, compression, level), digest
+
+    def extract(self, member, path=None, buffer_size=_EXTRACT_BUFFER_SIZE):
         """Extract a single member of the archive.
 
         Defaults to extracting in *cwd*.
 
+        Members larger than *buffer_size* are read from the archive,
+        decompressed and written in chunks of *buffer_size* bytes, so memory
+        use doesn't depend on the size of the member.
+
         Args:
             member: The archive member to extract.
             path (optional): The root path to extract the archive to.
+            buffer_size (optional): The largest amount of member data held in
+                memory at once.
         """
         path = Path(path) if path else Path()
 
-        with self._conn as c:
+        with self._reading() as c:
             row = c.execute(
                 """
-                SELECT * FROM sqlar WHERE name = ?;
+                SELECT name, mode, mtime, sz, CASE WHEN sz <= ? THEN data END
+                FROM sqlar WHERE name = ?;
                 """,
-                (member,)
+                (buffer_size, member)
             ).fetchone()
-        if row:
+        if row and row[4] is None and row[3]:
+            self._extract_stream(path, row, buffer_size)
+        elif row:
             _decompress_row(path, row)
 
-    def extractall(self, path=None, members=None):
+    def _extract_stream(self, path, row, buffer_size, make_parents=True):
+        name, mode, mtime, _, _ = row
+        complete_path = path / name
+        if make_parents:
+            complete_path.parent.mkdir(parents=True, exist_ok=True)
+
+        buffer = bytearray(buffer_size)
+        with self.open(name) as src, open(complete_path, "wb") as f, memoryview(buffer) as view:
+            while True:
+                n = src.readinto(buffer)
+                if not n:
+                    break
+                f.write(view[:n])
+
+        complete_path.chmod(mode)
+        info = complete_path.stat()
+        os.utime(complete_path, times=(info.st_atime, mtime))
+
+    def extractall(self,
+                   path=None,
+                   members=None,
+                   workers=None,
+                   buffer_size=_EXTRACT_BUFFER_SIZE):
         """Extract the entire archive.
 
         Defaults to extracting in *cwd*.
 
+        All directories are created first from the list of members. The
+        members are then read in table order, and decompressed and written to
+        disk on a pool of *workers* threads. Directory permissions and
+        modification times are applied last.
+
+        Members larger than *buffer_size* are streamed to disk in chunks of
+        *buffer_size* bytes by the calling thread instead.
+
         Args:
             path (optional): The root path to extract the archive to.
-            members (optional): A list of member files to extract. Has to be
-                shorter than 999 members.
-
-        Raises:
-            ValueError: If `len(members) > 1000`.
+            members (optional): An iterable of member names to extract. All
+                members are extracted if it is `None` or empty.
+            workers (optional): The number of threads writing files, defaults
+                to the number of CPUs.
+            buffer_size (optional): The largest amount of data of a single
+                member held in memory at once.
         """
-        if members and len(members) > 1000:
-            raise ValueError("can only extract 999 or less named members.")
         path = Path(path) if path else Path()
-
-        with self._conn as c:
-            if members:
-                cur = c.execute(
-                    """
-                    SELECT * FROM sqlar WHERE name IN ({});
-                    """.format('?,'.join('' for _ in members)),
-                    members
-                )
-            else:
-                cur = c.execute(
-                    """
-                    SELECT * FROM sqlar;
-                    """
-                )
-            for row in cur:
-                _decompress_row(path, row)
+        workers = workers or os.cpu_count() or 1
+
+        # One read transaction gives a consistent view of the archive for both
+        # passes over the members. Pooled archives read on a snapshot reader
+        # and don't block writers for the duration of the extraction.
+        with self._reading() as c:
+            begin = not c.in_transaction
+            if begin:
+                c.execute("BEGIN")
+            try:
+                source = "sqlar"
+                if members:
+                    c.execute("CREATE TEMP TABLE IF NOT EXISTS sqlar_extract(name TEXT PRIMARY KEY)")
+                    c.execute("DELETE FROM temp.sqlar_extract")
+                    c.executemany(
+                        "INSERT OR IGNORE INTO temp.sqlar_extract(name) VALUES (?)",
+                        ((member,) for member in members)
+                    )
+                    source = "sqlar JOIN temp.sqlar_extract USING (name)"
+
+                directories = set()
+                for name, is_dir in c.execute(
+                        "SELECT name, sz = 0 AND data IS NULL FROM {};".format(source)):
+                    directories.add(path / name if is_dir else (path / name).parent)
+                for directory in sorted(directories):
+                    directory.mkdir(parents=True, exist_ok=True)
+
+                directory_rows = []
+
+                def rows():
+                    for row in c.execute(
+                            """
+                            SELECT name, mode, mtime, sz, CASE WHEN sz <= ? THEN data END
+                            FROM {}
+                            ORDER BY {};
+                            """.format(source, "sqlar.name" if self.dedup else "sqlar.rowid"),
+                            (buffer_size,)):
+                        if row[3] == 0 and row[4] is None:
+                            directory_rows.append(row)
+                        elif row[4] is None:
+                            self._extract_stream(path, row, buffer_size, False)
+                        else:
+                            yield path, row, False
+
+                with ThreadPoolExecutor(workers) as pool:
+                    for _ in _bounded_map(pool, _decompress_row, rows(), 2 * workers):
+                        pass
+            finally:
+                if begin:
+                    c.commit()
+
+        # Deepest first so creating a directory doesn't touch its parent's
+        # modification time afterwards.
+        for row in sorted(directory_rows, reverse=True):
+            _decompress_row(path, row, False)
 
     def read(self, name, start=1, end=2147483647):
         """Returns a decompressed bytes-object from the archive.
 
+        Only the bytes from position *start* to *end* (inclusive, 1-based as
+        in SQL's `substr`) are returned. Stored members are sliced by SQLite,
+        deflated members are decompressed up to *end* only, and for chunked
+        members only the chunks overlapping the range are decompressed.
+
         Args:
             name: The name of the file to extract.
+            start (optional): Position of the first byte to return.
+            end (optional): Position of the last byte to return.
 
         Returns:
-            A bytes-object with the decompressed file.
+            A bytes-object with the decompressed file, or `None` if *name* is
+            not a file in the archive.
         """
-        with self._conn as c:
-            row = c.execute(
-                """
-                SELECT sz, data FROM sqlar WHERE name = ?;
-                """,
-                (name,)
-            ).fetchone()
-        if row:
-            size, data = row
-            if self._compression != SQLAR_STORED:
-                return decompress_data(data, size)[start-1:end]
+        first = max(start - 1, 0)
+        if self._content_cache is not None:
+            data = self._cached_content(name)
+            if data is not MISSING:
+                if data is None or (first == 0 and end >= len(data)):
+                    return data
+                return data[first:end]
+
+        with self._reading() as c:
+            row = self._locate(c, name)
+            if row is None:
+                return None
+            rowid, size, length = row
+            if length is None:
+                if not size:
+                    return None
+                end = min(end, size)
+                if end <= first:
+                    return b""
+                if self._is_segmented(c, name):
+                    with io.BufferedReader(SegmentedMemberReader(c, name), _BLOB_CHUNK_SIZE) as f:
+                        f.seek(first)
+                        return f.read(end - first)
+                return self._read_chunks(c, name, first, end)
+            if size in (length, -1):
+                data, = c.execute(
+                    "SELECT substr(data, ?, ?) FROM {} WHERE rowid = ?;".format(self._data_table),
+                    (first + 1, max(end - first, 0), rowid)
+                ).fetchone()
+                # substr() of an empty blob is NULL
+                return data if data is not None else b""
+        with self.open(name) as f:
+            f.seek(first)
+            return f.read(max(min(end, size) - first, 0))
+
+    def readview(self, name):
+        """Returns the decompressed content of a member as a memoryview.
+
+        With the content cache enabled the read-only view references the
+        cached content, so repeated reads of a hot member neither decompress
+        nor copy it.
+
+        Args:
+            name: The name of the file.
+
+        Returns:
+            A `memoryview`, or `None` if *name* is not a file in the archive.
+        """
+        data = MISSING
+        if self._content_cache is not None:
+            data = self._cached_content(name)
+        if data is MISSING:
+            data = self.read(name)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return None if data is None else memoryview(data)
+
+    def _cached_content(self, name):
+        """Returns the content of *name* from the content cache, reading and
+        caching it on a miss.
+
+        Returns:
+            The decompressed content, `None` if *name* is not a file, or
+            `MISSING` if the member can't be cached.
+        """
+        cache = self._content_cache
+        token, data = self._cache_get(cache, name)
+        if data is not MISSING or token is None:
+            return data
+
+        with self._reading() as c:
+            row = self._locate(c, name)
+            if row is None or (row[2] is None and not row[1]):
+                return None
+            rowid, size, length = row
+            # Symbolic links aren't cached.
+            if size < 0 or size > cache.maxsize:
+                return MISSING
+            if length is None and self._is_segmented(c, name):
+                with SegmentedMemberReader(c, name) as f:
+                    data = f.readall()
+            elif length is None:
+                data = self._read_chunks(c, name, 0, size)
             else:
-                return data
+                blob, = c.execute(
+                    "SELECT data FROM {} WHERE rowid = ?;".format(self._data_table),
+                    (rowid,)
+                ).fetchone()
+                data = bytes(decompress_data(blob, size))
+        self._cache_put(cache, token, name, data)
+        return data
 
     def sql(self, query, *args):
         """Execute raw SQL statements against the database.
@@ -416,14 +2285,19 @@ class SQLiteArchive():
         Returns:
             The results of the query.
         """
-        with self._conn as c:
+        with self._transaction() as c:
             rows = c.execute(query, args).fetchall()
         return rows
 
     def testsqlar(self):
         raise NotImplementedError()
 
-    def write(self, filename, arcname=None, compression=None, compress_level=None):
+    def write(self,
+              filename,
+              arcname=None,
+              compression=None,
+              compress_level=None,
+              chunk_size=None):
         """Write the file pointed to by *filename* to the archive.
 
         Writes the file into the archive with the archive name *arcname*, which
@@ -433,6 +2307,11 @@ class SQLiteArchive():
         the database, but directories also have `data = NULL`. Symbolic links
         get their size set to -1 and `data` to their original targets.
 
+        Files larger than 1 MiB are compressed in chunks into a temporary
+        file, that stays in memory up to 8 MiB, and copied into the archive
+        through a blob handle. If the first 1 MiB of such a file doesn't
+        compress well the file is stored uncompressed.
+
         Args:
             filename: Filename or path-like object to the file to be written
                 into the archive.
@@ -441,6 +2320,9 @@ class SQLiteArchive():
                 opening the archive.
             compress_level (optional): Override the *compress_level* chosen when
                 opening the archive.
+            chunk_size (optional): Override the *chunk_size* chosen when
+                opening the archive. Only regular files are chunked, and an
+                existing chunked member is replaced.
 
         Raises:
             ValueError: *filename* does not represent a file, directory or
@@ -450,45 +2332,160 @@ class SQLiteArchive():
 
         compression = compression or self._compression
         level = compress_level or self._compress_level
+        chunk_size = chunk_size or self._chunk_size
 
         path = Path(filename)
 
-        info = path.stat()
-        mode = info.st_mode & 0o777
-        mtime = int(info.st_mtime_ns * 1e-9)
-        size = info.st_size
-
-        if path.is_symlink():
-            data = str(path.resolve().as_posix())
-            size = -1
-        elif path.is_file():
+        if chunk_size and path.is_file() and not path.is_symlink():
+            info = path.stat()
             with open(path, "rb") as f:
-                if compression == SQLAR_DEFLATED:
-                    data = compress_data(f.read(), level)
-                else:
-                    data = f.read()
-        elif path.is_dir():
-            data = None
-            size = 0
-        else:
-            raise ValueError("path is not a file, directory or symlink")
-
-        logger.debug(
-            "Write: arcname={}, mode={}, mtime={}, size={}".format(
-                arcname,
-                mode,
-                mtime,
-                size
-            )
+                self._store_chunked(
+                    str(Path(arcname).as_posix()),
+                    info.st_mode & 0o777,
+                    int(info.st_mtime_ns * 1e-9),
+                    f,
+                    compression,
+                    level,
+                    chunk_size
+                )
+            return
+
+        row = _read_file(
+            path,
+            arcname,
+            compression,
+            level,
+            self.dedup,
+            self._has_content if self.dedup else None
         )
-        with self._conn as c:
-            c.execute(
-                """
-                INSERT INTO sqlar(name, mode, mtime, sz, data)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (str(Path(arcname).as_posix()), mode, mtime, size, data)
-            )
+        try:
+            self._store(*row, replace=False)
+        finally:
+            if _is_stream(row[4]):
+                row[4].close()
+
+    def add_files(self, files, compression=None, compress_level=None, workers=None):
+        """Write many files to the archive, compressing them in parallel.
+
+        Files are read and compressed on a pool of *workers* threads, zlib
+        releases the GIL while compressing, and the calling thread inserts the
+        members in the order they were given. At most two files per worker are
+        in flight at any time so memory use stays bounded.
+
+        Unlike `write`, existing members with the same name are replaced.
+        Files are chunked in the calling thread if the archive has a
+        *chunk_size*.
+
+        Args:
+            files: An iterable of filenames or `(filename, arcname)` tuples.
+            compression (optional): Override the *compression* chosen when
+                opening the archive.
+            compress_level (optional): Override the *compress_level* chosen when
+                opening the archive.
+            workers (optional): The number of compression threads, defaults to
+                the number of CPUs.
+
+        Raises:
+            ValueError: A file does not represent a file, directory or
+                symlink.
+        """
+        compression = compression or self._compression
+        level = compress_level or self._compress_level
+        workers = workers or os.cpu_count() or 1
+
+        files = (item if isinstance(item, tuple) else (item, item) for item in files)
+
+        with self.batch():
+            if self._chunk_size:
+                for filename, arcname in files:
+                    self.sql("DELETE FROM sqlar WHERE name = ?", str(Path(arcname).as_posix()))
+                    self.write(filename, arcname, compression, level)
+                return
+
+            with ThreadPoolExecutor(workers) as pool:
+                self._store_rows(_bounded_map(
+                    pool,
+                    _read_file,
+                    (
+                        (filename, arcname, compression, level, self.dedup)
+                        for filename, arcname in files
+                    ),
+                    2 * workers
+                ))
+
+    def writemany(self, items, compression=None, compress_level=None):
+        """Write many strings into the archive in a single transaction.
+
+        The members are inserted with `executemany` in groups, so the cost of
+        committing is paid once for the whole call instead of once per
+        member. Existing members with the same name are replaced.
+
+        Args:
+            items: An iterable of `(arcname, data)` or
+                `(arcname, data, unix_mode, mtime)` tuples, see `writestr`.
+            compression (optional): Override the *compression* chosen when
+                opening the archive.
+            compress_level (optional): Override the *compress_level* chosen when
+                opening the archive.
+        """
+        compression = compression or self._compression
+        level = compress_level or self._compress_level
+
+        def rows():
+            for arcname, data, *rest in items:
+                unix_mode = rest[0] if rest else 0o777
+                mtime = rest[1] if len(rest) > 1 else int(time.time())
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                if self._chunk_size:
+                    self._store_chunked(
+                        str(Path(arcname).as_posix()),
+                        unix_mode,
+                        mtime,
+                        io.BytesIO(data),
+                        compression,
+                        level,
+                        self._chunk_size
+                    )
+                    continue
+                yield (
+                    str(Path(arcname).as_posix()),
+                    unix_mode,
+                    mtime,
+                    len(data),
+                    *self._pack(data, compression, level)
+                )
+
+        with self.batch():
+            self._store_rows(rows())
+
+    def _store_rows(self, rows):
+        """Insert or replace members from an iterable of *sqlar* rows.
+
+        Rows are passed to `executemany` in groups bounded by count and size.
+        Rows may carry a digest as a sixth item, deduplicated archives store
+        them one at a time.
+        """
+        sql = _SQLAR_UPSERT.format(data="?")
+        group = []
+        size = 0
+        with self._transaction() as c:
+            for row in rows:
+                if _is_stream(row[4]):
+                    with row[4]:
+                        self._store(*row)
+                    continue
+                if self.dedup:
+                    self._store(*row)
+                    continue
+                group.append(row[:5])
+                size += len(row[4] or b"")
+                if len(group) >= _BATCH_MAX_ROWS or size >= _BATCH_MAX_BYTES:
+                    c.executemany(sql, group)
+                    group = []
+                    size = 0
+            if group:
+                c.executemany(sql, group)
 
     def writestr(self,
                  arcname,
@@ -497,7 +2494,8 @@ class SQLiteArchive():
                  mtime=int(datetime.utcnow().timestamp()),
                  compression=None,
                  compress_level=None,
-                 mode='wb'):
+                 mode='wb',
+                 chunk_size=None):
         """Write the string into the archive with name *arcname*.
 
         If *data* is a *str* it is first encoded as utf-8 before writing.
@@ -511,49 +2509,354 @@ class SQLiteArchive():
                 opening the archive.
             compress_level (optional): Override the *compress_level* chosen when
                 opening the archive.
+            mode (optional): `"wb"` replaces the member, `"ab"` appends
+                *data* to it. The member is rewritten with the appended data,
+                unless the archive was opened with *append_segments*, which
+                adds *data* as a new segment, see `compact`. Chunked members
+                and members of deduplicated archives are always rewritten.
+            chunk_size (optional): Override the *chunk_size* chosen when
+                opening the archive.
         """
         if isinstance(data, str):
             data = data.encode("utf-8")
         
         compress_type = compression or self._compression
         level = compress_level or self._compress_level
-        
-        if compress_type == SQLAR_DEFLATED:
-            compressed_data = compress_data(data, level)
-        else:
-            compressed_data = data
+        chunk_size = chunk_size or self._chunk_size
+        name = str(Path(arcname).as_posix())
+
+        with self.batch():
+            if "a" in mode:
+                with self._transaction() as c:
+                    row = self._locate(c, name)
+                    if row and self._append_segments and not self.dedup and row[1] >= 0 and (
+                            row[2] is not None or self._is_segmented(c, name)):
+                        self._append_segment(c, name, row, unix_mode, mtime, data, compress_type, level)
+                        return
+                if row:
+                    data = (self.read(name) or b"") + data
+
+            if chunk_size:
+                self._store_chunked(
+                    name,
+                    unix_mode,
+                    mtime,
+                    io.BytesIO(data),
+                    compress_type,
+                    level,
+                    chunk_size
+                )
+            else:
+                self._store(name, unix_mode, mtime, len(data), *self._pack(data, compress_type, level))
 
-        # append_sql = f"""sz = {'sz + ' if mode == 'ab' else ''} :sz,
-        #                  data = {'cast(data || :data as blob)' if 'a' in mode
-        #                     else ':data'}"""
-        append_sql = f"""data = {'cast(data || :data as blob)' if 'a' in mode
-                            else ':data'}"""
+    def _append_segment(self, c, name, row, mode, mtime, data, compression, level):
+        """Append *data* to a member as a new row of *sqlar_append*.
 
-        with self._conn as c:
-            cursor = c.cursor()
-            sql = f"""
-                INSERT INTO sqlar(name, mode, mtime, sz, data)
-                VALUES (:name, :mode, :mtime, 0, :data)
-
-                ON CONFLICT(name) DO UPDATE
-                    SET name = :name,
-                    mode = :mode,
-                    mtime = :mtime,
-                    sz = 0,
-                    {append_sql}
+        The first append moves the content of the member into segment 0 and
+        leaves `data = NULL` in *sqlar*, so the row updated by later appends
+        is small and their cost doesn't depend on the size of the member.
+        """
+        rowid, size, length = row
+        # Empty members with data = NULL would be directories
+        if length is not None and data:
+            for statement in _SQLAR_APPEND_SCHEMA:
+                c.execute(statement)
+            c.execute(
+                "INSERT INTO sqlar_append(name, seq, sz, data) SELECT name, 0, sz, data FROM sqlar WHERE rowid = ?",
+                (rowid,)
+            )
+            c.execute("UPDATE sqlar SET data = NULL WHERE rowid = ?", (rowid,))
+        if data:
+            c.execute(
                 """
-            cursor.execute(
-                sql,
-                {
-                    'name': str(Path(arcname).as_posix()),
-                    'mode': unix_mode,
-                    'mtime': mtime,
-                    'data': compressed_data
-                }
+                INSERT INTO sqlar_append(name, seq, sz, data)
+                SELECT ?1, max(seq) + 1, ?2, ?3 FROM sqlar_append WHERE name = ?1
+                """,
+                (name, len(data), compress_data(data, level) if compression == SQLAR_DEFLATED else data)
             )
-            cursor.execute('UPDATE sqlar SET sz=coalesce(length(data),0)')
-            c.commit()
-            pass
+        c.execute(
+            "UPDATE sqlar SET mode = ?, mtime = ?, sz = sz + ? WHERE rowid = ?",
+            (mode, mtime, len(data), rowid)
+        )
+
+    def compact(self, name=None, compression=None, compress_level=None):
+        """Merge the appended segments of members back into one blob.
+
+        Compacted members are standard *sqlar* members again. Each member is
+        compacted in its own write transaction, which takes the write lock
+        before the segments are read, so appends from other connections wait
+        for it instead of being lost. The content is streamed from the
+        segments through a temporary file, like `open` does for written
+        members.
+
+        Args:
+            name (optional): The member to compact, every member with
+                segments by default.
+            compression (optional): Override the *compression* chosen when
+                opening the archive.
+            compress_level (optional): Override the *compress_level* chosen when
+                opening the archive.
+
+        Returns:
+            The number of members compacted.
+        """
+        compression = compression or self._compression
+        level = compress_level or self._compress_level
+        with self._reading() as c:
+            if self.dedup or not self._has_table(c, "sqlar_append"):
+                return 0
+            if name is None:
+                names = [row[0] for row in c.execute("SELECT DISTINCT name FROM sqlar_append")]
+            else:
+                names = [str(Path(name).as_posix())]
+        compacted = 0
+        for member in names:
+            with self.batch(), self._transaction() as c:
+                if not self._is_segmented(c, member):
+                    continue
+                mode, mtime = c.execute(
+                    "SELECT mode, mtime FROM sqlar WHERE name = ?", (member,)
+                ).fetchone()
+                with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE) as spool:
+                    with SegmentedMemberReader(c, member) as f:
+                        size = _spool_member(f, spool, compression, level)
+                    spool.seek(0)
+                    # Storing the content deletes the segments through the
+                    # replace trigger
+                    self._store(member, mode, mtime, size, spool)
+            compacted += 1
+        return compacted
+
+    def patch(self, name, ranges, size=None, mtime=None):
+        """Overwrite parts of a stored member in place.
+
+        The data is written through a blob handle, so the cost depends on the
+        size of *ranges* rather than on the size of the member. SQLite copies
+        the whole row on any `UPDATE` though, so changing the size, which
+        truncates the member or pads it with zero bytes, or setting *mtime*
+        copies the content once.
+
+        Args:
+            name: The name of the member.
+            ranges: An iterable of `(offset, data)` pairs, each one must fit
+                in the member once resized.
+            size (optional): The new size of the member.
+            mtime (optional): The new modification time. When the size
+                changes it defaults to the current time, otherwise the
+                modification time is left alone.
+
+        Returns:
+            `True` if the member was written. `False`, without changing
+            anything, if the member isn't stored uncompressed in one blob and
+            has to be rewritten with `writestr` instead.
+
+        Raises:
+            KeyError: If there is no file *name* in the archive.
+        """
+        name = str(Path(name).as_posix())
+        with self._transaction() as c:
+            row = self._locate(c, name)
+            if row is None or (row[2] is None and not row[1]):
+                raise KeyError("There is no file named {!r} in the archive".format(name))
+            rowid, current, length = row
+            if self.dedup or length is None or current != length:
+                return False
+            if size is not None and size != current:
+                c.execute(
+                    """
+                    UPDATE sqlar SET mtime = ?1, sz = ?2, data = CASE
+                        WHEN ?2 < sz THEN substr(data, 1, ?2)
+                        ELSE cast(data || zeroblob(?2 - sz) as blob)
+                    END
+                    WHERE rowid = ?3
+                    """,
+                    (int(time.time()) if mtime is None else mtime, size, rowid)
+                )
+            elif mtime is not None:
+                c.execute("UPDATE sqlar SET mtime = ? WHERE rowid = ?", (mtime, rowid))
+            with c.blobopen("sqlar", "data", rowid) as blob:
+                for offset, data in ranges:
+                    blob.seek(offset)
+                    blob.write(data)
+        if self._content_cache is not None:
+            with self._cache_lock:
+                # Blob writes aren't counted as changes of the connection,
+                # a new token clears the cache and drops pending puts.
+                self._content_cache.validate(object())
+        return True
+
+    def _relocation(self, src, dst):
+        """Normalizes the names of a `move` or `copy`.
+
+        Returns:
+            A tuple `(src, dst, where, args)` where *where* and *args* match
+            the members to relocate.
+        """
+        src = str(Path(src).as_posix())
+        dst = str(Path(dst).as_posix())
+        if src != dst and (dst.startswith(src.rstrip("/") + "/") or src.startswith(dst.rstrip("/") + "/")):
+            raise ValueError("can't relocate {} to {}, one is inside the other".format(src, dst))
+        return (src, dst) + self._subtree(src)
+
+    def _replace_targets(self, c, src, dst, where, args):
+        # The new names are computed from the source range, so only the
+        # members actually in the way are deleted.
+        c.execute(
+            """
+            DELETE FROM {0} WHERE name IN (
+                SELECT ? || substr(name, ?) FROM {0} WHERE {1}
+            )
+            """.format(self._entry_table, where),
+            (dst, len(src) + 1) + args
+        )
+
+    def move(self, src, dst, replace=False):
+        """Rename member *src*, and every member inside it if it is a
+        directory, to *dst*.
+
+        The names are rewritten by a single `UPDATE` of the range of names
+        starting with *src*, content is never read or copied, so moving a
+        directory costs the same whatever the size of its files.
+
+        Args:
+            src: The name of the member to move.
+            dst: The new name of the member.
+            replace (optional): Delete the members having the new names
+                first, e.g. to merge directory *src* into an existing
+                directory *dst*. Otherwise an existing member with a new
+                name raises `sqlite3.IntegrityError` and nothing is moved.
+
+        Returns:
+            The number of members moved.
+
+        Raises:
+            ValueError: *dst* is inside *src* or *src* is inside *dst*.
+        """
+        src, dst, where, args = self._relocation(src, dst)
+        if src == dst:
+            return 0
+        with self.batch():
+            with self._transaction() as c:
+                if replace:
+                    self._replace_targets(c, src, dst, where, args)
+                # Chunks follow their members through the sqlar_chunk_rename
+                # trigger.
+                return c.execute(
+                    "UPDATE {} SET name = ? || substr(name, ?) WHERE {}".format(
+                        self._entry_table,
+                        where
+                    ),
+                    (dst, len(src) + 1) + args
+                ).rowcount
+
+    def copy(self, src, dst, replace=False, mtime=None):
+        """Copy member *src*, and every member inside it if it is a
+        directory, to *dst*.
+
+        The rows are duplicated by a single `INSERT ... SELECT`, the content
+        is copied as it is stored, without being decompressed, and
+        deduplicated archives only add references to the existing content.
+
+        Args:
+            src: The name of the member to copy.
+            dst: The name of the copy.
+            replace (optional): Delete the members having the names of the
+                copies first, see `move`.
+            mtime (optional): The modification time of the copies, by
+                default that of the originals.
+
+        Returns:
+            The number of members copied.
+
+        Raises:
+            ValueError: *dst* is inside *src* or *src* is inside *dst*.
+        """
+        src, dst, where, args = self._relocation(src, dst)
+        if src == dst:
+            return 0
+        rename = (dst, len(src) + 1)
+        with self.batch():
+            with self._transaction() as c:
+                columns = [
+                    field[1]
+                    for field in c.execute("PRAGMA table_info('{}')".format(self._entry_table))
+                ]
+                select = []
+                select_args = ()
+                for column in columns:
+                    if column == "name":
+                        select.append("? || substr(name, ?)")
+                        select_args += rename
+                    elif column == "mtime" and mtime is not None:
+                        select.append("?")
+                        select_args += (mtime,)
+                    else:
+                        select.append(column)
+                if replace:
+                    self._replace_targets(c, src, dst, where, args)
+                copied = c.execute(
+                    "INSERT INTO {0}({1}) SELECT {2} FROM {0} WHERE {3}".format(
+                        self._entry_table,
+                        ", ".join(columns),
+                        ", ".join(select),
+                        where
+                    ),
+                    select_args + args
+                ).rowcount
+                for table in ("sqlar_chunk", "sqlar_append"):
+                    if not self.dedup and self._has_table(c, table):
+                        c.execute(
+                            """
+                            INSERT INTO {0}(name, seq, sz, data)
+                            SELECT ? || substr(name, ?), seq, sz, data FROM {0} WHERE {1}
+                            """.format(table, where),
+                            rename + args
+                        )
+                return copied
+
+    def _prefix_condition(self, prefix):
+        """Returns an SQL condition and its arguments matching the names
+        starting with *prefix*, as a range of the index on `name`."""
+        if not prefix:
+            return "1", ()
+        return "name >= ? AND name < ?", (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+    def delete_prefix(self, prefix):
+        """Delete every member whose name starts with *prefix*.
+
+        The members are deleted by a single `DELETE` of a range of the index
+        on `name`, in one transaction. Pass a directory name followed by `/`
+        to delete everything inside the directory but not the directory
+        itself.
+
+        Args:
+            prefix: The start of the names to delete, `""` deletes all the
+                members.
+
+        Returns:
+            The number of members deleted.
+        """
+        where, args = self._prefix_condition(str(prefix))
+        with self._transaction() as c:
+            # Chunks and unreferenced content are deleted by the triggers.
+            return c.execute(
+                "DELETE FROM {} WHERE {}".format(self._entry_table, where),
+                args
+            ).rowcount
+
+    def has_members(self, prefix):
+        """Returns `True` if the name of any member starts with *prefix*.
+
+        Only probes the index on `name`, e.g. `has_members("dir/")` checks
+        whether directory `dir` is empty without listing it.
+        """
+        where, args = self._prefix_condition(str(prefix))
+        with self._reading() as c:
+            found, = c.execute(
+                "SELECT EXISTS (SELECT 1 FROM {} WHERE {})".format(self._entry_table, where),
+                args
+            ).fetchone()
+        return bool(found)
 
     def __enter__(self):
         return self
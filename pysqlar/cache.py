@@ -0,0 +1,79 @@
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+"""Cache statistics, in the style of `functools.lru_cache`."""
+
+MISSING = object()
+"""Returned by `LRUCache.get` for keys that aren't cached."""
+
+
+class LRUCache():
+    """A least recently used cache that is cleared when the archive changes.
+
+    The cache holds entries until the sum of their sizes reaches *maxsize*,
+    then the least recently used entries are evicted. By default every entry
+    has size 1, so *maxsize* is a number of entries.
+
+    Entries are only valid for one state of the archive, identified by a
+    token passed to `validate`. The whole cache is cleared when the token
+    changes.
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._token = None
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, token):
+        """Clear the cache if *token* differs from the previous token."""
+        if token != self._token:
+            self.clear()
+            self._token = token
+
+    def get(self, key):
+        """Return the value cached for *key*, or `MISSING`."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, token=None):
+        """Cache *value* for *key*, unless it is larger than the cache.
+
+        If *token* is given the value is only cached if *token* is still
+        the current token, so a value read before the archive changed
+        isn't cached after another thread cleared the cache.
+        """
+        if token is not None and token != self._token:
+            return
+        size = self._sizeof(value)
+        self.pop(key)
+        if size > self.maxsize:
+            return
+        self._entries[key] = value
+        self._size += size
+        while self._size > self.maxsize:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= self._sizeof(evicted)
+
+    def pop(self, key):
+        value = self._entries.pop(key, MISSING)
+        if value is not MISSING:
+            self._size -= self._sizeof(value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, self._size)
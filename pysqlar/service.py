@@ -0,0 +1,414 @@
+"""Single-writer service for archives written by several processes.
+
+SQLite allows one writer at a time, so processes writing to the same archive
+wait for each other's locks and fail with `database is locked` when they
+wait too long. `ArchiveWriterService` owns the archive instead and commits
+the members sent by any number of `ArchiveWriterClient`s over a Unix socket.
+Members received while a commit is running are committed together by the
+next one.
+
+Clients compress the data themselves, the service only stores it.
+
+```python
+# in the process owning the archive
+with ArchiveWriterService("logs.sqlar", "/run/logs.sock") as service:
+    service.serve_forever()
+
+# in each producer
+with ArchiveWriterClient("/run/logs.sock", compression=SQLAR_DEFLATED) as client:
+    client.writestr("worker-1/0001.log", data)
+```
+"""
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from pathlib import Path
+
+from .archive import (
+    SQLiteArchive,
+    SQLiteArchiveException,
+    SQLAR_DEFLATED,
+    SQLAR_STORED,
+    _BATCH_MAX_BYTES,
+    _BATCH_MAX_ROWS,
+    compress_data,
+)
+
+
+_FRAME = struct.Struct("!BHIqqq")
+"""Frame header: kind, name length, mode, mtime, size and data length (-1
+for `NULL`), followed by the name and the data."""
+
+_ACK = struct.Struct("!BI")
+"""Reply to a flush: status and message length, followed by the message."""
+
+_ROW = 0
+_FLUSH = 1
+
+_QUEUE_SIZE = 4 * _BATCH_MAX_ROWS
+"""Rows waiting to be committed, beyond this clients are slowed down."""
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError("connection closed in the middle of a frame")
+    return data
+
+
+class _Client():
+    """A connected client, as seen by the writer thread."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.error = None
+        # Flushes queued and not acknowledged yet
+        self._pending = 0
+        self._acked = threading.Condition()
+
+    def flushing(self):
+        with self._acked:
+            self._pending += 1
+
+    def ack(self, error=None):
+        message = (error or self.error or "").encode("utf-8")
+        self.error = None
+        try:
+            self._connection.sendall(_ACK.pack(bool(message), len(message)) + message)
+        except OSError:
+            # The client is gone, it can't be told anyway.
+            pass
+        with self._acked:
+            self._pending -= 1
+            self._acked.notify_all()
+
+    def wait_acked(self):
+        """Wait until the queued flushes are acknowledged, the connection is
+        closed once the handler returns."""
+        with self._acked:
+            self._acked.wait_for(lambda: self._pending <= 0)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.server.service._connected(self.connection)
+
+    def handle(self):
+        client = _Client(self.connection)
+        put = self.server.service._put
+        try:
+            while True:
+                header = self.rfile.read(_FRAME.size)
+                if len(header) != _FRAME.size:
+                    # Disconnected or closing, a partial frame is dropped.
+                    return
+                kind, name_length, mode, mtime, size, data_length = _FRAME.unpack(header)
+                if kind == _FLUSH:
+                    if not put(client, None):
+                        return
+                    continue
+                try:
+                    name = _read_exactly(self.rfile, name_length).decode("utf-8")
+                    data = None if data_length < 0 else _read_exactly(self.rfile, data_length)
+                except EOFError:
+                    return
+                if not put(client, (name, mode, mtime, size, data)):
+                    return
+        finally:
+            client.wait_acked()
+
+    def finish(self):
+        self.server.service._disconnected(self.connection)
+        super().finish()
+
+
+class ArchiveWriterService():
+    """Owns an archive and commits the members sent by clients.
+
+    A single thread writes to the archive. It takes all rows that have
+    arrived, up to the usual batch limits, and commits them in one
+    transaction, so the cost of a commit is shared by every member
+    received while the previous commit was running. Each client connection
+    is served by its own thread, and clients are slowed down by their
+    sockets when the writer falls behind.
+
+    Attributes:
+        address: The path of the Unix socket.
+        archive: The `SQLiteArchive` written to.
+    """
+
+    def __init__(self, filename, address, mode="rwc", **kwargs):
+        """Open the archive and listen on *address*.
+
+        Args:
+            filename: The path to the archive.
+            address: The path of the Unix socket to create. An existing
+                socket file is replaced.
+            mode (optional): The mode to open the archive with, see
+                `SQLiteArchive`.
+            **kwargs: Other arguments passed to `SQLiteArchive`, e.g.
+                *pragmas*.
+        """
+        self.address = str(address)
+        self._queue = queue.Queue(_QUEUE_SIZE)
+        # Guards _closed and _connections, rows are only queued before the
+        # sentinel stopping the writer
+        self._state_lock = threading.Lock()
+        self._closed = False
+        self._connections = set()
+        self.archive = None
+        self._writer = threading.Thread(
+            target=self._write,
+            args=(filename, mode, kwargs),
+            name="pysqlar-writer",
+            daemon=True
+        )
+        opened = threading.Event()
+        self._opened = opened
+        self._open_error = None
+        self._writer.start()
+        # The archive's connection belongs to the writer thread.
+        opened.wait()
+        if self._open_error:
+            raise self._open_error
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._server = socketserver.ThreadingUnixStreamServer(self.address, _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+
+    def _write(self, filename, mode, kwargs):
+        try:
+            self.archive = SQLiteArchive(filename, mode, **kwargs)
+        except BaseException as e:
+            self._open_error = e
+            return
+        finally:
+            self._opened.set()
+
+        get = self._queue.get
+        while True:
+            item = get()
+            if item is None:
+                break
+            group = [item]
+            size = len(item[1][4] or b"") if item[1] else 0
+            stopping = False
+            while len(group) < _BATCH_MAX_ROWS and size < _BATCH_MAX_BYTES:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+                if item[1]:
+                    size += len(item[1][4] or b"")
+            self._commit(group)
+            if stopping:
+                break
+        self.archive.close()
+
+    def _connected(self, connection):
+        with self._state_lock:
+            if self._closed:
+                connection.shutdown(socket.SHUT_RD)
+            self._connections.add(connection)
+
+    def _disconnected(self, connection):
+        with self._state_lock:
+            self._connections.discard(connection)
+
+    def _put(self, client, row):
+        """Queue a row, or a flush if *row* is `None`, for the writer.
+
+        Returns:
+            `False` if the service is closed and nothing was queued, the
+            handler then disconnects the client.
+        """
+        with self._state_lock:
+            if self._closed:
+                return False
+            if row is None:
+                client.flushing()
+            # Blocks while the queue is full, the writer doesn't need the
+            # lock to empty it.
+            self._queue.put((client, row))
+            return True
+
+    def _commit(self, group):
+        rows = [row for _, row in group if row]
+        try:
+            with self.archive.batch():
+                self.archive._store_rows(rows)
+        except Exception:
+            # Only the client that sent a failing row gets the error.
+            self._commit_each(group)
+        for client, row in group:
+            if not row:
+                client.ack()
+
+    def _commit_each(self, group):
+        """Commit the rows of *group* in one transaction with a savepoint per
+        row, rolling back only the rows that fail."""
+        try:
+            with self.archive.batch():
+                c = self.archive._conn
+                for client, row in group:
+                    if not row:
+                        continue
+                    c.execute("SAVEPOINT pysqlar_row")
+                    try:
+                        self.archive._store_rows([row])
+                    except Exception as e:
+                        c.execute("ROLLBACK TO pysqlar_row")
+                        client.error = "{}: {}".format(type(e).__name__, e)
+                    c.execute("RELEASE pysqlar_row")
+        except Exception as e:
+            for client, row in group:
+                if row:
+                    client.error = "{}: {}".format(type(e).__name__, e)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve clients until `shutdown` is called."""
+        self._server.serve_forever(poll_interval)
+
+    def shutdown(self):
+        """Stop `serve_forever`, it must be running in another thread."""
+        self._server.shutdown()
+
+    def close(self):
+        """Stop listening, commit the rows received and close the archive.
+
+        Connected clients stop being read from, the rows they sent so far
+        are committed and their pending flushes acknowledged. Later flushes
+        fail.
+        """
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            connections = list(self._connections)
+            self._queue.put(None)
+        self._server.server_close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        self._writer.join()
+        # Nothing is queued after the sentinel, unless the writer failed.
+        while True:
+            try:
+                client, row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not row:
+                client.ack("the service is closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *details):
+        self.close()
+
+
+class ArchiveWriterClient():
+    """Sends members to an `ArchiveWriterService`.
+
+    Members are compressed by the client and sent without waiting for them
+    to be committed. `flush` waits until all members sent so far are
+    committed and reports errors.
+    """
+
+    def __init__(self, address, compression=SQLAR_STORED, compress_level=None):
+        """Connect to the service listening on *address*.
+
+        Args:
+            address: The path of the service's Unix socket.
+            compression (optional): `SQLAR_STORED` or `SQLAR_DEFLATED`, see
+                `SQLiteArchive`.
+            compress_level (optional): The compression level to use, see
+                *zlib* documentation for allowed values.
+        """
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(str(address))
+        self._wfile = self._sock.makefile("wb")
+        self._rfile = self._sock.makefile("rb")
+        self._compression = compression
+        self._compress_level = compress_level
+
+    def writestr(self, arcname, data, unix_mode=0o777, mtime=None):
+        """Send a member to be written to the archive.
+
+        An existing member with the same name is replaced.
+
+        Args:
+            arcname: The name of the file in the archive.
+            data: The *bytes* or *str* to write, *str* is encoded as utf-8.
+            unix_mode (optional): The unix file permissions.
+            mtime (optional): The modification time in unix epoch time
+                (seconds), by default the current time.
+
+        Raises:
+            `SQLiteArchiveException` if the service closed the connection.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        size = len(data)
+        if self._compression == SQLAR_DEFLATED:
+            data = compress_data(data, self._compress_level)
+        name = str(Path(arcname).as_posix()).encode("utf-8")
+        mtime = int(time.time()) if mtime is None else mtime
+        try:
+            self._wfile.write(_FRAME.pack(_ROW, len(name), unix_mode, mtime, size, len(data)))
+            self._wfile.write(name)
+            self._wfile.write(data)
+        except OSError as e:
+            raise SQLiteArchiveException("connection to the service lost: {}".format(e)) from e
+
+    def flush(self):
+        """Wait until the members sent so far are committed.
+
+        Raises:
+            `SQLiteArchiveException` if the service failed to commit some of
+            the members sent since the previous flush, or was closed.
+        """
+        try:
+            self._wfile.write(_FRAME.pack(_FLUSH, 0, 0, 0, 0, 0))
+            self._wfile.flush()
+            status, length = _ACK.unpack(_read_exactly(self._rfile, _ACK.size))
+            message = _read_exactly(self._rfile, length).decode("utf-8")
+        except (EOFError, OSError) as e:
+            raise SQLiteArchiveException("connection to the service lost: {}".format(e)) from e
+        if status:
+            raise SQLiteArchiveException(message)
+
+    def close(self):
+        """Flush and disconnect."""
+        try:
+            self.flush()
+        finally:
+            try:
+                self._wfile.close()
+            except OSError:
+                # Unsent members of a lost connection, flush reported it.
+                pass
+            self._rfile.close()
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *details):
+        self.close()
@@ -18,7 +18,7 @@ The module requires the zlib and sqlite3 support, but has no external dependenci
     author_email='hampus.frojdholm@gmail.com',
     license='MIT',
     packages=find_packages(),
-    python_requires='>=3',
+    python_requires='>=3.11',
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3"
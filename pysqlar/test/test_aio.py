@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch
+
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+
+from pysqlar import aio, archive
+
+
+class AsyncSQLiteArchiveTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.sqlar = aio.AsyncSQLiteArchive(
+            str(self.tmp / "async.sqlar"),
+            mode="rwc",
+            compression=archive.SQLAR_DEFLATED,
+            max_pending=3
+        )
+        await self.sqlar.__aenter__()
+        self.addAsyncCleanup(self.sqlar.close)
+
+    async def test_read_write(self):
+        await self.sqlar.writestr("a.txt", "Hello World!" * 100, mtime=0)
+        self.assertEqual(await self.sqlar.read("a.txt"), b"Hello World!" * 100)
+        self.assertEqual(await self.sqlar.read("a.txt", 7, 12), b"World!")
+        self.assertEqual((await self.sqlar.getinfo("a.txt"))[:4], ("a.txt", 0o777, 0, 1200))
+        self.assertEqual([row[0] for row in await self.sqlar.infolist()], ["a.txt"])
+        self.assertEqual(await self.sqlar.namelist(), ["a.txt"])
+
+    async def test_concurrent(self):
+        await asyncio.gather(*(self.sqlar.writestr("f{}".format(i), str(i) * 1000) for i in range(20)))
+        results = await asyncio.gather(*(self.sqlar.read("f{}".format(i)) for i in range(20)))
+        self.assertEqual(results, [str(i).encode() * 1000 for i in range(20)])
+
+    async def test_open(self):
+        async with self.sqlar.open("stream.bin", "w") as f:
+            for i in range(10):
+                await f.write(bytes([i]) * 100000)
+        async with self.sqlar.open("stream.bin") as f:
+            self.assertEqual(await f.read(3), b"\0\0\0")
+            await f.seek(100000)
+            self.assertEqual(f.tell(), 100000)
+            self.assertEqual(await f.read(1), b"\1")
+        f = await self.sqlar.open("stream.bin")
+        chunks = [chunk async for chunk in f]
+        await f.close()
+        self.assertEqual(b"".join(chunks), b"".join(bytes([i]) * 100000 for i in range(10)))
+        with self.assertRaises(KeyError):
+            await self.sqlar.open("missing")
+
+    async def test_open_file_doesnt_pin_reads(self):
+        # One worker runs the reads while the file is open
+        async with aio.AsyncSQLiteArchive(str(self.tmp / "one.sqlar"), mode="rwc", workers=1) as ar:
+            await ar.writestr("big", b"x" * 100000)
+            async with ar.open("big") as f:
+                self.assertEqual(await f.read(3), b"xxx")
+                await ar.writestr("new", "new")
+                self.assertEqual(await ar.read("new"), b"new")
+                self.assertIsNotNone(await ar.getinfo("new"))
+
+    async def test_iterinfo(self):
+        await self.sqlar.writemany(("d/{}.txt".format(i), "x") for i in range(25))
+        await self.sqlar.writestr("d/other.bin", "y")
+        names = [row[0] async for row in self.sqlar.iterinfo(["d/*.txt"], page=10)]
+        self.assertEqual(names, sorted("d/{}.txt".format(i) for i in range(25)))
+        names = [row[0] async for row in self.sqlar.iterinfo(["d/*.txt"], page=5)]
+        self.assertEqual(len(names), 25)
+
+    async def test_writemany_backpressure(self):
+        produced = 0
+        gate = threading.Event()
+        pack = aio._pack_item
+
+        def blocked_pack(*args):
+            gate.wait()
+            return pack(*args)
+
+        async def items():
+            nonlocal produced
+            for i in range(10):
+                produced += 1
+                yield "m{}".format(i), "data {}".format(i)
+
+        with patch.object(aio, "_pack_item", blocked_pack):
+            task = asyncio.create_task(self.sqlar.writemany(items()))
+            await asyncio.sleep(0.05)
+            self.assertEqual(produced, 3)
+            gate.set()
+            await task
+        self.assertEqual(await self.sqlar.read("m9"), b"data 9")
+        self.assertEqual(len(await self.sqlar.namelist()), 10)
+
+    async def test_extract(self):
+        await self.sqlar.writestr("dir/a.txt", "a", unix_mode=0o644)
+        await self.sqlar.extract("dir/a.txt", self.tmp / "out")
+        self.assertEqual((self.tmp / "out" / "dir" / "a.txt").read_bytes(), b"a")
+
+    async def test_extractall(self):
+        await self.sqlar.writemany(("dir/{}.txt".format(i), "data {}".format(i) * 100) for i in range(5))
+        await self.sqlar.extractall(self.tmp / "out", workers=2, buffer_size=10)
+        for i in range(5):
+            path = self.tmp / "out" / "dir" / "{}.txt".format(i)
+            self.assertEqual(path.read_bytes(), "data {}".format(i).encode() * 100)
+
+    async def test_memory(self):
+        async with aio.AsyncSQLiteArchive(":memory:") as ar:
+            await ar.writestr("a.txt", "a")
+            self.assertEqual(await ar.read("a.txt"), b"a")
@@ -2,8 +2,17 @@ import unittest
 from unittest.mock import patch, mock_open, call
 
 import binascii
+import fnmatch
+import io
+import os
+import re
 import sqlite3
+import tempfile
+import threading
+import tracemalloc
+import zlib
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -86,13 +95,13 @@ SQLAR_TABLE_INFO_RESULT = [
     (3, "sz", "INT", 0, None, 0),
     (4, "data", "BLOB", 0, None, 0)
 ]
+# Extra columns are allowed, e.g. atime and ctime, missing ones are not.
 SQLAR_TABLE_INFO_INCORRECT_RESULT = [
     (0, "name", "TEXT", 0, None, 1),
     (1, "mode", "INT", 0, None, 0),
     (2, "mtime", "INT", 0, None, 0),
     (3, "sz", "INT", 0, None, 0),
-    (4, "data", "BLOB", 0, None, 0),
-    (5, "wrong", "TEXT", 0, None, 0)
+    (4, "wrong", "TEXT", 0, None, 0)
 ]
 
 
@@ -163,7 +172,7 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
         with self.sqlar._conn as conn:
             conn.execute(
                 """
-                INSERT INTO sqlar
+                INSERT INTO sqlar(name, mode, mtime, sz, data)
                 VALUES ('example/python.py',438,1578096131,22,X'7072696e74282248656c6c6f20576f726c642122290a'),
                        ('example/text.txt',438,1578096145,16,X'46616e7461737469632070726f73650a');
                 """
@@ -179,15 +188,15 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
 
     def test_getinfo(self):
         res = self.sqlar.getinfo("example/python.py")
-        self.assertEqual(res, ('example/python.py', 438, 1578096131, 22))
+        self.assertEqual(res, ('example/python.py', 438, 1578096131, 22, 0, 0, None, None))
 
     def test_infolist(self):
         res = self.sqlar.infolist()
         self.assertSequenceEqual(
             res,
             [
-                ('example/python.py', 438, 1578096131, 22),
-                ('example/text.txt', 438, 1578096145, 16)
+                ('example/python.py', 438, 1578096131, 22, 0, 0, None, None),
+                ('example/text.txt', 438, 1578096145, 16, 0, 0, None, None)
             ]
         )
 
@@ -199,7 +208,11 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
         )
 
     def test_open(self):
-        with self.assertRaises(NotImplementedError):
+        with self.sqlar.open("example/python.py") as f:
+            self.assertEqual(f.read(), b'print("Hello World!")\n')
+
+    def test_open_missing(self):
+        with self.assertRaises(KeyError):
             self.sqlar.open("filename.txt")
 
     def test_extract(self):
@@ -230,13 +243,15 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
             decompress_row.assert_has_calls([
                 call(
                     Path(),
-                    ('example/python.py', 438, 1578096131, 22, binascii.unhexlify("7072696e74282248656c6c6f20576f726c642122290a"))
+                    ('example/python.py', 438, 1578096131, 22, binascii.unhexlify("7072696e74282248656c6c6f20576f726c642122290a")),
+                    False
                 ),
                 call(
                     Path(),
-                    ('example/text.txt', 438, 1578096145, 16, binascii.unhexlify("46616e7461737469632070726f73650a"))
+                    ('example/text.txt', 438, 1578096145, 16, binascii.unhexlify("46616e7461737469632070726f73650a")),
+                    False
                 )
-            ])
+            ], any_order=True)
     
     def test_extractall_with_path(self):
         with patch("pysqlar.archive._decompress_row") as decompress_row:
@@ -246,13 +261,15 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
             decompress_row.assert_has_calls([
                 call(
                     Path("folder"),
-                    ('example/python.py', 438, 1578096131, 22, binascii.unhexlify("7072696e74282248656c6c6f20576f726c642122290a"))
+                    ('example/python.py', 438, 1578096131, 22, binascii.unhexlify("7072696e74282248656c6c6f20576f726c642122290a")),
+                    False
                 ),
                 call(
                     Path("folder"),
-                    ('example/text.txt', 438, 1578096145, 16, binascii.unhexlify("46616e7461737469632070726f73650a"))
+                    ('example/text.txt', 438, 1578096145, 16, binascii.unhexlify("46616e7461737469632070726f73650a")),
+                    False
                 )
-            ])
+            ], any_order=True)
 
     def test_read(self):
         res = self.sqlar.read("example/python.py")
@@ -274,10 +291,1162 @@ class SQLiteArchiveWithDataTestCase(unittest.TestCase):
             self.sqlar.testsqlar()
 
 
+class SQLiteArchiveOpenTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED)
+        self.data = b"".join(b"line %d\n" % i for i in range(100000))
+        with self.sqlar._conn as conn:
+            conn.execute(
+                "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, ?, ?, ?, ?)",
+                ("deflated.txt", 0o644, 0, len(self.data), zlib.compress(self.data))
+            )
+
+    def tearDown(self):
+        self.sqlar.close()
+
+    def test_read_deflated(self):
+        with self.sqlar.open("deflated.txt") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_readinto(self):
+        buf = bytearray(1000)
+        with self.sqlar.open("deflated.txt") as f:
+            self.assertEqual(f.readinto(buf), 1000)
+        self.assertEqual(bytes(buf), self.data[:1000])
+
+    def test_seek(self):
+        with self.sqlar.open("deflated.txt") as f:
+            f.seek(500000)
+            self.assertEqual(f.read(10), self.data[500000:500010])
+            f.seek(-10, io.SEEK_END)
+            self.assertEqual(f.read(), self.data[-10:])
+            f.seek(10)
+            self.assertEqual(f.read(10), self.data[10:20])
+
+    def test_write_deflated(self):
+        with self.sqlar.open("written.txt", "w") as f:
+            for i in range(0, len(self.data), 4096):
+                f.write(self.data[i:i + 4096])
+        sz, data = self.sqlar.sql("SELECT sz, data FROM sqlar WHERE name = ?", "written.txt")[0]
+        self.assertEqual(sz, len(self.data))
+        self.assertEqual(data, zlib.compress(self.data))
+
+    def test_write_stored(self):
+        with self.sqlar.open("written.txt", "w", compression=archive.SQLAR_STORED) as f:
+            f.write(b"Hello World!")
+        with self.sqlar.open("written.txt") as f:
+            self.assertEqual(f.read(), b"Hello World!")
+        self.assertEqual(
+            self.sqlar.sql("SELECT sz, data FROM sqlar WHERE name = ?", "written.txt"),
+            [(12, b"Hello World!")]
+        )
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            self.sqlar.open("deflated.txt", "a")
+
+    def test_read_range_deflated(self):
+        self.assertEqual(
+            self.sqlar.read("deflated.txt", 100001, 104096),
+            self.data[100000:104096]
+        )
+
+
+class SQLiteArchiveChunkedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(
+            ":memory:",
+            compression=archive.SQLAR_DEFLATED,
+            chunk_size=4096
+        )
+        self.data = b"".join(b"line %d\n" % i for i in range(10000))
+        self.sqlar.writestr("chunked.txt", self.data)
+
+    def tearDown(self):
+        self.sqlar.close()
+
+    def test_layout(self):
+        self.assertEqual(
+            self.sqlar.sql("SELECT sz, data FROM sqlar WHERE name = ?", "chunked.txt"),
+            [(len(self.data), None)]
+        )
+        chunks = self.sqlar.sql("SELECT count(*) FROM sqlar_chunk WHERE name = ?", "chunked.txt")
+        self.assertEqual(chunks[0][0], -(-len(self.data) // 4096))
+
+    def test_read(self):
+        self.assertEqual(self.sqlar.read("chunked.txt"), self.data)
+
+    def test_read_range(self):
+        for start, end in [(1, 10), (4000, 4100), (4097, 8192), (len(self.data) - 5, len(self.data) + 5)]:
+            self.assertEqual(
+                self.sqlar.read("chunked.txt", start, end),
+                self.data[start - 1:end]
+            )
+
+    def test_open_seek(self):
+        with self.sqlar.open("chunked.txt") as f:
+            f.seek(9000)
+            self.assertEqual(f.read(5000), self.data[9000:14000])
+            f.seek(10)
+            self.assertEqual(f.read(10), self.data[10:20])
+
+    def test_replace_with_standard_member(self):
+        self.sqlar._chunk_size = None
+        self.sqlar.writestr("chunked.txt", b"small")
+        self.assertEqual(self.sqlar.read("chunked.txt"), b"small")
+        self.assertEqual(self.sqlar.sql("SELECT count(*) FROM sqlar_chunk"), [(0,)])
+
+    def test_delete(self):
+        self.sqlar.sql("DELETE FROM sqlar WHERE name = ?", "chunked.txt")
+        self.assertEqual(self.sqlar.sql("SELECT count(*) FROM sqlar_chunk"), [(0,)])
+
+
+class SQLiteArchiveExtractTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.sqlar = archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED)
+        self.addCleanup(self.sqlar.close)
+        self.sqlar.sql("INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES ('a', 493, 1578096131, 0, NULL)")
+        self.files = {"a/b/{}.txt".format(i): b"file %d\n" % i * i for i in range(1500)}
+        self.sqlar.writemany(self.files.items())
+        self.sqlar.writestr("c/chunked.txt", b"chunked\n" * 1000, chunk_size=1024)
+
+    def test_extractall(self):
+        self.sqlar.extractall(self.root, workers=4)
+        for name, data in self.files.items():
+            self.assertEqual((self.root / name).read_bytes(), data)
+        self.assertEqual((self.root / "c/chunked.txt").read_bytes(), b"chunked\n" * 1000)
+        self.assertEqual((self.root / "a").stat().st_mtime, 1578096131)
+
+    def test_extractall_members(self):
+        members = list(self.files)[:1200]
+        self.sqlar.extractall(self.root, members=members)
+        self.assertEqual(
+            sorted(str(p.relative_to(self.root)) for p in self.root.glob("a/b/*")),
+            sorted(members)
+        )
+
+    def test_extractall_no_members(self):
+        self.sqlar.extractall(self.root, members=[])
+        self.assertEqual(len(list(self.root.glob("a/b/*"))), len(self.files))
+        self.assertTrue((self.root / "c/chunked.txt").exists())
+
+
+class SQLiteArchiveExtractMemoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.sqlar = archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED)
+        self.addCleanup(self.sqlar.close)
+        self.size = 32 * 1024 * 1024
+        with self.sqlar.open("big.bin", "w") as f:
+            block = bytes(range(256)) * 4096
+            for _ in range(self.size // len(block)):
+                f.write(block)
+
+    def _peak(self, fn):
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_extract_bounded_memory(self):
+        peak = self._peak(lambda: self.sqlar.extract("big.bin", self.root, buffer_size=256 * 1024))
+        self.assertEqual((self.root / "big.bin").stat().st_size, self.size)
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_extractall_bounded_memory(self):
+        peak = self._peak(lambda: self.sqlar.extractall(self.root, buffer_size=256 * 1024))
+        self.assertEqual((self.root / "big.bin").stat().st_size, self.size)
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+
+class SQLiteArchiveStreamingWriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.sqlar = archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED)
+        self.addCleanup(self.sqlar.close)
+
+    def test_write_compressible(self):
+        data = b"".join(b"line %d\n" % i for i in range(500000))
+        (self.root / "big.txt").write_bytes(data)
+        self.sqlar.write(self.root / "big.txt", "big.txt")
+        self.assertEqual(
+            self.sqlar.sql("SELECT sz, data FROM sqlar WHERE name = 'big.txt'"),
+            [(len(data), zlib.compress(data))]
+        )
+
+    def test_write_incompressible(self):
+        data = os.urandom(2 * 1024 * 1024)
+        (self.root / "big.bin").write_bytes(data)
+        self.sqlar.write(self.root / "big.bin", "big.bin")
+        self.assertEqual(
+            self.sqlar.sql("SELECT sz, data FROM sqlar WHERE name = 'big.bin'"),
+            [(len(data), data)]
+        )
+
+    def test_write_bounded_memory(self):
+        with open(self.root / "big.txt", "wb") as f:
+            for i in range(32):
+                f.write(bytes(range(256)) * 4096)
+        tracemalloc.start()
+        try:
+            self.sqlar.write(self.root / "big.txt", "big.txt")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 4 * 1024 * 1024)
+        self.assertEqual(self.sqlar.getinfo("big.txt")[3], 32 * 1024 * 1024)
+
+
+class SQLiteArchiveAddFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        (self.root / "dir").mkdir()
+        self.files = {}
+        for i in range(20):
+            data = b"file %d\n" % i * (i * 100)
+            (self.root / "dir" / "{}.txt".format(i)).write_bytes(data)
+            self.files["dir/{}.txt".format(i)] = data
+
+    def test_add_files(self):
+        items = [(self.root / "dir", "dir")]
+        items += [(self.root / name, name) for name in self.files]
+        with archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED) as ar:
+            ar.add_files(items, workers=4)
+            self.assertEqual(
+                [name for name, in ar.sql("SELECT name FROM sqlar ORDER BY rowid")],
+                ["dir"] + list(self.files)
+            )
+            for name, data in self.files.items():
+                self.assertEqual(ar.read(name), data)
+
+    def test_add_files_replaces(self):
+        name = "dir/1.txt"
+        with archive.SQLiteArchive(":memory:") as ar:
+            ar.writestr(name, b"old")
+            ar.add_files([(self.root / name, name)], workers=1)
+            self.assertEqual(ar.read(name), self.files[name])
+
+
+class SQLiteArchiveBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED)
+
+    def tearDown(self):
+        self.sqlar.close()
+
+    def test_batch_single_transaction(self):
+        with self.sqlar.batch():
+            self.sqlar.writestr("a.txt", "a")
+            self.assertTrue(self.sqlar._conn.in_transaction)
+            with self.sqlar.batch():
+                self.sqlar.writestr("b.txt", "b")
+            self.assertTrue(self.sqlar._conn.in_transaction)
+        self.assertFalse(self.sqlar._conn.in_transaction)
+        self.assertEqual(self.sqlar.namelist(), ["a.txt", "b.txt"])
+
+    def test_batch_rollback(self):
+        with self.assertRaises(TestException):
+            with self.sqlar.batch():
+                self.sqlar.writestr("a.txt", "a")
+                raise TestException()
+        self.assertEqual(self.sqlar.sql("SELECT count(*) FROM sqlar"), [(0,)])
+
+    def test_writemany(self):
+        data = b"x" * 1000
+        self.sqlar.writemany(
+            [("a.txt", data), ("b.txt", "text", 0o644, 1578096131)]
+        )
+        self.assertEqual(self.sqlar.read("a.txt"), data)
+        self.assertEqual(
+            self.sqlar.sql("SELECT name, mode, mtime, sz FROM sqlar ORDER BY name"),
+            [("a.txt", 0o777, self.sqlar.getinfo("a.txt")[2], 1000), ("b.txt", 0o644, 1578096131, 4)]
+        )
+
+    def test_pragma_profile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "bulk.sqlar")
+            with archive.SQLiteArchive(filename, mode="rwc", pragmas="bulk") as ar:
+                self.assertEqual(ar.sql("PRAGMA page_size"), [(65536,)])
+                self.assertEqual(ar.sql("PRAGMA journal_mode"), [("wal",)])
+                self.assertEqual(ar.sql("PRAGMA synchronous"), [(1,)])
+
+    def test_pragma_profile_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "ro.sqlar")
+            with archive.SQLiteArchive(filename, mode="rwc") as ar:
+                ar.writestr("a.txt", b"data")
+            for mode, options in [("ro", {}), ("immutable", {}), ("ro", {"pooled": True})]:
+                with archive.SQLiteArchive(filename, mode=mode, pragmas="bulk", **options) as ar:
+                    self.assertEqual(ar.read("a.txt"), b"data")
+                    self.assertEqual(ar.sql("PRAGMA journal_mode"), [("delete",)])
+            self.assertEqual(sorted(os.listdir(tmp)), ["ro.sqlar"])
+
+
+class SQLiteArchiveListdirTestCase(unittest.TestCase):
+
+    NAMES = ["a", "a/b", "a/b/c.txt", "a/d.txt", "a0", "e.txt", "/abs", "/abs/f.txt"]
+
+    def fill(self, conn):
+        conn.executemany(
+            "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, 420, 0, 0, NULL)",
+            ((name,) for name in self.NAMES)
+        )
+
+    def check(self, ar):
+        self.assertEqual(ar.listdir(), ["a", "a0", "e.txt"])
+        self.assertEqual(ar.listdir("a"), ["a/b", "a/d.txt"])
+        self.assertEqual(ar.listdir("a/b/"), ["a/b/c.txt"])
+        self.assertEqual(ar.listdir("a/b/c.txt"), [])
+        self.assertEqual(ar.listdir("/"), ["/abs"])
+        self.assertEqual(ar.listdir("/abs"), ["/abs/f.txt"])
+
+    def test_listdir(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            with ar._conn as conn:
+                self.fill(conn)
+            self.check(ar)
+            plan = ar.sql("EXPLAIN QUERY PLAN SELECT name FROM sqlar WHERE parent = 'a'")
+            self.assertIn("sqlar_parent", plan[0][3])
+
+    def test_scandir(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            with ar._conn as conn:
+                self.fill(conn)
+            ar.writestr("a/z.txt", "z", mtime=0)
+            self.assertEqual(
+                [row[:6] for row in ar.scandir("a")],
+                [("a/b", 420, 0, 0, 1, 0), ("a/d.txt", 420, 0, 0, 1, 0), ("a/z.txt", 0o777, 0, 1, 0, 0)]
+            )
+            self.assertEqual([row[0] for row in ar.scandir("a", limit=2)], ["a/b", "a/d.txt"])
+            self.assertEqual([row[0] for row in ar.scandir("a", after="a/d.txt")], ["a/z.txt"])
+            self.assertEqual([row[0] for row in ar.scandir("a", offset=1, limit=1)], ["a/d.txt"])
+
+    def test_listdir_dedup(self):
+        with archive.SQLiteArchive(":memory:", dedup=True) as ar:
+            with ar._conn as conn:
+                self.fill(conn)
+            self.check(ar)
+            ar.writestr("a/z.txt", "z", mtime=0)
+            self.assertEqual(
+                [row[:6] for row in ar.scandir("a")],
+                [("a/b", 420, 0, 0, 1, 0), ("a/d.txt", 420, 0, 0, 1, 0), ("a/z.txt", 0o777, 0, 1, 0, 0)]
+            )
+
+    def test_migration(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "old.sqlar")
+            with sqlite3.connect(filename) as conn:
+                conn.execute(archive._SQLAR_TABLE_SCHEMA)
+                self.fill(conn)
+            conn.close()
+            with archive.SQLiteArchive(filename) as ar:
+                self.assertFalse(ar._has_parent)
+                self.check(ar)
+            with archive.SQLiteArchive(filename, mode="rw") as ar:
+                self.assertTrue(ar._has_parent)
+                self.check(ar)
+
+    def test_metadata_indexes(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            with ar._conn as conn:
+                self.fill(conn)
+                conn.execute(
+                    "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES ('link', 420, 0, -1, 'a')"
+                )
+            ar.writestr("a/empty.txt", b"", mtime=0)
+            ar.writestr("a/big.bin", bytes(100000), mtime=0)
+            self.assertEqual(
+                [row[:6] for row in ar.infolist() if row[0].startswith(("a/", "link"))],
+                [("a/b", 420, 0, 0, 1, 0), ("a/b/c.txt", 420, 0, 0, 1, 0),
+                 ("a/big.bin", 0o777, 0, 100000, 0, 0), ("a/d.txt", 420, 0, 0, 1, 0),
+                 ("a/empty.txt", 0o777, 0, 0, 0, 0), ("link", 420, 0, -1, 0, 1)]
+            )
+            self.assertEqual(ar.getinfo("a/big.bin")[:6], ("a/big.bin", 0o777, 0, 100000, 0, 0))
+            select_list = ", ".join(ar._fieldlist(calc=True))
+            for where in ("", " WHERE name = 'a'", " WHERE parent = 'a'"):
+                plan = ar.sql("EXPLAIN QUERY PLAN SELECT {} FROM {}{}".format(
+                    select_list,
+                    ar._metadata_source(),
+                    where
+                ))
+                self.assertRegex(plan[0][3], "USING (COVERING )?INDEX sqlar_(meta|parent)")
+
+    def test_metadata_index_migration(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "old.sqlar")
+            with sqlite3.connect(filename) as conn:
+                conn.execute(archive._SQLAR_TABLE_SCHEMA)
+                conn.execute(
+                    "ALTER TABLE sqlar ADD COLUMN parent TEXT GENERATED ALWAYS AS ({}) VIRTUAL".format(
+                        archive._SQLAR_PARENT
+                    )
+                )
+                conn.execute("CREATE INDEX sqlar_parent ON sqlar(parent, name)")
+                self.fill(conn)
+            conn.close()
+            with archive.SQLiteArchive(filename) as ar:
+                self.assertFalse(ar._has_metadata_index)
+                self.check(ar)
+            with archive.SQLiteArchive(filename, mode="rw") as ar:
+                self.assertTrue(ar._has_metadata_index)
+                self.assertEqual(
+                    [column for _, _, column in ar.sql("PRAGMA index_info('sqlar_parent')")],
+                    ["parent", "name", "mode", "mtime", "sz", "atime", "ctime"]
+                )
+                self.check(ar)
+
+
+class SQLiteArchivePatchTestCase(unittest.TestCase):
+
+    def test_patch(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            ar.writestr("f", b"hello world")
+            statements = []
+            ar._conn.set_trace_callback(statements.append)
+            self.assertTrue(ar.patch("f", [(0, b"J"), (6, b"W")]))
+            ar._conn.set_trace_callback(None)
+            self.assertEqual(ar.read("f"), b"Jello World")
+            # The content is written through a blob handle, not in SQL
+            self.assertFalse([s for s in statements if "Jello" in s])
+
+    def test_patch_resizes(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            ar.writestr("f", b"hello world")
+            self.assertTrue(ar.patch("f", [(11, b"!")], size=14, mtime=5))
+            self.assertEqual(ar.read("f"), b"hello world!\0\0")
+            self.assertEqual(ar.getinfo("f")[2:4], (5, 14))
+            self.assertTrue(ar.patch("f", [], size=5))
+            self.assertEqual(ar.read("f"), b"hello")
+
+    def test_patch_not_stored(self):
+        with archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED) as ar:
+            ar.writestr("f", b"x" * 1000)
+            self.assertFalse(ar.patch("f", [(0, b"y")]))
+            self.assertEqual(ar.read("f"), b"x" * 1000)
+            with self.assertRaises(KeyError):
+                ar.patch("missing", [])
+
+
+class SQLiteArchiveAppendSegmentTestCase(unittest.TestCase):
+
+    def append(self, ar, count):
+        ar.writestr("log", b"x" * 100000)
+        for i in range(count):
+            ar.writestr("log", b"line %d\n" % i, mode="ab")
+        return b"x" * 100000 + b"".join(b"line %d\n" % i for i in range(count))
+
+    def test_append_segments(self):
+        with archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED, append_segments=True) as ar:
+            expected = self.append(ar, 10)
+            self.assertEqual(ar.sql("SELECT count(*) FROM sqlar_append"), [(11,)])
+            self.assertEqual(ar.getinfo("log")[3], len(expected))
+            self.assertEqual(ar.read("log"), expected)
+            self.assertEqual(ar.read("log", 100001, 100013), b"line 0\nline 1")
+            with ar.open("log") as f:
+                f.seek(-7, io.SEEK_END)
+                self.assertEqual(f.read(), b"line 9\n")
+
+    def test_append_does_not_copy_member(self):
+        with archive.SQLiteArchive(":memory:", append_segments=True) as ar:
+            self.append(ar, 1)
+            statements = []
+            ar._conn.set_trace_callback(statements.append)
+            ar.writestr("log", b"more", mode="ab")
+            ar._conn.set_trace_callback(None)
+            # Only the segment and the small sqlar row are written
+            self.assertFalse([s for s in statements if "SELECT name, 0" in s])
+            self.assertEqual(ar.read("log")[-4:], b"more")
+
+    def test_compact(self):
+        with archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED, append_segments=True) as ar:
+            expected = self.append(ar, 5)
+            ar.writestr("other", b"data")
+            self.assertEqual(ar.compact(), 1)
+            self.assertEqual(ar.compact(), 0)
+            self.assertEqual(ar.sql("SELECT count(*) FROM sqlar_append"), [(0,)])
+            # A standard member again
+            size, length = ar.sql("SELECT sz, length(data) FROM sqlar WHERE name = 'log'")[0]
+            self.assertEqual(size, len(expected))
+            self.assertLess(length, size)
+            self.assertEqual(ar.read("log"), expected)
+
+    def test_segments_follow_member(self):
+        with archive.SQLiteArchive(":memory:", append_segments=True) as ar:
+            expected = self.append(ar, 2)
+            ar.copy("log", "copy")
+            ar.move("log", "moved")
+            self.assertEqual(ar.read("copy"), expected)
+            self.assertEqual(ar.read("moved"), expected)
+            ar.writestr("copy", b"new")
+            self.assertEqual(ar.sql("SELECT DISTINCT name FROM sqlar_append"), [("moved",)])
+            ar.delete_prefix("moved")
+            self.assertEqual(ar.sql("SELECT count(*) FROM sqlar_append"), [(0,)])
+
+    def test_append_rewrites_by_default(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "append.sqlar")
+            with archive.SQLiteArchive(filename, mode="rwc", append_segments=True) as ar:
+                expected = self.append(ar, 2)
+            with archive.SQLiteArchive(filename, mode="rw") as ar:
+                ar.writestr("log", b"more", mode="ab")
+                self.assertEqual(ar.sql("SELECT count(*) FROM sqlar_append"), [(0,)])
+                self.assertEqual(ar.read("log"), expected + b"more")
+            # Readable without the segments
+            with sqlite3.connect(filename) as conn:
+                self.assertEqual(
+                    conn.execute("SELECT data FROM sqlar WHERE name = 'log'").fetchone(),
+                    (expected + b"more",)
+                )
+
+    def test_compact_blocks_appends(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = str(Path(tmp) / "append.sqlar")
+            ar = archive.SQLiteArchive(filename, mode="rwc", append_segments=True)
+            self.addCleanup(ar.close)
+            expected = self.append(ar, 3)
+
+            def append():
+                with archive.SQLiteArchive(filename, mode="rw", append_segments=True) as other:
+                    other.writestr("log", b"late\n", mode="ab")
+
+            spool_member = archive._spool_member
+            appending = ThreadPoolExecutor(1)
+            self.addCleanup(appending.shutdown)
+            appended = []
+
+            def spool_and_append(*args):
+                # Another connection appends while the segments are read
+                appended.append(appending.submit(append))
+                with self.assertRaises(TimeoutError):
+                    appended[0].result(timeout=0.2)
+                return spool_member(*args)
+
+            with patch("pysqlar.archive._spool_member", spool_and_append):
+                self.assertEqual(ar.compact(), 1)
+            appended[0].result(timeout=5)
+            self.assertEqual(ar.read("log"), expected + b"late\n")
+            self.assertEqual(ar.getinfo("log")[3], len(expected) + 5)
+
+
+class SQLiteArchiveItertreeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(":memory:")
+        self.addCleanup(self.sqlar.close)
+        for name in ("dir", "dir/sub", "dir.old"):
+            self.sqlar.sql("INSERT INTO sqlar(name, mode, mtime, sz) VALUES (?, 493, 0, 0)", name)
+        self.sqlar.writemany([
+            ("dir/sub/b.txt", b"b"),
+            ("dir/a.py", b"a"),
+            ("dir/sub/c.py", b"c"),
+            ("dir.old/d.py", b"d"),
+            ("top.py", b"t"),
+        ])
+
+    def names(self, *args, **kwargs):
+        return [row[0] for row in self.sqlar.itertree(*args, **kwargs)]
+
+    def test_sorted_by_directory(self):
+        self.assertEqual(
+            self.names("dir"),
+            ["dir/a.py", "dir/sub", "dir/sub/b.txt", "dir/sub/c.py"]
+        )
+        self.assertEqual(
+            self.names(),
+            ["dir", "dir.old", "top.py", "dir/a.py", "dir/sub", "dir.old/d.py",
+             "dir/sub/b.txt", "dir/sub/c.py"]
+        )
+
+    def test_max_depth(self):
+        self.assertEqual(self.names("dir", max_depth=1), ["dir/a.py", "dir/sub"])
+        self.assertEqual(self.names(max_depth=1), ["dir", "dir.old", "top.py"])
+
+    def test_patterns_select_files(self):
+        self.assertEqual(
+            self.names("dir", patterns=["*.py"]),
+            ["dir/a.py", "dir/sub", "dir/sub/c.py"]
+        )
+
+    def test_single_query(self):
+        statements = []
+        self.sqlar._conn.set_trace_callback(statements.append)
+        self.names("dir", max_depth=2, patterns=["*.py"])
+        self.sqlar._conn.set_trace_callback(None)
+        self.assertEqual(len(statements), 1)
+        # Streamed from the parent index, without sorting
+        plan = self.sqlar._conn.execute("EXPLAIN QUERY PLAN " + statements[0]).fetchall()
+        self.assertIn("sqlar_parent", str(plan))
+        self.assertNotIn("TEMP B-TREE", str(plan))
+
+
+class SQLiteArchiveIterinfoTestCase(unittest.TestCase):
+
+    NAMES = ["a", "ab", "a/b", "a/b/c.c", "src/x.c", "src/y/z.c", "src/y/z.h",
+             "[x]", "^a", "a[b", "]x", "a\nb", "\u00e9/\u00fc.c", "a-b", "a*b"]
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(":memory:")
+        self.addCleanup(self.sqlar.close)
+        self.sqlar.writemany((name, b"") for name in self.NAMES)
+
+    def test_matches_fnmatch(self):
+        patterns = ["*", "a*", "*.c", "src/**/*.c", "[!a]*", "[^a]*", "a[", "[]]x",
+                    "[a-]*", "?", "a?b", "[*]*", "*[!c]", "\u00e9/*", "src/y/z.[ch]"]
+        for pattern in patterns:
+            with self.subTest(pattern=pattern):
+                regex = re.compile(fnmatch.translate(pattern))
+                self.assertEqual(
+                    sorted(row[0] for row in self.sqlar.iterinfo([pattern])),
+                    sorted(name for name in self.NAMES if regex.match(name))
+                )
+
+    def test_several_patterns(self):
+        self.assertEqual(
+            sorted(row[0] for row in self.sqlar.iterinfo(["*.c", "src/*"])),
+            ["a/b/c.c", "src/x.c", "src/y/z.c", "src/y/z.h", "\u00e9/\u00fc.c"]
+        )
+        self.assertEqual(len(list(self.sqlar.iterinfo())), len(self.NAMES))
+
+    def test_pages(self):
+        rows = []
+        after = None
+        while True:
+            page = list(self.sqlar.iterinfo(["a*", "src/*"], after=after, limit=2))
+            rows += page
+            if len(page) < 2:
+                break
+            after = page[-1][0]
+        regex = re.compile("|".join(fnmatch.translate(p) for p in ["a*", "src/*"]))
+        self.assertEqual(
+            [row[0] for row in rows],
+            sorted(name for name in self.NAMES if regex.match(name))
+        )
+
+    def test_prefix_uses_index(self):
+        condition, args = archive._pattern_condition("src/*.c")
+        plan = self.sqlar.sql(
+            "EXPLAIN QUERY PLAN SELECT name FROM sqlar WHERE " + condition, *args
+        )
+        self.assertIn("INDEX", plan[0][3])
+
+
+class SQLiteArchiveMetadataCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = str(Path(tmp.name) / "cache.sqlar")
+        self.sqlar = archive.SQLiteArchive(self.filename, mode="rwc", metadata_cache=2)
+        self.addCleanup(self.sqlar.close)
+        self.sqlar.writestr("a.txt", "a", mtime=0)
+
+    def test_hits(self):
+        self.assertEqual(self.sqlar.getinfo("a.txt")[:4], ("a.txt", 0o777, 0, 1))
+        self.assertEqual(self.sqlar.getinfo("a.txt")[:4], ("a.txt", 0o777, 0, 1))
+        self.assertIsNone(self.sqlar.getinfo("missing"))
+        self.assertIsNone(self.sqlar.getinfo("missing"))
+        self.assertEqual(self.sqlar.metadata_cache_info(), archive.CacheInfo(2, 2, 2, 2))
+
+    def test_eviction(self):
+        for name in ("a.txt", "b", "c", "a.txt"):
+            self.sqlar.getinfo(name)
+        self.assertEqual(self.sqlar.metadata_cache_info().misses, 4)
+
+    def test_invalidated_by_write(self):
+        self.assertIsNone(self.sqlar.getinfo("b.txt"))
+        self.sqlar.writestr("b.txt", "bb")
+        self.assertEqual(self.sqlar.getinfo("b.txt")[3], 2)
+        self.sqlar.sql("DELETE FROM sqlar WHERE name = 'b.txt'")
+        self.assertIsNone(self.sqlar.getinfo("b.txt"))
+
+    def test_invalidated_by_other_connection(self):
+        self.assertEqual(self.sqlar.getinfo("a.txt")[3], 1)
+        with archive.SQLiteArchive(self.filename, mode="rw") as other:
+            other.writestr("a.txt", "aaa")
+        self.assertEqual(self.sqlar.getinfo("a.txt")[3], 3)
+
+    def test_disabled(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            self.assertIsNone(ar.metadata_cache_info())
+
+
+class SQLiteArchiveContentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sqlar = archive.SQLiteArchive(
+            ":memory:",
+            compression=archive.SQLAR_DEFLATED,
+            content_cache=3000
+        )
+        self.addCleanup(self.sqlar.close)
+        self.data = b"Hello World!" * 100
+        self.sqlar.writestr("a.txt", self.data)
+
+    def test_hits(self):
+        self.assertEqual(self.sqlar.read("a.txt"), self.data)
+        self.assertEqual(self.sqlar.read("a.txt", 7, 12), b"World!")
+        self.assertIsNone(self.sqlar.read("missing"))
+        info = self.sqlar.content_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, len(self.data)))
+
+    def test_readview(self):
+        view = self.sqlar.readview("a.txt")
+        self.assertTrue(view.readonly)
+        self.assertEqual(view, self.data)
+        self.assertIs(self.sqlar.readview("a.txt").obj, view.obj)
+        self.assertIsNone(self.sqlar.readview("missing"))
+
+    def test_readview_disabled(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            ar.writestr("a.txt", "Hello")
+            self.assertEqual(ar.readview("a.txt"), b"Hello")
+            self.assertIsNone(ar.content_cache_info())
+
+    def test_invalidated_by_write(self):
+        self.sqlar.read("a.txt")
+        self.sqlar.writestr("a.txt", "changed")
+        self.assertEqual(self.sqlar.read("a.txt"), b"changed")
+
+    def test_byte_budget(self):
+        self.sqlar.writestr("b.txt", b"b" * 1500)
+        self.sqlar.writestr("big.txt", b"c" * 4000)
+        self.sqlar.read("a.txt")
+        self.sqlar.read("b.txt")
+        self.assertEqual(self.sqlar.content_cache_info().currsize, 2700)
+        self.assertEqual(self.sqlar.read("big.txt"), b"c" * 4000)
+        self.assertEqual(self.sqlar.content_cache_info().currsize, 2700)
+        self.sqlar.writestr("b2.txt", b"b" * 1500)
+        self.sqlar.read("a.txt")
+        self.sqlar.read("b.txt")
+        # a.txt is the least recently used and makes room for b2.txt.
+        self.sqlar.read("b2.txt")
+        self.assertEqual(self.sqlar.content_cache_info().currsize, 3000)
+
+
+class SQLiteArchivePooledTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = str(Path(tmp.name) / "pooled.sqlar")
+        self.sqlar = archive.SQLiteArchive(
+            self.filename,
+            mode="rwc",
+            compression=archive.SQLAR_DEFLATED,
+            metadata_cache=16,
+            content_cache=1 << 20,
+            pooled=True
+        )
+        self.addCleanup(self.sqlar.close)
+        self.sqlar.writemany(("f{}".format(i), "data {}".format(i) * 100) for i in range(20))
+
+    def test_wal(self):
+        self.assertEqual(self.sqlar.sql("PRAGMA journal_mode"), [("wal",)])
+
+    def test_memory(self):
+        with self.assertRaises(ValueError):
+            archive.SQLiteArchive(":memory:", pooled=True)
+
+    def test_threads(self):
+        def work(i):
+            name = "f{}".format(i % 20)
+            self.assertEqual(self.sqlar.read(name), "data {}".format(i % 20).encode() * 100)
+            self.assertEqual(self.sqlar.getinfo(name)[0], name)
+            with self.sqlar.open(name) as f:
+                self.assertEqual(f.read(5), b"data ")
+            self.sqlar.writestr("new/{}".format(i), str(i))
+            return self.sqlar.read("new/{}".format(i))
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(work, range(100)))
+        self.assertEqual(results, [str(i).encode() for i in range(100)])
+        self.assertEqual(len(self.sqlar.listdir("new")), 100)
+        self.assertLessEqual(len(self.sqlar._readers), 5)
+
+    def test_open_member_doesnt_pin_reads(self):
+        self.assertIsNone(self.sqlar.getinfo("new"))
+        with self.sqlar.open("f0") as f:
+            self.assertEqual(f.read(6), b"data 0")
+            self.sqlar.writestr("new", "new")
+            self.assertEqual(self.sqlar.read("new"), b"new")
+            self.assertEqual(self.sqlar.getinfo("new")[3], 3)
+            self.assertEqual(f.read(6), b"data 0")
+        self.assertEqual(self.sqlar.getinfo("new")[3], 3)
+
+    def test_readers_of_finished_threads_are_reused(self):
+        for i in range(20):
+            thread = threading.Thread(target=self.sqlar.read, args=("f{}".format(i),))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(self.sqlar._readers), 1)
+
+    def test_batch_isolation(self):
+        with ThreadPoolExecutor(1) as pool:
+            with self.sqlar.batch():
+                self.sqlar.writestr("f0", "changed")
+                self.assertEqual(self.sqlar.read("f0"), b"changed")
+                self.assertEqual(pool.submit(self.sqlar.read, "f0").result()[:6], b"data 0")
+            self.assertEqual(pool.submit(self.sqlar.read, "f0").result(), b"changed")
+
+    def test_extractall_snapshot(self):
+        decompress_row = archive._decompress_row
+        written = []
+
+        def decompress_and_write(*args):
+            # Writers on other threads aren't blocked by the extraction
+            if not written:
+                pool = ThreadPoolExecutor(1)
+                try:
+                    written.append(pool.submit(self.sqlar.writestr, "f19", "changed").result(timeout=5))
+                finally:
+                    pool.shutdown(wait=False)
+            return decompress_row(*args)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("pysqlar.archive._decompress_row", decompress_and_write):
+            self.sqlar.extractall(tmp, workers=1)
+            self.assertEqual((Path(tmp) / "f19").read_bytes()[:7], b"data 19")
+        self.assertEqual(self.sqlar.read("f19"), b"changed")
+
+    def test_rollback_not_cached(self):
+        with self.assertRaises(TestException):
+            with self.sqlar.batch():
+                self.sqlar.writestr("f0", "changed")
+                self.assertEqual(self.sqlar.getinfo("f0")[3], 7)
+                self.assertEqual(self.sqlar.read("f0"), b"changed")
+                raise TestException()
+        self.assertEqual(self.sqlar.getinfo("f0")[3], 600)
+        self.assertEqual(self.sqlar.read("f0")[:6], b"data 0")
+
+
+class SQLiteArchiveImmutableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = str(Path(tmp.name) / "published.sqlar")
+        with archive.SQLiteArchive(self.filename, mode="rwc", compression=archive.SQLAR_DEFLATED) as ar:
+            ar.writestr("dir/a.txt", "Hello World!" * 10, mtime=0)
+            ar.writestr("b.txt", "b", mtime=0)
+
+    def open(self, **kwargs):
+        sqlar = archive.SQLiteArchive(self.filename, mode="immutable", **kwargs)
+        self.addCleanup(sqlar.close)
+        return sqlar
+
+    def test_read(self):
+        sqlar = self.open(metadata_cache=8, content_cache=1024)
+        self.assertEqual(sqlar.mode, "immutable")
+        self.assertGreater(sqlar.sql("PRAGMA mmap_size")[0][0], 0)
+        for _ in range(2):
+            self.assertEqual(sqlar.read("dir/a.txt"), b"Hello World!" * 10)
+            self.assertEqual(sqlar.getinfo("b.txt")[:4], ("b.txt", 0o777, 0, 1))
+        self.assertEqual(sqlar.namelist(), ["b.txt", "dir/a.txt"])
+        self.assertEqual(sqlar.listdir("dir"), ["dir/a.txt"])
+        with sqlar.open("dir/a.txt") as f:
+            self.assertEqual(f.read(5), b"Hello")
+        with self.assertRaises(sqlite3.OperationalError):
+            sqlar.writestr("c.txt", "c")
+
+    def test_schema_checked_once(self):
+        with patch.object(archive, "_sqlar_table_exists", wraps=archive._sqlar_table_exists) as check:
+            self.open()
+            self.open()
+            self.assertEqual(check.call_count, 1)
+            with archive.SQLiteArchive(self.filename, mode="rw") as ar:
+                ar.writestr("c.txt", "changed")
+            self.assertEqual(self.open().read("c.txt"), b"changed")
+            # Checked again by the writer and for the modified file.
+            self.assertEqual(check.call_count, 3)
+
+    def test_not_an_archive(self):
+        with sqlite3.connect(self.filename) as conn:
+            conn.execute("DROP TABLE sqlar")
+        conn.close()
+        with self.assertRaises(archive.SQLiteArchiveException):
+            archive.SQLiteArchive(self.filename, mode="immutable")
+
+    def test_pooled(self):
+        sqlar = self.open(content_cache=1024, pooled=True)
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(sqlar.read, ["dir/a.txt", "b.txt"] * 20))
+        self.assertEqual(results, [b"Hello World!" * 10, b"b"] * 20)
+
+
+class SQLiteArchiveDedupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.filename = str(self.root / "dedup.sqlar")
+        self.sqlar = archive.SQLiteArchive(
+            self.filename,
+            mode="rwc",
+            compression=archive.SQLAR_DEFLATED,
+            dedup=True
+        )
+        self.addCleanup(self.sqlar.close)
+
+    def content(self):
+        return self.sqlar.sql("SELECT refs, length(data) FROM sqlar_content ORDER BY rowid")
+
+    def test_identical_content_stored_once(self):
+        data = b"Hello World!" * 100
+        self.sqlar.writestr("a.txt", data)
+        self.sqlar.writemany([("b.txt", data), ("c.txt", data, 0o644, 0)])
+        self.assertEqual(self.content(), [(3, len(zlib.compress(data)))])
+        self.assertEqual(self.sqlar.read("c.txt"), data)
+        self.assertEqual(self.sqlar.read("b.txt", 7, 12), b"World!")
+
+    def test_delete_reclaims_content(self):
+        self.sqlar.writestr("a.txt", "Hello World!")
+        self.sqlar.writestr("b.txt", "Hello World!")
+        self.sqlar.sql("DELETE FROM sqlar WHERE name = ?", "a.txt")
+        self.assertEqual(self.content(), [(1, 12)])
+        self.sqlar.sql("DELETE FROM sqlar WHERE name = ?", "b.txt")
+        self.assertEqual(self.content(), [])
+
+    def test_replace_releases_old_content(self):
+        self.sqlar.writestr("a.txt", "Hello World!")
+        self.sqlar.writestr("a.txt", "Goodbye World!")
+        self.assertEqual(self.content(), [(1, 14)])
+        self.assertEqual(self.sqlar.read("a.txt"), b"Goodbye World!")
+
+    def test_content_deleted_while_writing(self):
+        data = b"Hello World!" * 100
+        big = os.urandom(2 * 1024 * 1024)
+        (self.root / "b.txt").write_bytes(data)
+        (self.root / "c.bin").write_bytes(big)
+        self.sqlar.writestr("a.txt", data)
+        self.sqlar.writestr("c.bin", big)
+        has_content = self.sqlar._has_content
+
+        def deleted_after_check(digest):
+            found = has_content(digest)
+            with archive.SQLiteArchive(self.filename, mode="rw") as other:
+                other.sql("DELETE FROM sqlar_entry WHERE digest = ?", digest)
+            return found
+
+        with patch.object(self.sqlar, "_has_content", side_effect=deleted_after_check):
+            self.sqlar.write(self.root / "b.txt", "b.txt")
+            self.sqlar.write(self.root / "c.bin", "b.bin")
+        self.assertEqual(self.content(), [(1, len(zlib.compress(data))), (1, len(big))])
+        self.assertEqual(self.sqlar.namelist(), ["b.bin", "b.txt"])
+        self.assertEqual(self.sqlar.read("b.txt"), data)
+        with self.sqlar.open("b.bin") as f:
+            self.assertEqual(f.read(), big)
+
+    def test_sql_through_view(self):
+        data = b"Hello World!" * 100
+        self.sqlar.writestr("a.txt", data)
+        self.sqlar.sql(
+            "INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES (?, ?, ?, ?, ?)",
+            "b.txt", 0o644, 0, len(data), data
+        )
+        self.sqlar.sql("INSERT INTO sqlar(name, mode, mtime, sz) VALUES ('dir', 493, 0, 0)")
+        self.sqlar.sql("UPDATE sqlar SET mode = 420 WHERE name = 'a.txt'")
+        self.assertEqual(self.content(), [(2, len(zlib.compress(data)))])
+        self.assertEqual(
+            self.sqlar.sql("SELECT name, mode, sz FROM sqlar ORDER BY name"),
+            [("a.txt", 420, len(data)), ("b.txt", 420, len(data)), ("dir", 493, 0)]
+        )
+        self.assertEqual(self.sqlar.read("b.txt"), data)
+
+    def test_write_files(self):
+        data = os.urandom(2 * 1024 * 1024)
+        for name in ("a.bin", "b.bin"):
+            (self.root / name).write_bytes(data)
+        (self.root / "small.txt").write_bytes(b"small")
+        self.sqlar.add_files([str(self.root / "a.bin"), (str(self.root / "small.txt"), "small.txt")])
+        self.sqlar.write(self.root / "b.bin", "b.bin")
+        with self.sqlar.open("c.bin", "w") as f:
+            f.write(data)
+        self.assertEqual(self.content(), [(3, len(data)), (1, 5)])
+        with self.sqlar.open("b.bin") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_extractall(self):
+        self.sqlar.writestr("a/a.txt", "Hello World!")
+        self.sqlar.writestr("b/b.txt", "Hello World!")
+        self.sqlar.extractall(self.root / "out")
+        self.assertEqual((self.root / "out" / "b" / "b.txt").read_bytes(), b"Hello World!")
+
+    def test_reopen(self):
+        self.sqlar.writestr("a.txt", "Hello World!")
+        self.sqlar.close()
+        self.assertTrue(archive.is_sqlar(self.filename))
+        with archive.SQLiteArchive(self.filename) as ar:
+            self.assertTrue(ar.dedup)
+            self.assertEqual(ar.read("a.txt"), b"Hello World!")
+        with sqlite3.connect(self.filename) as conn:
+            self.assertEqual(
+                conn.execute("SELECT name, sz, data FROM sqlar").fetchall(),
+                [("a.txt", 12, b"Hello World!")]
+            )
+
+    def test_not_deduplicated(self):
+        filename = str(self.root / "plain.sqlar")
+        archive.SQLiteArchive(filename, mode="rwc").close()
+        with self.assertRaises(archive.SQLiteArchiveException):
+            archive.SQLiteArchive(filename, mode="rw", dedup=True)
+
+    def test_chunked_rejected(self):
+        with self.assertRaises(ValueError):
+            archive.SQLiteArchive(":memory:", dedup=True, chunk_size=1024)
+        with self.assertRaises(ValueError):
+            self.sqlar.writestr("a.txt", "Hello World!", chunk_size=4)
+
+
 class TestException(Exception):
     pass
 
 
+class SQLiteArchiveMoveCopyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = str(Path(tmp.name) / "move.sqlar")
+
+    def populate(self, ar):
+        ar.sql("INSERT INTO sqlar(name, mode, mtime, sz) VALUES ('dir', 493, 0, 0)")
+        ar.sql("INSERT INTO sqlar(name, mode, mtime, sz) VALUES ('dir/sub', 493, 0, 0)")
+        ar.writestr("dir/a.txt", b"a" * 1000, mtime=1)
+        ar.writestr("dir/sub/b.txt", b"b" * 1000, mtime=2)
+        ar.writestr("dir.txt", b"not inside dir")
+
+    def test_move_directory(self):
+        with archive.SQLiteArchive(self.filename, "rwc", compression=archive.SQLAR_DEFLATED) as ar:
+            self.populate(ar)
+            blob = ar.sql("SELECT data FROM sqlar WHERE name = 'dir/a.txt'")
+            self.assertEqual(ar.move("dir", "moved"), 4)
+            self.assertEqual(
+                sorted(ar.namelist()),
+                ["dir.txt", "moved", "moved/a.txt", "moved/sub", "moved/sub/b.txt"]
+            )
+            self.assertEqual(ar.listdir("moved/sub"), ["moved/sub/b.txt"])
+            self.assertEqual(ar.sql("SELECT data FROM sqlar WHERE name = 'moved/a.txt'"), blob)
+            self.assertEqual(ar.getinfo("moved/sub/b.txt")[:4], ("moved/sub/b.txt", 0o777, 2, 1000))
+
+    def test_move_existing(self):
+        with archive.SQLiteArchive(self.filename, "rwc") as ar:
+            self.populate(ar)
+            ar.writestr("other/a.txt", b"replaced")
+            ar.writestr("other/c.txt", b"kept")
+            with self.assertRaises(sqlite3.IntegrityError):
+                ar.move("dir", "other")
+            self.assertEqual(len(ar.listdir("dir")), 2)
+            ar.move("dir", "other", replace=True)
+            self.assertEqual(ar.read("other/a.txt"), b"a" * 1000)
+            self.assertEqual(ar.read("other/c.txt"), b"kept")
+            self.assertIsNone(ar.getinfo("dir"))
+
+    def test_move_into_itself(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            self.populate(ar)
+            with self.assertRaises(ValueError):
+                ar.move("dir", "dir/sub/dir")
+            with self.assertRaises(ValueError):
+                ar.copy("dir/sub", "dir")
+            self.assertEqual(ar.move("dir", "dir"), 0)
+
+    def test_copy_directory(self):
+        with archive.SQLiteArchive(self.filename, "rwc", compression=archive.SQLAR_DEFLATED) as ar:
+            self.populate(ar)
+            self.assertEqual(ar.copy("dir", "copy", mtime=5), 4)
+            self.assertEqual(ar.read("copy/sub/b.txt"), b"b" * 1000)
+            self.assertEqual(ar.read("dir/sub/b.txt"), b"b" * 1000)
+            self.assertEqual(ar.getinfo("copy/a.txt")[:4], ("copy/a.txt", 0o777, 5, 1000))
+            self.assertEqual(ar.getinfo("dir/a.txt")[2], 1)
+            self.assertTrue(ar.getinfo("copy/sub")[4])
+            self.assertEqual(len(ar.namelist()), 9)
+
+    def test_copy_chunked(self):
+        with archive.SQLiteArchive(":memory:", chunk_size=100) as ar:
+            ar.writestr("dir/chunked", b"0123456789" * 50)
+            ar.copy("dir", "copy")
+            self.assertEqual(ar.read("copy/chunked", 101, 110), b"0123456789")
+            ar.move("copy", "moved")
+            self.assertEqual(ar.read("moved/chunked"), b"0123456789" * 50)
+            self.assertEqual(ar.sql("SELECT count(*) FROM sqlar_chunk"), [(10,)])
+
+    def test_copy_deduplicated(self):
+        with archive.SQLiteArchive(self.filename, "rwc", dedup=True) as ar:
+            self.populate(ar)
+            ar.copy("dir", "copy")
+            ar.copy("dir/a.txt", "copy/a.txt", replace=True)
+            self.assertEqual(
+                ar.sql("SELECT refs FROM sqlar_content ORDER BY rowid"),
+                [(2,), (2,), (1,)]
+            )
+            ar.move("copy", "moved")
+            ar.sql("DELETE FROM sqlar WHERE name LIKE 'dir/%'")
+            self.assertEqual(ar.read("moved/sub/b.txt"), b"b" * 1000)
+            self.assertEqual(ar.sql("SELECT refs FROM sqlar_content ORDER BY rowid"), [(1,), (1,), (1,)])
+
+
+class SQLiteArchiveDeletePrefixTestCase(unittest.TestCase):
+
+    def populate(self, ar):
+        ar.writemany([("dir/a", b"a"), ("dir/sub/b", b"b"), ("dir.txt", b"c"), ("dirt", b"d")])
+
+    def test_delete_prefix(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            self.populate(ar)
+            statements = []
+            ar._conn.set_trace_callback(statements.append)
+            self.assertEqual(ar.delete_prefix("dir/"), 2)
+            ar._conn.set_trace_callback(None)
+            self.assertEqual(len([s for s in statements if s.startswith("DELETE")]), 1)
+            self.assertEqual(sorted(ar.namelist()), ["dir.txt", "dirt"])
+            self.assertEqual(ar.delete_prefix("dir"), 2)
+            self.assertEqual(ar.namelist(), [])
+
+    def test_delete_prefix_chunked(self):
+        with archive.SQLiteArchive(":memory:", chunk_size=10) as ar:
+            ar.writestr("dir/chunked", b"x" * 100)
+            ar.writestr("other", b"x" * 100)
+            ar.delete_prefix("dir/")
+            self.assertEqual(ar.sql("SELECT DISTINCT name FROM sqlar_chunk"), [("other",)])
+
+    def test_delete_prefix_deduplicated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with archive.SQLiteArchive(str(Path(tmp) / "dedup.sqlar"), "rwc", dedup=True) as ar:
+                self.populate(ar)
+                ar.writestr("copy", b"a")
+                ar.delete_prefix("dir")
+                self.assertEqual(ar.namelist(), ["copy"])
+                self.assertEqual(ar.sql("SELECT refs, data FROM sqlar_content"), [(1, b"a")])
+
+    def test_has_members(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            self.populate(ar)
+            self.assertTrue(ar.has_members("dir/"))
+            self.assertTrue(ar.has_members("dir/sub/"))
+            self.assertFalse(ar.has_members("dir/sub/b/"))
+            self.assertFalse(ar.has_members("dirt/"))
+            self.assertTrue(ar.has_members(""))
+
+
 class SQLiteArchiveNoDataTestCase(unittest.TestCase):
 
     def test_write(self):
@@ -310,6 +1479,27 @@ class SQLiteArchiveNoDataTestCase(unittest.TestCase):
                 b"Hello World!"
             )
 
+    def test_writestr_deflated_size(self):
+        data = b"Hello World!" * 100
+        with archive.SQLiteArchive(":memory:", compression=archive.SQLAR_DEFLATED) as ar:
+            ar.writestr("test.txt", data)
+            self.assertEqual(ar.getinfo("test.txt")[3], len(data))
+            self.assertEqual(ar.read("test.txt"), data)
+
+    def test_writestr_only_touches_its_row(self):
+        with archive.SQLiteArchive(":memory:") as ar:
+            ar.sql("INSERT INTO sqlar(name, mode, mtime, sz, data) VALUES ('other', 438, 0, 22, x'00')")
+            ar.writestr("test.txt", "Hello World!")
+            self.assertEqual(ar.getinfo("other")[3], 22)
+
+    def test_writestr_append(self):
+        for compression in (archive.SQLAR_STORED, archive.SQLAR_DEFLATED):
+            with archive.SQLiteArchive(":memory:", compression=compression) as ar:
+                ar.writestr("test.txt", b"Hello " * 100)
+                ar.writestr("test.txt", b"World!", mode="ab")
+                self.assertEqual(ar.read("test.txt"), b"Hello " * 100 + b"World!")
+                self.assertEqual(ar.getinfo("test.txt")[3], 606)
+
     def test_context_manager(self):
         try:
             with archive.SQLiteArchive(":memory:") as ar:
@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import patch
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pysqlar import archive, service
+
+
+class ArchiveWriterServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = str(Path(tmp.name) / "service.sqlar")
+        self.address = str(Path(tmp.name) / "service.sock")
+        self.service = service.ArchiveWriterService(self.filename, self.address)
+        thread = threading.Thread(target=self.service.serve_forever, args=(0.01,))
+        thread.start()
+
+        def stop():
+            self.service.shutdown()
+            thread.join()
+            self.service.close()
+        self.addCleanup(stop)
+
+    def test_producers(self):
+        def produce(i):
+            with service.ArchiveWriterClient(
+                    self.address,
+                    compression=archive.SQLAR_DEFLATED) as client:
+                for j in range(50):
+                    client.writestr("p{}/{}.txt".format(i, j), "data {} {}".format(i, j) * 50, mtime=0)
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(produce, range(8)))
+
+        with archive.SQLiteArchive(self.filename) as ar:
+            self.assertEqual(len(ar.namelist()), 400)
+            self.assertEqual(ar.read("p7/49.txt"), b"data 7 49" * 50)
+            self.assertEqual(ar.getinfo("p3/0.txt")[:4], ("p3/0.txt", 0o777, 0, 400))
+            self.assertLess(ar.sql("SELECT length(data) FROM sqlar WHERE name = 'p3/0.txt'")[0][0], 400)
+
+    def test_flush(self):
+        with service.ArchiveWriterClient(self.address) as client:
+            client.writestr("a.txt", "a")
+            client.flush()
+            with archive.SQLiteArchive(self.filename) as ar:
+                self.assertEqual(ar.read("a.txt"), b"a")
+            client.writestr("a.txt", "replaced")
+            client.flush()
+            with archive.SQLiteArchive(self.filename) as ar:
+                self.assertEqual(ar.read("a.txt"), b"replaced")
+
+    def test_error(self):
+        with service.ArchiveWriterClient(self.address) as client:
+            with patch.object(self.service.archive, "_store_rows", side_effect=ValueError("broken")):
+                client.writestr("a.txt", "a")
+                with self.assertRaisesRegex(archive.SQLiteArchiveException, "broken"):
+                    client.flush()
+            client.writestr("b.txt", "b")
+            client.flush()
+        with archive.SQLiteArchive(self.filename) as ar:
+            self.assertEqual(ar.namelist(), ["b.txt"])
+
+    def test_error_only_for_its_client(self):
+        store_rows = self.service.archive._store_rows
+        storing, gate = threading.Event(), threading.Event()
+
+        def store_checked(rows):
+            storing.set()
+            gate.wait()
+            if any(row[0] == "bad" for row in rows):
+                raise ValueError("bad row")
+            store_rows(rows)
+
+        def send(name):
+            with service.ArchiveWriterClient(self.address) as client:
+                client.writestr(name, name)
+                client.flush()
+
+        with patch.object(self.service.archive, "_store_rows", side_effect=store_checked), \
+                ThreadPoolExecutor(3) as pool:
+            first = pool.submit(send, "first")
+            storing.wait(5)
+            # Both rows are committed in the same group
+            bad, good = pool.submit(send, "bad"), pool.submit(send, "good")
+            while self.service._queue.qsize() < 4:
+                time.sleep(0.001)
+            gate.set()
+            first.result(timeout=5)
+            good.result(timeout=5)
+            with self.assertRaisesRegex(archive.SQLiteArchiveException, "bad row"):
+                bad.result(timeout=5)
+        with archive.SQLiteArchive(self.filename) as ar:
+            self.assertEqual(sorted(ar.namelist()), ["first", "good"])
+
+    def test_close_while_flushing(self):
+        client = service.ArchiveWriterClient(self.address)
+        flushed = []
+
+        def produce():
+            with self.assertRaises(archive.SQLiteArchiveException):
+                for i in range(100000):
+                    client.writestr("f{}".format(i), "data")
+                    client.flush()
+                    flushed.append("f{}".format(i))
+
+        with ThreadPoolExecutor(1) as pool:
+            producing = pool.submit(produce)
+            while len(flushed) < 10:
+                time.sleep(0.001)
+            self.service.shutdown()
+            self.service.close()
+            producing.result(timeout=5)
+        with self.assertRaises(archive.SQLiteArchiveException):
+            client.close()
+        with archive.SQLiteArchive(self.filename) as ar:
+            self.assertLessEqual(set(flushed), set(ar.namelist()))
@@ -97,36 +97,44 @@ def delete_file(archive, file):
     archive.sql(f"DELETE FROM sqlar WHERE name=?", file)
 
 
-def _make_archive(archive, files):
-    with pysqlar.SQLiteArchive(archive, mode='rwc') as new_arch:
+def _make_archive(archive, files, jobs=1, dedup=False, compression=pysqlar.SQLAR_STORED, level=None):
+    with pysqlar.SQLiteArchive(archive, mode='rwc', pragmas='bulk', dedup=dedup,
+                               compression=compression, compress_level=level) as new_arch:
         try:
-            file: Path
-            for pattern in files:
-                for file in [Path(p) for p in glob(str(pattern), recursive=True)]:
-                    stat = file.stat()
-                    npath = os.path.normpath(str(file))
-                    prefix = re.match('^([.][.]/)+', npath)
-                    archive_filename = str(file)
-                    if prefix:
-                        archive_filename = npath[len(prefix.group(0)):]
-                    info = {
-                        'name': archive_filename,
-                        'mode': stat.st_mode,
-                        'mtime': stat.st_mtime,
-                        'sz': stat.st_size,
-                        'is_dir': file.is_dir(),
-                        'is_sym': None,
-                        'atime': stat.st_atime,
-                        'ctime': stat.st_ctime
-                    }
-                    f_info = SQLARFileInfo(**info)
-                    #f_info = SQLARFileInfo(archive_filename, stat.st_mode, stat.st_mtime, stat.st_size, file.is_dir())
-                    print(str(f_info))
-                    write(new_arch, str(file), archive_filename, file.is_dir())
+            new_arch.add_files(_archive_files(files), workers=jobs)
+            # The bulk profile switches to WAL, leave a plain single-file archive behind
+            new_arch.sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            new_arch.sql("PRAGMA journal_mode=DELETE")
         finally:
             new_arch.close()
 
 
+def _archive_files(files):
+    file: Path
+    for pattern in files:
+        for file in [Path(p) for p in glob(str(pattern), recursive=True)]:
+            stat = file.stat()
+            npath = os.path.normpath(str(file))
+            prefix = re.match('^([.][.]/)+', npath)
+            archive_filename = str(file)
+            if prefix:
+                archive_filename = npath[len(prefix.group(0)):]
+            info = {
+                'name': archive_filename,
+                'mode': stat.st_mode,
+                'mtime': stat.st_mtime,
+                'sz': stat.st_size,
+                'is_dir': file.is_dir(),
+                'is_sym': file.is_symlink(),
+                'atime': stat.st_atime,
+                'ctime': stat.st_ctime
+            }
+            f_info = SQLARFileInfo(**info)
+            #f_info = SQLARFileInfo(archive_filename, stat.st_mode, stat.st_mtime, stat.st_size, file.is_dir())
+            print(str(f_info))
+            yield str(file), archive_filename
+
+
 def extract_dir(name):
     path = Path(name)
     path.mkdir(parents=True, exist_ok=True)
@@ -175,16 +183,9 @@ def _new_sqlarinfo(archive: pysqlar.SQLiteArchive, *file) -> SQLARFileInfo:
     """
     Create a SQLARInfo object from file details
     :param archive: A SQLiteArchive object (from pysqlar)
+    :param file: A row from archive.infolist(), which includes is_dir and is_sym
     """
-    is_dir = False
-    is_sym = False
-    if file[3] == -1:
-        is_sym = True
-    elif file[3] == 0:
-        # Check if it's a directory
-        is_dir = path_is_dir(archive, file[0])
-    sqlarinfo = SQLARFileInfo(*file)
-    return sqlarinfo
+    return SQLARFileInfo(*file)
 
 
 def find_files(archive: pysqlar.SQLiteArchive, patterns, from_root=False):
@@ -194,11 +195,10 @@ def find_files(archive: pysqlar.SQLiteArchive, patterns, from_root=False):
         patterns = [patterns]
     if len(patterns) == 0:
         patterns = ['*']
-    for file in archive.infolist():
-        for pattern in patterns:
-            reobj = re.compile(('^' if from_root else '') + fnmatch.translate(str(pattern)))
-            if reobj.match(file[0]):
-                yield _new_sqlarinfo(archive, *file)
+    # Patterns are matched against the whole name by SQLite, from_root is
+    # implied.
+    for file in archive.iterinfo(patterns):
+        yield _new_sqlarinfo(archive, *file)
 
 
 def get_path_info(archive: pysqlar.SQLiteArchive, path):
@@ -228,9 +228,17 @@ def get_path_info(archive: pysqlar.SQLiteArchive, path):
 @click.option('-l', 'command', flag_value='list')
 @click.option('-x', 'command', flag_value='extract')
 @click.option('-w', 'width', default=80)
+@click.option('-j', 'jobs', default=1, type=click.IntRange(min=1),
+              help='Number of threads compressing files.')
+@click.option('-d', '--dedup', is_flag=True,
+              help='Create an archive storing identical files once.')
+@click.option('-z', '--deflate', is_flag=True,
+              help='Compress files with zlib deflate.')
+@click.option('--level', type=click.IntRange(1, 9), default=None,
+              help='Deflate compression level, by default zlib\'s.')
 @click.argument('archive', required=True, type=click.Path(path_type=Path, exists=False))
 @click.argument('files', required=False, type=click.Path(path_type=Path), nargs=-1)
-def cli(command, width, archive, files):
+def cli(command, width, jobs, dedup, deflate, level, archive, files):
     global console_width
     console_width = width
     if command == None:
@@ -238,7 +246,8 @@ def cli(command, width, archive, files):
             raise click.UsageError("No filenames provided.")
     if command == None:
         # Archive files
-        _make_archive(archive, files)
+        compression = pysqlar.SQLAR_DEFLATED if deflate else pysqlar.SQLAR_STORED
+        _make_archive(archive, files, jobs, dedup, compression, level)
     elif command == 'extract':
         _extract_files(archive, files)
     elif command == 'list':
@@ -0,0 +1,52 @@
+import os
+import unittest
+from click.testing import CliRunner
+from pathlib import Path
+from pysqlar import SQLiteArchive
+from sqlar import cli
+
+
+class TestCLIArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = CliRunner()
+        self.enterContext(self.runner.isolated_filesystem())
+        for i in range(20):
+            path = Path('src/dir{}'.format(i % 3)) / 'file{}.txt'.format(i)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes('line {}\n'.format(i).encode() * 1000 + os.urandom(100))
+
+    def members(self, archive):
+        with SQLiteArchive(archive) as ar:
+            return ar.sql("SELECT name, sz, data FROM sqlar WHERE data IS NOT NULL ORDER BY name")
+
+    def run_cli(self, *args):
+        result = self.runner.invoke(cli, list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def test_deflate_jobs(self):
+        self.run_cli('-z', '-j', '1', 'one.sqlar', 'src/**')
+        self.run_cli('-z', '-j', '4', 'four.sqlar', 'src/**')
+        members = self.members('one.sqlar')
+        self.assertEqual(len(members), 20)
+        self.assertEqual(members, self.members('four.sqlar'))
+        # Compressed, and the same content as the files
+        for name, size, data in members:
+            self.assertLess(len(data), size)
+        with SQLiteArchive('four.sqlar') as ar:
+            self.assertEqual(ar.read('src/dir1/file4.txt'), Path('src/dir1/file4.txt').read_bytes())
+
+    def test_stored_by_default(self):
+        self.run_cli('-j', '2', 'stored.sqlar', 'src/**')
+        for name, size, data in self.members('stored.sqlar'):
+            self.assertEqual(len(data), size)
+
+    def test_level(self):
+        self.run_cli('-z', '--level', '1', 'fast.sqlar', 'src/**')
+        self.run_cli('-z', '--level', '9', 'best.sqlar', 'src/**')
+        fast = sum(len(data) for _, _, data in self.members('fast.sqlar'))
+        best = sum(len(data) for _, _, data in self.members('best.sqlar'))
+        self.assertLessEqual(best, fast)
+
+
+unittest.main()